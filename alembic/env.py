@@ -30,6 +30,11 @@ target_metadata = HomestackDatabase._base.metadata
 # ... etc.
 compare_type=True
 
+# Point a run at another database with `alembic -x url=sqlite:////var/lib/homestack/homestack.db ...`
+url = context.get_x_argument(as_dictionary=True).get("url")
+if url:
+    config.set_main_option("sqlalchemy.url", url)
+
 
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
@@ -67,7 +72,9 @@ def run_migrations_online():
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
-            compare_type=True
+            compare_type=True,
+            # SQLite can't ALTER much, so autogenerate batch operations (which copy the table) for it
+            render_as_batch=connection.dialect.name == "sqlite"
         )
 
         with context.begin_transaction():
@@ -0,0 +1,73 @@
+"""Add pivot table primary keys, drop unused indexes
+
+Revision ID: 34a1ce541d8b
+Revises: 4c1d8e2f7a9b
+Create Date: 2026-10-17 23:33:45.731350
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '34a1ce541d8b'
+down_revision = '4c1d8e2f7a9b'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+from hsdb import migrations
+
+def pivot_table(name, left, right, primary_key=False):
+    """
+    Our pivot tables, before (or with `primary_key`, after) this revision. SQLite rebuilds
+    tables to alter them, and reflects them to find out how unless it's handed these, which
+    it can't do offline (--sql). Reflection also loses the primary key's name
+    """
+    constraints = [ sa.PrimaryKeyConstraint(left[0], right[0], name='pk_{}'.format(name)) ] if primary_key else []
+    return sa.Table(name, sa.MetaData(),
+        sa.Column(left[0], mysql.INTEGER(unsigned=True), nullable=not primary_key),
+        sa.Column(right[0], mysql.INTEGER(unsigned=True), nullable=not primary_key),
+        sa.ForeignKeyConstraint([left[0]], [left[1]]),
+        sa.ForeignKeyConstraint([right[0]], [right[1]]),
+        *constraints)
+
+def usergroupstoroles_table(primary_key=False):
+    return pivot_table('UserGroupsToRoles', ('user_group_id', 'UserGroups.group_id'), ('role_id', 'Roles.role_id'), primary_key)
+
+def userstousergroups_table(primary_key=False):
+    return pivot_table('UsersToUserGroups', ('user_id', 'Users.user_id'), ('user_group_id', 'UserGroups.group_id'), primary_key)
+
+def upgrade():
+    # UserGroupsToRoles has no primary key. Drop NULL and duplicate rows, so it can have one
+    usergroupstoroles = sa.table('UserGroupsToRoles', sa.column('user_group_id', mysql.INTEGER(unsigned=True)), sa.column('role_id', mysql.INTEGER(unsigned=True)))
+    migrations.deduplicate(usergroupstoroles, ['user_group_id', 'role_id'])
+    with op.batch_alter_table('UserGroupsToRoles', copy_from=usergroupstoroles_table()) as batch_op:
+        batch_op.alter_column('user_group_id', existing_type=mysql.INTEGER(unsigned=True), nullable=False)
+        batch_op.alter_column('role_id', existing_type=mysql.INTEGER(unsigned=True), nullable=False)
+        batch_op.create_primary_key('pk_UserGroupsToRoles', ['user_group_id', 'role_id'])
+
+    # UsersToUserGroups has no primary key. Drop NULL and duplicate rows, so it can have one
+    userstousergroups = sa.table('UsersToUserGroups', sa.column('user_id', mysql.INTEGER(unsigned=True)), sa.column('user_group_id', mysql.INTEGER(unsigned=True)))
+    migrations.deduplicate(userstousergroups, ['user_id', 'user_group_id'])
+    with op.batch_alter_table('UsersToUserGroups', copy_from=userstousergroups_table()) as batch_op:
+        batch_op.alter_column('user_id', existing_type=mysql.INTEGER(unsigned=True), nullable=False)
+        batch_op.alter_column('user_group_id', existing_type=mysql.INTEGER(unsigned=True), nullable=False)
+        batch_op.create_primary_key('pk_UsersToUserGroups', ['user_id', 'user_group_id'])
+
+    op.drop_index('ix_Passwords_hashed_password', table_name='Passwords')
+    op.drop_index('ix_Users_password_salt', table_name='Users')
+
+
+def downgrade():
+    op.create_index('ix_Users_password_salt', 'Users', ['password_salt'], unique=False)
+    op.create_index('ix_Passwords_hashed_password', 'Passwords', ['hashed_password'], unique=False)
+    with op.batch_alter_table('UsersToUserGroups', copy_from=userstousergroups_table(primary_key=True)) as batch_op:
+        batch_op.drop_constraint('pk_UsersToUserGroups', type_='primary')
+        batch_op.alter_column('user_id', existing_type=mysql.INTEGER(unsigned=True), nullable=True)
+        batch_op.alter_column('user_group_id', existing_type=mysql.INTEGER(unsigned=True), nullable=True)
+
+    with op.batch_alter_table('UserGroupsToRoles', copy_from=usergroupstoroles_table(primary_key=True)) as batch_op:
+        batch_op.drop_constraint('pk_UserGroupsToRoles', type_='primary')
+        batch_op.alter_column('user_group_id', existing_type=mysql.INTEGER(unsigned=True), nullable=True)
+        batch_op.alter_column('role_id', existing_type=mysql.INTEGER(unsigned=True), nullable=True)
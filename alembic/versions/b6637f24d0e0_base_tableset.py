@@ -16,14 +16,11 @@ from alembic import op
 import sqlalchemy as sa
 from sqlalchemy.dialects import mysql
 
-from hsdb import User
-from hsdb import Password
-from hsdb import HomestackDatabase as HSDB
-from hsdb import Role
-from hsdb import UserGroup
+from hsdb import migrations
 
 from argon2 import argon2_hash
 
+import os
 import datetime
 
 def upgrade():
@@ -83,50 +80,45 @@ def upgrade():
     )
     ### end Alembic commands ###
 
-    session = User._session
-
-    # Create a few base Roles
+    # Seed a few base Roles and groups, the group/role mappings, and our admin/admin user.
+    #   The tables were only just created, so we can hand out ids ourselves
     roles = ["admin", "read_all", "hue_rw", "nest_rw"]
-    for role in roles:
-        Role.insert(name=role)
-
-    # Create a few base groups
-    groups = {
-        "administrator" : ['admin'],
-        "user" : ['read_all'],
-        "google" : ['hue_rw', 'nest_rw']
-    }
-
-    # Create group/role mappings in the DB
-    for group, roles in groups.iteritems():
-        g = UserGroup.insert(name=group)
-
-        for role in roles:
-            r = Role.filter_by(name=role).first()
-            g.roles.append(r)
-
-    session.commit()
-
-    # Grant `administrator` group the `admin` role
-    admin_role = Role.filter_by(name='admin').first()
-    admin_group = UserGroup.filter_by(name="administrator").first()
-    admin_group.roles.append(admin_role)
-    session.commit()
-
-    # Create our admin/admin user
-    now = datetime.datetime.utcnow()
-    u = User.insert(username='admin', time=now, timestamp=now)
-    session.commit()
-    session.flush()
-
-    # This create a default password of `admin` for our admin user, with hard coded time complexity values
-    # These hard-coded values are used during login if the admin user appears to be initiating a first-login
-    p = Password.insert(hashed_password=bytearray(argon2_hash("admin", u.password_salt, t=2000, m=1024)))
-    session.commit()
-
-    # Add admin user to `administrator` group
-    u.user_groups.append(admin_group)
-    session.commit()
+    groups = [
+        ("administrator", ['admin']),
+        ("user", ['read_all']),
+        ("google", ['hue_rw', 'nest_rw'])
+    ]
+
+    with migrations.transaction():
+        role_ids = dict( (name, role_id) for role_id, name in enumerate(roles, 1) )
+        migrations.bulk_insert(sa.table('Roles', sa.column('role_id', mysql.INTEGER(unsigned=True)), sa.column('name', sa.VARCHAR(length=30))),
+            [ {'role_id': role_ids[name], 'name': name} for name in roles ])
+
+        migrations.bulk_insert(sa.table('UserGroups', sa.column('group_id', mysql.INTEGER(unsigned=True)), sa.column('name', sa.VARCHAR(length=30))),
+            [ {'group_id': group_id, 'name': name} for group_id, (name, _) in enumerate(groups, 1) ])
+
+        migrations.bulk_insert(sa.table('UserGroupsToRoles', sa.column('user_group_id', mysql.INTEGER(unsigned=True)),
+                                                sa.column('role_id', mysql.INTEGER(unsigned=True))),
+            [ {'user_group_id': group_id, 'role_id': role_ids[role]}
+                for group_id, (_, group_roles) in enumerate(groups, 1) for role in group_roles ])
+
+        now = datetime.datetime.utcnow()
+        salt = os.urandom(32)
+        migrations.bulk_insert(sa.table('Users', sa.column('user_id', mysql.INTEGER(unsigned=True)), sa.column('time', mysql.DATETIME()),
+                                        sa.column('timestamp', mysql.DATETIME()), sa.column('username', sa.VARCHAR(length=128)),
+                                        sa.column('password_salt', sa.BINARY(length=32))),
+            [ {'user_id': 1, 'time': now, 'timestamp': now, 'username': 'admin', 'password_salt': salt} ])
+
+        # This create a default password of `admin` for our admin user, with hard coded time complexity values
+        # These hard-coded values are used during login if the admin user appears to be initiating a first-login
+        migrations.bulk_insert(sa.table('Passwords', sa.column('password_id', mysql.INTEGER(unsigned=True)),
+                                        sa.column('hashed_password', sa.BINARY(length=128))),
+            [ {'password_id': 1, 'hashed_password': bytes(argon2_hash("admin", salt, t=2000, m=1024))} ])
+
+        # Add admin user to `administrator` group
+        migrations.bulk_insert(sa.table('UsersToUserGroups', sa.column('user_id', mysql.INTEGER(unsigned=True)),
+                                                sa.column('user_group_id', mysql.INTEGER(unsigned=True))),
+            [ {'user_id': 1, 'user_group_id': 1} ])
 
 
 def downgrade():
@@ -0,0 +1,66 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Compare connection checkout latency with keep-alive off, with the old ping-on-every-checkout
+behaviour, and with idle-time based liveness checks (`ping_idle`)
+
+Runs against a throwaway SQLite file unless a database URL is given. The gap is a lot
+bigger against a MySQL server on the other end of a network, where each ping is a round trip
+
+Usage:
+    python benchmarks/checkout_latency.py [--checkouts 20000] [--repeat 3] [--url mysql://...]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import select
+from sqlalchemy.pool import QueuePool
+
+import hsdb
+from hsdb import HomestackDatabase
+
+
+def timed(label, checkouts, repeat, **settings):
+    hsdb.configure(url=settings.pop("url"), poolclass=QueuePool, **settings)
+    engine = HomestackDatabase._engine
+
+    # Warm the pool (and the database file) up, so we're timing checkouts rather than
+    #   new connections and cold caches
+    for i in range(checkouts // 10):
+        with engine.connect() as connection:
+            connection.execute(select([1])).scalar()
+
+    # Best of `repeat` runs, as checkout timings are noisy
+    elapsed = None
+    for run in range(repeat):
+        start = time.time()
+        for i in range(checkouts):
+            with engine.connect() as connection:
+                connection.execute(select([1])).scalar()
+        elapsed = min(elapsed or float("inf"), time.time() - start)
+
+    print("{:<28} {:>8} checkouts {:>9.3f}s {:>9.1f}us/checkout".format(label, checkouts, elapsed, elapsed / checkouts * 1e6))
+    hsdb.reset()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--checkouts", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--url", default=None)
+    args = parser.parse_args()
+
+    url = args.url or "sqlite:///{}".format(tempfile.mktemp(suffix=".db"))
+
+    timed("keep_alive off", args.checkouts, args.repeat, url=url, keep_alive=False)
+    timed("ping every checkout", args.checkouts, args.repeat, url=url, keep_alive=True)
+    timed("ping_idle=30", args.checkouts, args.repeat, url=url, keep_alive=True, ping_idle=30)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Benchmark the data-access hot paths: inserts, filter_by, list, serialize, permission checks,
+api key lookups and bridge lookups, against a seeded database
+
+Runs against a throwaway SQLite file unless a database URL is given (the schema is created
+for you, so point it at an empty database). Results are printed as a table and can be
+written out as JSON, then compared against a previous run to spot regressions
+
+Usage:
+    python benchmarks/hot_paths.py [--users 1000] [--output results.json]
+    python benchmarks/hot_paths.py --compare baseline.json [--threshold 0.15]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import argparse
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import sqlalchemy
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import User
+from hsdb import Role
+from hsdb import UserGroup
+from hsdb import ApiKey
+from hsdb import HueBridge
+from hsdb import UserToUserGroup
+from hsdb import UserGroupToRole
+
+
+def seed(args):
+    """
+    Fill the database with `args.*` worth of rows, returning what we need to run against
+    """
+    rand = random.Random(args.seed)
+
+    Role.insert_many([ {"name": "role{}".format(i)} for i in range(args.roles) ])
+    UserGroup.insert_many([ {"name": "group{}".format(i)} for i in range(args.groups) ])
+    User.insert_many([ {"username": "user{}".format(i)} for i in range(args.users) ])
+
+    role_ids = [ role.id for role in Role.list() ]
+    group_ids = [ group.id for group in UserGroup.list() ]
+    user_ids = [ user.id for user in User.list() ]
+
+    session = HomestackDatabase.get_session()
+    session.execute(UserGroupToRole.insert(), [
+        {"user_group_id": group_id, "role_id": role_id}
+            for group_id in group_ids for role_id in rand.sample(role_ids, min(args.roles_per_group, len(role_ids))) ])
+    session.execute(UserToUserGroup.insert(), [
+        {"user_id": user_id, "user_group_id": group_id}
+            for user_id in user_ids for group_id in rand.sample(group_ids, min(args.groups_per_user, len(group_ids))) ])
+    session.commit()
+
+    ApiKey.insert_many([ {"user_id": rand.choice(user_ids), "description": "key{}".format(i)} for i in range(args.api_keys) ])
+    HueBridge.insert_many([ {
+        "user_id"   : rand.choice(user_ids),
+        "name"      : "bridge{}".format(i),
+        "address"   : "10.0.{}.{}".format(i // 256, i % 256),
+        "user"      : "bridge-user{}".format(i)
+    } for i in range(args.bridges) ])
+
+    keys = [ key.api_key for key in ApiKey.list() ]
+    HomestackDatabase.remove_session()
+
+    return {
+        "rand"      : rand,
+        "user_ids"  : user_ids,
+        "usernames" : [ "user{}".format(i) for i in range(args.users) ],
+        "roles"     : [ "role{}".format(i) for i in range(args.roles) ],
+        "groups"    : [ "group{}".format(i) for i in range(args.groups) ],
+        "keys"      : keys
+    }
+
+def measure(func, iterations, repeat, setup=None):
+    """
+    Time `iterations` calls of `func`, `repeat` times over, returning per-call stats (seconds)
+    """
+    runs = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+
+        start = time.time()
+        for j in range(iterations):
+            func()
+        runs.append((time.time() - start) / iterations)
+
+    runs.sort()
+    return {
+        "iterations"    : iterations,
+        "repeat"        : repeat,
+        "best"          : runs[0],
+        "median"        : runs[len(runs) // 2],
+        "worst"         : runs[-1]
+    }
+
+def benchmarks(data, args):
+    """
+    Return a list of (name, func, iterations, setup) to run
+    """
+    rand = data["rand"]
+    user = lambda: User.filter_by(username=rand.choice(data["usernames"])).first()
+    clear_caches = lambda: (User.permission_cache.clear(), ApiKey.resolve_cache.clear(), HueBridge.index_cache.clear(),
+                            HomestackDatabase.remove_session())
+    fresh_session = HomestackDatabase.remove_session
+    counter = itertools.count()
+
+    return [
+        ("insert",              lambda: HueBridge.insert(user_id=data["user_ids"][0], name="b", address="10.1.1.1",
+                                                         user="bench-{}".format(next(counter))), 200, None),
+        ("filter_by",           user, 1000, fresh_session),
+        ("list.users",          lambda: User.list(), 5, fresh_session),
+        ("rows.users",          lambda: User.rows("id", "username"), 5, fresh_session),
+        ("rows.api_keys",       lambda: ApiKey.rows("id", "api_key", "description"), 5, fresh_session),
+        ("list.groups.eager",   lambda: UserGroup.list(eager=2), 20, fresh_session),
+        ("serialize.depth1",    lambda: [ u.serialize(depth=1) for u in User.list() ], 3, fresh_session),
+        ("serialize.depth2",    lambda: [ g.serialize(depth=2) for g in UserGroup.list() ], 10, fresh_session),
+        ("serialize.depth3",    lambda: [ g.serialize(depth=3) for g in UserGroup.list(eager=3) ], 10, fresh_session),
+        ("role.filter_by",      lambda: Role.filter_by(name=rand.choice(data["roles"])).first(), 1000, fresh_session),
+        ("has_role.cold",       lambda: (User.permission_cache.clear(), user().has_role(rand.choice(data["roles"]))), 500, clear_caches),
+        ("has_role.warm",       lambda: User.get_permissions(rand.choice(data["user_ids"]))[1], 5000, None),
+        ("in_group.warm",       lambda: rand.choice(data["groups"]) in User.get_permissions(rand.choice(data["user_ids"]))[0], 5000, None),
+        ("api_key.filter_by",   lambda: ApiKey.filter_by(api_key=rand.choice(data["keys"])).first(), 1000, fresh_session),
+        ("api_key.resolve",     lambda: ApiKey.resolve(rand.choice(data["keys"])), 5000, None),
+        ("api_key.resolve_many", lambda: ApiKey.resolve_many(rand.sample(data["keys"], min(50, len(data["keys"])))), 200, clear_caches),
+        ("bridges.for_user",    lambda: HueBridge.for_user(rand.choice(data["user_ids"])), 5000, None)
+    ]
+
+def compare(results, baseline, threshold):
+    """
+    Print how each benchmark moved against a previous run. Returns True when nothing got
+    slower by more than `threshold` (a fraction)
+    """
+    ok = True
+    print("\n{:<24} {:>12} {:>12} {:>9}".format("benchmark", "baseline", "current", "change"))
+    for name, stats in sorted(results["benchmarks"].items()):
+        before = baseline["benchmarks"].get(name)
+        if before is None:
+            print("{:<24} {:>12} {:>12.1f} {:>9}".format(name, "-", stats["median"] * 1e6, "new"))
+            continue
+
+        change = (stats["median"] - before["median"]) / before["median"]
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print("{:<24} {:>10.1f}us {:>10.1f}us {:>+8.1%}{}".format(name, before["median"] * 1e6, stats["median"] * 1e6, change, flag))
+
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--roles", type=int, default=20)
+    parser.add_argument("--groups-per-user", type=int, default=3)
+    parser.add_argument("--roles-per-group", type=int, default=4)
+    parser.add_argument("--api-keys", type=int, default=2000)
+    parser.add_argument("--bridges", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", default=None, help="Comma separated list of benchmarks to run")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="A previous --output to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Slowdown (as a fraction) that counts as a regression")
+    args = parser.parse_args()
+
+    url = args.url or "sqlite:///{}".format(tempfile.mktemp(suffix=".db"))
+    hsdb.configure(url=url)
+    HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+    data = seed(args)
+    only = set(args.only.split(",")) if args.only else None
+
+    results = {
+        "meta"  : {
+            "time"          : time.time(),
+            "python"        : platform.python_version(),
+            "sqlalchemy"    : sqlalchemy.__version__,
+            "backend"       : HomestackDatabase._engine.dialect.name,
+            "volumes"       : dict( (key, getattr(args, key)) for key in
+                                ("users", "groups", "roles", "groups_per_user", "roles_per_group", "api_keys", "bridges") )
+        },
+        "benchmarks" : {}
+    }
+
+    print("{:<24} {:>12} {:>12} {:>12}".format("benchmark", "best", "median", "worst"))
+    for name, func, iterations, setup in benchmarks(data, args):
+        if only is not None and name not in only:
+            continue
+
+        stats = measure(func, iterations, args.repeat, setup)
+        results["benchmarks"][name] = stats
+        print("{:<24} {:>10.1f}us {:>10.1f}us {:>10.1f}us".format(name, stats["best"] * 1e6, stats["median"] * 1e6, stats["worst"] * 1e6))
+
+    HomestackDatabase.remove_session()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Run the hot path workload (see hot_paths.py) plus pagination and relationship walks under
+the index advisor, then report unused and missing indexes, optionally writing the
+recommendations out as an Alembic revision
+
+Runs against a throwaway SQLite file unless a database URL is given. Against a real
+database, point it at a copy migrated with Alembic (--no-create), so we're advising on
+the schema you actually have, rather than on what the models would create
+
+Usage:
+    python benchmarks/index_advisor.py [--users 1000] [--revision alembic/versions]
+    python benchmarks/index_advisor.py --url mysql://.../homestack_copy --no-create
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import hsdb
+from hsdb import advisor
+from hsdb import HomestackDatabase
+from hsdb import User
+from hsdb import Role
+from hsdb import UserGroup
+from hsdb import ApiKey
+from hsdb import Password
+from hsdb import HueBridge
+
+import hot_paths
+
+
+def workload(data, args):
+    """
+    Run each hot path benchmark once, plus the lookups they don't cover
+    """
+    for name, func, iterations, setup in hot_paths.benchmarks(data, args):
+        if setup is not None:
+            setup()
+        func()
+
+    rand = data["rand"]
+    user_id = rand.choice(data["user_ids"])
+    HomestackDatabase.remove_session()
+
+    # Relationship walks, both ways across the pivot tables
+    user = User.filter_by(id=user_id).first()
+    [ group.roles for group in user.user_groups ]
+    [ role.user_groups for role in Role.list() ]
+    [ group.users for group in UserGroup.list() ]
+
+    # Pagination, and the per-user lookups our endpoints make
+    User.paginate(order_by=[User.time], limit=20)
+    ApiKey.paginate(order_by=[ApiKey.created], desc=True, query=ApiKey.filter_by(user_id=user_id), limit=20)
+    ApiKey.filter_by(user_id=user_id).all()
+    HueBridge.filter_by(user_id=user_id).all()
+    HueBridge.index_cache.clear()
+    HueBridge.for_user(user_id)
+    Password.filter_by(id=1).first()
+
+    HomestackDatabase.remove_session()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--no-create", action="store_true", help="Don't create the schema, it's already there")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--roles", type=int, default=20)
+    parser.add_argument("--groups-per-user", type=int, default=3)
+    parser.add_argument("--roles-per-group", type=int, default=4)
+    parser.add_argument("--api-keys", type=int, default=2000)
+    parser.add_argument("--bridges", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", default="", help="Comma separated list of indexes to never recommend dropping")
+    parser.add_argument("--revision", default=None, help="Write an Alembic revision to this versions directory")
+    parser.add_argument("--message", default="Apply index advisor recommendations")
+    args = parser.parse_args()
+
+    url = args.url or "sqlite:///{}".format(tempfile.mktemp(suffix=".db"))
+    hsdb.configure(url=url)
+    if not args.no_create:
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+    data = hot_paths.seed(args)
+
+    # Start from cold caches, so every lookup actually reaches the database
+    hsdb.query_cache.clear()
+    User.permission_cache.clear()
+    ApiKey.resolve_cache.clear()
+
+    with advisor.capture() as recorder:
+        workload(data, args)
+
+    report = advisor.analyze(recorder, keep=[ name for name in args.keep.split(",") if name ])
+    print(advisor.format_report(report))
+
+    if args.revision:
+        print("Wrote {}".format(advisor.write_revision(report, args.revision, args.message)))
+
+if __name__ == "__main__":
+    main()
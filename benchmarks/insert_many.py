@@ -0,0 +1,66 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Compare the throughput of HomestackDatabase.insert() (a round trip and a commit per row)
+against insert_many() and upsert_many()
+
+Runs against a throwaway SQLite file unless a database URL is given
+
+Usage:
+    python benchmarks/insert_many.py [--rows 5000] [--url sqlite:////tmp/bench.db]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import User
+from hsdb import HueBridge
+
+
+def bridges(user_id, count, prefix):
+    return [ {
+        "user_id"   : user_id,
+        "name"      : "bridge {}".format(i),
+        "address"   : "10.0.{}.{}".format(i // 256, i % 256),
+        "user"      : "{}{}".format(prefix, i)
+    } for i in range(count) ]
+
+def timed(label, rows, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print("{:<24} {:>8} rows {:>9.3f}s {:>10.0f} rows/s".format(label, rows, elapsed, rows / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--url", default=None)
+    args = parser.parse_args()
+
+    url = args.url or "sqlite:///{}".format(tempfile.mktemp(suffix=".db"))
+    hsdb.configure(url=url)
+    HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+    user = User.insert(username="benchmark")
+
+    def per_row():
+        for row in bridges(user.id, args.rows, "single"):
+            HueBridge.insert(**row)
+
+    timed("insert()", args.rows, per_row)
+    timed("insert_many()", args.rows, lambda: HueBridge.insert_many(bridges(user.id, args.rows, "many")))
+    timed("upsert_many() (update)", args.rows, lambda: HueBridge.upsert_many(bridges(user.id, args.rows, "many"), conflict_keys=["user"]))
+    timed("upsert_many() (insert)", args.rows, lambda: HueBridge.upsert_many(bridges(user.id, args.rows, "upsert"), conflict_keys=["user"]))
+
+    HomestackDatabase.remove_session()
+
+if __name__ == "__main__":
+    main()
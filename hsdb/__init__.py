@@ -1,17 +1,27 @@
 #! /usr/bin/env python2.7
 # -*- coding: latin-1 -*-
 
-from hsdb import User
-from hsdb import Password
-from hsdb import UserGroup
-from hsdb import Role
-from hsdb import ApiKey
-from hsdb import HueBridge
+from .hsdb import User
+from .hsdb import Password
+from .hsdb import UserGroup
+from .hsdb import Role
+from .hsdb import ApiKey
+from .hsdb import HueBridge
 
-from hsdb import UserGroupToRole
-from hsdb import UserToUserGroup
+from .hsdb import UserGroupToRole
+from .hsdb import UserToUserGroup
 
-from hsdb import HomestackDatabase
+from .hsdb import HomestackDatabase
+
+from .hsdb import configure
+from .hsdb import configure_sqlite
+from .hsdb import reset
+from .hsdb import get_engine
+from .hsdb import after_fork
+from .hsdb import limit_sessions
+from .hsdb import own_session
+from .hsdb import query_cache
+from .hsdb import statement_cache
 
 __ALL__ = [
     "User",
@@ -24,5 +34,15 @@ __ALL__ = [
     "UserGroupToRole",
     "UserToUserGroup",
 
-    "HomestackDatabase"
+    "HomestackDatabase",
+
+    "configure",
+    "configure_sqlite",
+    "reset",
+    "get_engine",
+    "after_fork",
+    "limit_sessions",
+    "own_session",
+    "query_cache",
+    "statement_cache"
 ]
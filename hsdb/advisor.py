@@ -0,0 +1,510 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Index advisor. Records the statements our helpers actually issue, runs EXPLAIN on each
+of them, and works out which indexes are pulling their weight:
+
+    Unused indexes      Secondary indexes that no captured statement used (per EXPLAIN)
+                            or even filtered, joined or sorted on. They only cost writes
+    Missing indexes     Tables the database had to scan, for a statement that filters or
+                            joins on columns no existing index (or foreign key, as MySQL
+                            indexes those for us) starts with
+    No primary key      Tables (ie: our pivot tables) without one. We recommend one over
+                            their foreign key columns, ordered by how they're looked up
+
+The recommendations can then be written out as an Alembic revision
+
+Only MySQL (EXPLAIN) and SQLite (EXPLAIN QUERY PLAN) are supported
+
+Examples:
+    from hsdb import advisor
+
+    with advisor.capture() as recorder:
+        run_the_workload()
+
+    report = advisor.analyze(recorder)
+    print(advisor.format_report(report))
+    advisor.write_revision(report, "alembic/versions")
+"""
+
+import os
+import re
+import uuid
+import logging
+
+from datetime import datetime
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy import Column
+from sqlalchemy.sql import operators
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.selectable import Alias
+from sqlalchemy.sql.selectable import Select
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.ddl import DDLElement
+
+from .hsdb import on_engine_created
+from .hsdb import get_engine
+from .hsdb import hs_base
+
+log = logging.getLogger(__name__)
+
+# How much a column being looked up a certain way counts towards it leading an index
+EQUALITY_WEIGHT = 2
+JOIN_WEIGHT = 1
+
+# Max number of columns we'll recommend putting in one index
+MAX_INDEX_COLUMNS = 3
+
+
+class Recorder(object):
+    """
+    Collects one example (SQL, parameters and the statement it was compiled from) of each
+    distinct statement run against our engine while it's recording
+    """
+
+    def __init__(self):
+        self.recording = False
+        self.statements = {}
+
+    def record(self, statement, parameters, context, executemany):
+        if not self.recording or executemany or statement in self.statements:
+            return
+
+        compiled = getattr(context, "compiled", None)
+        element = getattr(compiled, "statement", None)
+
+        # Inserts never read through an index, and DDL can't be explained
+        if element is None or isinstance(element, (Insert, DDLElement)):
+            return
+
+        self.statements[statement] = (parameters, element)
+
+
+# Recorders currently listening, and whether we've hooked our engines yet
+_recorders = []
+_installed = []
+
+
+def install(engine):
+    """
+    Attach our listener to an engine. Done for you by `capture()`
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        for recorder in _recorders:
+            recorder.record(statement, parameters, context, executemany)
+
+@contextmanager
+def capture(recorder=None):
+    """
+    Record every distinct statement run inside the block
+
+    Examples:
+        with advisor.capture() as recorder:
+            User.filter_by(username="mike").first()
+    """
+    recorder = recorder or Recorder()
+
+    if not _installed:
+        _installed.append(on_engine_created(install))
+
+    recorder.recording = True
+    _recorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        recorder.recording = False
+        _recorders.remove(recorder)
+
+
+"""
+EXPLAIN, per dialect. Each returns a list of (table, index) pairs, one per table the
+statement reads, with index None when the table was scanned
+"""
+
+def _explain_mysql(cursor, statement, parameters):
+    cursor.execute("EXPLAIN " + statement, parameters)
+    names = [ column[0] for column in cursor.description ]
+
+    ret = []
+    for row in cursor.fetchall():
+        row = dict(zip(names, row))
+        if not row.get("table") or row["table"].startswith("<"):
+            continue
+        ret.append((row["table"], None if row.get("type") == "ALL" else row.get("key")))
+    return ret
+
+_sqlite_plan = re.compile(r'^(SCAN|SEARCH)(?: TABLE)? "?([^" ]+)"?(?: AS \S+)?(?: USING (?:COVERING )?INDEX (\S+)| USING (?:INTEGER )?PRIMARY KEY)?')
+
+def _explain_sqlite(cursor, statement, parameters):
+    cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+
+    ret = []
+    for row in cursor.fetchall():
+        match = _sqlite_plan.match(row[-1])
+        if match is None:
+            continue
+
+        kind, table, index = match.groups()
+        if kind == "SEARCH" and index is None:
+            index = "PRIMARY"
+        ret.append((table, index))
+    return ret
+
+EXPLAINERS = {
+    "mysql"     : _explain_mysql,
+    "sqlite"    : _explain_sqlite
+}
+
+
+def _table_name(table):
+    # Aliases (ie: from eager loads) count against the table they alias
+    return getattr(getattr(table, "original", table), "name", None)
+
+def _lookups(element):
+    """
+    Work out how a statement looks rows up, as a dict of table name -> {column name: weight},
+    a set of (table name, column name) it sorts on, and a dict of alias -> table name
+    """
+    lookups = {}
+    ordering = set()
+    aliases = {}
+
+    def add(column, weight):
+        name = _table_name(getattr(column, "table", None))
+        if name is None:
+            return
+        columns = lookups.setdefault(name, {})
+        columns[column.name] = max(columns.get(column.name, 0), weight)
+
+    def visit_binary(binary):
+        if binary.operator not in (operators.eq, operators.in_op, operators.gt, operators.ge, operators.lt, operators.le):
+            return
+
+        left, right = binary.left, binary.right
+        if isinstance(left, Column) and isinstance(right, Column):
+            if left.table is not right.table:
+                add(left, JOIN_WEIGHT)
+                add(right, JOIN_WEIGHT)
+            return
+
+        for column, other in ((left, right), (right, left)):
+            if isinstance(column, Column) and not isinstance(other, Column):
+                add(column, EQUALITY_WEIGHT if binary.operator in (operators.eq, operators.in_op) else JOIN_WEIGHT)
+
+    visitors.traverse(element, {}, {"binary": visit_binary})
+
+    for item in visitors.iterate(element, {}):
+        if isinstance(item, Alias) and _table_name(item):
+            aliases[item.name] = _table_name(item)
+
+        if isinstance(item, Select):
+            for clause in item._order_by_clause.clauses:
+                column = getattr(clause, "element", clause)
+                if isinstance(column, Column) and _table_name(column.table):
+                    ordering.add((_table_name(column.table), column.name))
+
+    return lookups, ordering, aliases
+
+
+def _schema(engine, tables):
+    """
+    Return table name -> dict of the indexes, primary key, unique constraints and foreign
+    keys the database actually has
+    """
+    inspector = inspect(engine)
+    schema = {}
+
+    for table in tables:
+        columns = [ column["name"] for column in inspector.get_columns(table) ]
+        pk = inspector.get_pk_constraint(table).get("constrained_columns") or []
+
+        schema[table] = {
+            "columns"   : columns,
+            "types"     : dict( (column["name"], column) for column in inspector.get_columns(table) ),
+            "pk"        : pk,
+            "indexes"   : [ (index["name"], index["column_names"]) for index in inspector.get_indexes(table) if not index.get("unique") ],
+            "unique"    : [ index["column_names"] for index in inspector.get_indexes(table) if index.get("unique") ] +
+                          [ unique["column_names"] for unique in inspector.get_unique_constraints(table) ],
+            "foreign"   : [ fk["constrained_columns"] for fk in inspector.get_foreign_keys(table) ]
+        }
+
+    return schema
+
+
+def analyze(recorder, engine=None, keep=()):
+    """
+    EXPLAIN everything a Recorder captured, and compare it against the indexes our
+    database actually has
+
+    Args:
+        recorder (Recorder) What to analyze
+        engine (Engine) Where to run EXPLAIN. Defaults to our engine
+        keep (list) Names of indexes to never recommend dropping
+
+    Returns:
+        A dict of:
+            plans           [{"statement", "plan": [(table, index or None)], "lookups"}]
+            unused          [(table, index name, columns)]
+            missing         [(table, columns, example statement)]
+            primary_keys    [(table, columns)]
+    """
+    engine = engine or get_engine()
+    explain = EXPLAINERS.get(engine.dialect.name)
+    if explain is None:
+        raise ValueError("Don't know how to EXPLAIN on {}".format(engine.dialect.name))
+
+    plans = []
+    used = set()
+    weights = {}
+    ordered = set()
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement, (parameters, element) in sorted(recorder.statements.items()):
+            try:
+                plan = explain(cursor, statement, parameters)
+            except Exception as e:
+                log.warning("Couldn't EXPLAIN %s: %s", statement, e)
+                continue
+
+            lookups, ordering, aliases = _lookups(element)
+            plan = [ (aliases.get(table, table), index) for table, index in plan ]
+            plans.append({ "statement": statement, "plan": plan, "lookups": lookups })
+            ordered |= ordering
+
+            for table, index in plan:
+                if index is not None:
+                    used.add((table, index))
+
+            for table, columns in lookups.items():
+                for column, weight in columns.items():
+                    totals = weights.setdefault(table, {})
+                    totals[column] = totals.get(column, 0) + weight
+        cursor.close()
+    finally:
+        connection.close()
+
+    tables = set(table for plan in plans for table, index in plan["plan"]) | set(weights)
+    tables &= set(inspect(engine).get_table_names())
+    schema = _schema(engine, sorted(tables))
+
+    # Tables without a primary key get one over their foreign keys, most looked up first
+    primary_keys = []
+    for table, info in sorted(schema.items()):
+        if info["pk"]:
+            continue
+
+        columns = [ column for fk in info["foreign"] for column in fk ] or list(info["columns"])
+        usage = weights.get(table, {})
+        columns.sort(key=lambda column: (-usage.get(column, 0), info["columns"].index(column)))
+        primary_keys.append((table, columns))
+        info["pk"] = columns
+
+    # Secondary indexes nobody used, that aren't holding up a foreign key
+    unused = []
+    for table, info in sorted(schema.items()):
+        for name, columns in info["indexes"]:
+            if name in keep or (table, name) in used:
+                continue
+            if any(columns[:len(fk)] == fk for fk in info["foreign"]):
+                continue
+            if weights.get(table, {}).get(columns[0]) or (table, columns[0]) in ordered:
+                continue
+            unused.append((table, name, columns))
+
+    # Scans over columns we filter or join on, that no existing index (or primary key) starts with
+    missing = []
+    for plan in plans:
+        for table, index in plan["plan"]:
+            if index is not None or table not in schema:
+                continue
+
+            lookups = plan["lookups"].get(table, {})
+            if not lookups:
+                continue
+
+            info = schema[table]
+            leading = set(columns[0] for name, columns in info["indexes"]) | set(columns[0] for columns in info["unique"]) \
+                        | set(columns[0] for columns in info["foreign"])
+            if info["pk"]:
+                leading.add(info["pk"][0])
+            if leading & set(lookups):
+                continue
+
+            columns = sorted(lookups, key=lambda column: (-lookups[column], info["columns"].index(column)))[:MAX_INDEX_COLUMNS]
+            missing.append((table, columns, plan["statement"]))
+
+            # Later statements get to use the index we just recommended
+            info["indexes"].append((_index_name(table, columns), columns))
+
+    return {
+        "plans"         : plans,
+        "unused"        : unused,
+        "missing"       : missing,
+        "primary_keys"  : primary_keys,
+        "schema"        : schema
+    }
+
+
+def format_report(report):
+    """
+    Render a report from `analyze()` as plain text
+    """
+    lines = ["Statements explained: {}".format(len(report["plans"]))]
+
+    for plan in report["plans"]:
+        scans = [ table for table, index in plan["plan"] if index is None ]
+        if scans:
+            lines.append("    scans {}: {}".format(", ".join(scans), " ".join(plan["statement"].split())[:160]))
+
+    lines.append("\nTables without a primary key:")
+    for table, columns in report["primary_keys"]:
+        lines.append("    {} -> PRIMARY KEY ({})".format(table, ", ".join(columns)))
+
+    lines.append("\nUnused indexes:")
+    for table, name, columns in report["unused"]:
+        lines.append("    {}.{} ({})".format(table, name, ", ".join(columns)))
+
+    lines.append("\nMissing indexes:")
+    for table, columns, statement in report["missing"]:
+        lines.append("    {} ({})    for: {}".format(table, ", ".join(columns), " ".join(statement.split())[:120]))
+
+    return "\n".join(lines) + "\n"
+
+
+def _index_name(table, columns):
+    return "ix_{}_{}".format(table, "_".join(columns))
+
+def _names(columns):
+    return "[{}]".format(", ".join("'{}'".format(column) for column in columns))
+
+def _head(directory):
+    """
+    Return the current head revision of the Alembic revisions in `directory`
+    """
+    revisions = {}
+    for name in os.listdir(directory):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            source = f.read()
+        revision = re.search(r"^revision = ['\"](\w+)['\"]", source, re.M)
+        down = re.search(r"^down_revision = ['\"]?(\w+)['\"]?", source, re.M)
+        if revision:
+            revisions[revision.group(1)] = down.group(1) if down and down.group(1) != "None" else None
+
+    heads = set(revisions) - set(revisions.values())
+    if len(heads) != 1:
+        raise ValueError("Expected a single head revision in {}, found {}".format(directory, sorted(heads)))
+    return heads.pop()
+
+def _column_type(table, info):
+    """
+    Render a column's type as mysql dialect source, the way our revisions spell them.
+    Our models know the type better than reflection does (ie: SQLite has no unsigned)
+    """
+    type_ = info["type"]
+    if table in hs_base.metadata.tables and info["name"] in hs_base.metadata.tables[table].c:
+        type_ = hs_base.metadata.tables[table].c[info["name"]].type
+    type_ = getattr(type_, "mapping", {}).get("mysql", type_)   # Variants, ie: UnsignedInteger()
+    name = type(type_).__name__
+    if name == "INTEGER":
+        return "mysql.INTEGER(unsigned=True)" if getattr(type_, "unsigned", False) else "mysql.INTEGER()"
+    return "sa.{}".format(repr(type_))
+
+REVISION_TEMPLATE = '''"""{message}
+
+Revision ID: {revision}
+Revises: {down_revision}
+Create Date: {date}
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '{revision}'
+down_revision = '{down_revision}'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+from hsdb import migrations
+
+def upgrade():
+{upgrade}
+
+
+def downgrade():
+{downgrade}
+'''
+
+def render_revision(report, down_revision, message="Apply index advisor recommendations", revision=None):
+    """
+    Render the recommendations in a report as the source of an Alembic revision
+    """
+    upgrade = []
+    downgrade = []
+
+    for table, columns in report["primary_keys"]:
+        types = report["schema"][table]["types"]
+        upgrade.append("    # {} has no primary key. Drop NULL and duplicate rows, so it can have one".format(table))
+        upgrade.append("    {} = sa.table('{}', {})".format(table.lower(), table, ", ".join(
+            "sa.column('{}', {})".format(column, _column_type(table, types[column])) for column in columns)))
+        upgrade.append("    migrations.deduplicate({}, {})".format(table.lower(), _names(columns)))
+        upgrade.append("    with op.batch_alter_table('{}') as batch_op:".format(table))
+        for column in columns:
+            upgrade.append("        batch_op.alter_column('{}', existing_type={}, nullable=False)".format(column, _column_type(table, types[column])))
+        upgrade.append("        batch_op.create_primary_key('pk_{}', {})".format(table, _names(columns)))
+        upgrade.append("")
+
+        downgrade.insert(0, "")
+        for column in reversed(columns):
+            downgrade.insert(0, "        batch_op.alter_column('{}', existing_type={}, nullable=True)".format(column, _column_type(table, types[column])))
+        downgrade.insert(0, "        batch_op.drop_constraint('pk_{}', type_='primary')".format(table))
+        downgrade.insert(0, "    with op.batch_alter_table('{}') as batch_op:".format(table))
+
+    for table, name, columns in report["unused"]:
+        upgrade.append("    op.drop_index('{}', table_name='{}')".format(name, table))
+        downgrade.insert(0, "    op.create_index('{}', '{}', {}, unique=False)".format(name, table, _names(columns)))
+
+    for table, columns, statement in report["missing"]:
+        name = _index_name(table, columns)
+        upgrade.append("    op.create_index('{}', '{}', {}, unique=False)".format(name, table, _names(columns)))
+        downgrade.insert(0, "    op.drop_index('{}', table_name='{}')".format(name, table))
+
+    while upgrade and not upgrade[-1]:
+        upgrade.pop()
+    while downgrade and not downgrade[-1]:
+        downgrade.pop()
+
+    return REVISION_TEMPLATE.format(
+        message         = message,
+        revision        = revision or uuid.uuid4().hex[-12:],
+        down_revision   = down_revision,
+        date            = datetime.now(),
+        upgrade         = "\n".join(upgrade) or "    pass",
+        downgrade       = "\n".join(downgrade) or "    pass"
+    )
+
+def write_revision(report, directory, message="Apply index advisor recommendations"):
+    """
+    Write the recommendations in a report out as a new Alembic revision, on top of the
+    current head in `directory`. Returns the path written to
+    """
+    revision = uuid.uuid4().hex[-12:]
+    slug = re.sub(r"\W+", "_", message.lower()).strip("_")[:40]
+    path = os.path.join(directory, "{}_{}.py".format(revision, slug))
+
+    with open(path, "w") as f:
+        f.write(render_revision(report, _head(directory), message, revision))
+
+    return path
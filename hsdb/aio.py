@@ -0,0 +1,169 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Awaitable mirrors of the HomestackDatabase helpers, for asyncio based services
+
+The actual database work is handed off to a small, bounded pool of worker threads, so the
+event loop never blocks on MySQL, and a thousand concurrent requests share `max_workers`
+connections rather than getting a thread each. Each call runs on a Session of its own (see
+`hsdb.own_session()`), whatever `scopefunc` the scoped session was configured with
+
+Objects handed back are detached from the worker's session, with their columns loaded.
+Walk relationships inside the worker (ie: `await Users.serialize(user, depth=2)`, or load
+them eagerly with `eager=`) rather than touching them from the event loop
+
+Requires Python 3 (asyncio and concurrent.futures)
+
+Examples:
+    from hsdb.aio import AsyncModel
+    from hsdb import User
+
+    Users = AsyncModel(User)
+    mike = await Users.first_by(username="mike")
+    users = await Users.list()
+    data = await Users.serialize(users, depth=2)
+"""
+
+import functools
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    asyncio = None
+
+from sqlalchemy.inspection import inspect
+
+from .hsdb import HomestackDatabase
+from .hsdb import own_session
+from .hsdb import _scope_token
+
+# Our shared worker pool. Built on first use, see `set_executor()`
+_executor = []
+
+
+def set_executor(executor=None, max_workers=8):
+    """
+    Swap out the pool our database work runs on. Size it to match the connection pool
+
+    Args:
+        executor (Executor) Use this executor. Defaults to a new ThreadPoolExecutor
+        max_workers (int) Size of the default executor
+    """
+    if asyncio is None:
+        raise RuntimeError("hsdb.aio requires Python 3 (asyncio and concurrent.futures)")
+
+    del _executor[:]
+    _executor.append(executor or ThreadPoolExecutor(max_workers=max_workers))
+    return _executor[0]
+
+def get_executor():
+    return _executor[0] if _executor else set_executor()
+
+def _caller_scope():
+    """
+    The scope token of whoever's calling us, so read-your-writes follows the task (or
+    thread) that wrote from one worker to the next. A per task `scopefunc` can't tell us
+    outside of a running task, in which case each call is a scope of its own
+    """
+    try:
+        return _scope_token()
+    except RuntimeError:
+        return None
+
+def _detach(session, value):
+    """
+    Make sure any ORM objects in `value` have their columns loaded, so they're still
+    usable once the worker's session is closed out from under them
+    """
+    items = value if isinstance(value, list) else [value]
+    for item in items:
+        if isinstance(item, HomestackDatabase) and inspect(item).expired_attributes:
+            session.refresh(item)
+    return value
+
+
+class AsyncModel(object):
+    """
+    Wraps a HomestackDatabase model, exposing awaitable versions of its helpers
+    """
+
+    def __init__(self, model, executor=None):
+        """
+        Args:
+            model (class) A HomestackDatabase subclass, ie: User
+            executor (Executor) Run on this executor, rather than our shared one
+        """
+        self.model = model
+        self.executor = executor
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` on a worker, in a session of its own that's closed
+        afterwards, returning an awaitable for its result
+
+        Examples:
+            count = await Users.run(lambda: User.query().count())
+        """
+        if asyncio is None:
+            raise RuntimeError("hsdb.aio requires Python 3 (asyncio and concurrent.futures)")
+
+        scope = _caller_scope()
+
+        def work():
+            with own_session(scope) as session:
+                return _detach(session, func(*args, **kwargs))
+
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor or get_executor(), work)
+
+    def query(self, build):
+        """
+        Build a query against our model on a worker, returning all of its results
+
+        Examples:
+            admins = await Users.query(lambda q: q.filter(User.username.like("adm%")))
+        """
+        return self.run(lambda: build(self.model.query()).all())
+
+    def filter_by(self, *args, **kwargs):
+        return self.run(lambda: self.model.filter_by(*args, **kwargs).all())
+
+    def first_by(self, *args, **kwargs):
+        return self.run(lambda: self.model.filter_by(*args, **kwargs).first())
+
+    def filter(self, *args, **kwargs):
+        return self.run(lambda: self.model.filter(*args, **kwargs).all())
+
+    def list(self, eager=None):
+        return self.run(functools.partial(self.model.list, eager=eager))
+
+    def rows(self, *columns, **kwargs):
+        return self.run(functools.partial(self.model.rows, *columns, **kwargs))
+
+    def insert(self, **kwargs):
+        return self.run(functools.partial(self.model.insert, **kwargs))
+
+    def insert_many(self, rows, batch_size=1000, return_pks=False):
+        return self.run(functools.partial(self.model.insert_many, rows, batch_size=batch_size, return_pks=return_pks))
+
+    def delete(self, instance):
+        """
+        Delete a (detached) instance we handed back earlier
+        """
+        def delete():
+            self.model.get_session().merge(instance).delete()
+        return self.run(delete)
+
+    def serialize(self, instances, depth=1, hybrid=True):
+        """
+        Serialize an instance (or a list of them) on a worker, where relationships can be
+        loaded safely
+        """
+        def serialize():
+            session = self.model.get_session()
+            if isinstance(instances, list):
+                return [ session.merge(instance, load=False).serialize(depth=depth, hybrid=hybrid) for instance in instances ]
+            return session.merge(instances, load=False).serialize(depth=depth, hybrid=hybrid)
+        return self.run(serialize)
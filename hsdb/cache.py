@@ -0,0 +1,287 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """
+    A small, thread-safe, in-process cache. Entries expire `ttl` seconds after being set,
+    and once we're holding `maxsize` entries, the least recently used one gets evicted
+
+    Examples:
+        cache = TTLCache(maxsize=1000, ttl=60)
+        cache.set("mike", frozenset(["admin"]))
+        cache.get("mike")                       frozenset(["admin"])
+        cache.get("nobody", "nope")             "nope"
+    """
+
+    # Returned by get() on a miss when no default is given, so that None can be cached
+    MISSING = object()
+
+    def __init__(self, maxsize=10000, ttl=60, clock=time.time):
+        """
+        Args:
+            maxsize (int) The max number of entries to hold before evicting
+            ttl (float) Number of seconds an entry lives for. None means forever
+            clock (callable) Returns the current time, in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not self.MISSING
+
+    def get(self, key, default=MISSING):
+        """
+        Return the value for `key`, or `default` if it's missing or has expired
+        """
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires <= self.clock():
+                self.misses += 1
+                return default
+
+            # Re-insert, marking it as most recently used
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=MISSING):
+        """
+        Cache `value` under `key`, optionally overriding our default ttl for this entry
+        """
+        ttl = self.ttl if ttl is self.MISSING else ttl
+        expires = None if ttl is None else self.clock() + ttl
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Drop a single entry, if we have it
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Drop everything
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Return a dict of our hit/miss counters and current size
+        """
+        return {
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            "size"      : len(self._data),
+            "maxsize"   : self.maxsize
+        }
+
+
+class QueryCache(object):
+    """
+    Our second-level query cache: pickled query results, held in a pluggable backend,
+    with hit/miss counters. See hsdb.PreparedQuery for what gets cached and when
+
+    Examples:
+        hsdb.query_cache.use(FileBackend("/dev/shm/hsdb-query-cache"))
+        hsdb.query_cache.stats()        {"hits": 1042, "misses": 12, ...}
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def use(self, backend):
+        """
+        Swap our backend out, ie: for a FileBackend shared between workers
+        """
+        self.backend = backend
+
+    def get(self, key):
+        """
+        Return the cached result for `key`, or TTLCache.MISSING
+        """
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return TTLCache.MISSING
+
+        self.hits += 1
+        return pickle.loads(value)
+
+    def set(self, key, value, generation):
+        """
+        Cache a result, unless we've been cleared since `generation()` was read (the
+        result might be from before the change that cleared us)
+        """
+        if self.backend.generation() == generation:
+            self.backend.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def generation(self):
+        return self.backend.generation()
+
+    def clear(self):
+        self.invalidations += 1
+        self.backend.clear()
+
+    def stats(self):
+        """
+        Return a dict of our hit/miss/invalidation counters, plus whatever our backend reports
+        """
+        stats = dict(self.backend.stats())
+        stats.update({
+            "hits"          : self.hits,
+            "misses"        : self.misses,
+            "invalidations" : self.invalidations
+        })
+        return stats
+
+
+"""
+Backends for our second-level query cache (see hsdb.QueryCache). A backend stores opaque
+(pickled) values by string key, and only needs get(), set(), clear() and generation().
+The generation goes up on every clear(), so results read from the database before a
+clear() don't get written back afterwards
+"""
+
+class MemoryBackend(object):
+    """
+    In-process LRU. Fast, but every worker process has its own copy
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generation = 0
+
+    def get(self, key):
+        value = self._cache.get(key)
+        return None if value is TTLCache.MISSING else value
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def clear(self):
+        self._generation += 1
+        self._cache.clear()
+
+    def generation(self):
+        return self._generation
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class FileBackend(object):
+    """
+    One file per entry, under a directory shared by every worker on the box. Point it
+    somewhere under /dev/shm to keep it in shared memory
+
+    Examples:
+        hsdb.query_cache.use(FileBackend("/dev/shm/hsdb-query-cache", ttl=300))
+    """
+
+    def __init__(self, path, ttl=300):
+        """
+        Args:
+            path (str) Directory to keep entries in. Created if needed
+            ttl (float) Number of seconds an entry lives for. None means forever
+        """
+        self.path = path
+        self.ttl = ttl
+
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # Another worker beat us to it
+                if not os.path.isdir(path):
+                    raise
+
+    def _file(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode("utf-8")
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest())
+
+    def _write(self, filename, value):
+        # Write then rename, so nobody ever reads half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.rename(tmp, filename)
+        except:
+            os.remove(tmp)
+            raise
+
+    def get(self, key):
+        filename = self._file(key)
+        try:
+            if self.ttl is not None and os.stat(filename).st_mtime + self.ttl <= time.time():
+                return None
+            with open(filename, "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, value):
+        self._write(self._file(key), value)
+
+    def clear(self):
+        self._write(os.path.join(self.path, "generation"), str(self.generation() + 1).encode("ascii"))
+
+        for name in os.listdir(self.path):
+            if name == "generation" or name.startswith(".tmp"):
+                continue
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+    def generation(self):
+        try:
+            with open(os.path.join(self.path, "generation"), "rb") as f:
+                return int(f.read() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def stats(self):
+        return {
+            "size"      : len([ name for name in os.listdir(self.path) if name != "generation" and not name.startswith(".tmp") ])
+        }
@@ -0,0 +1,230 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Password hashing and verification, run on a bounded pool of worker processes
+
+argon2 is deliberately slow (that's the point), and running it inline holds a request
+thread (and the GIL) for the duration. Instead, we hand the work off to a process pool.
+When more than `max_queue` hashes are already waiting, we refuse new ones outright
+(CredentialServiceBusy) rather than letting a burst of logins starve everything else
+
+The argon2 cost parameters used for a hash are stored alongside it (see Password), so
+we can raise our costs later and transparently re-hash passwords as people log in
+
+On Python 3, asyncio services can await hashes instead of blocking on them, with
+`hash_password_async()` / `verify_async()`. They raise RuntimeError on Python 2.7
+
+Examples:
+    from hsdb import credentials
+
+    hashed, params = credentials.hash_password("hunter2", user.password_salt)
+    credentials.verify("hunter2", user.password_salt, hashed, params)      True
+
+    # Python 3, inside a coroutine
+    service = credentials.get_service()
+    hashed = await service.hash_password_async("hunter2", user.password_salt)
+    await service.verify_async("hunter2", user.password_salt, hashed, service.params)      True
+"""
+
+import hmac
+import atexit
+import threading
+import multiprocessing
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+from argon2 import argon2_hash
+
+# dict: The argon2 costs new hashes are made with
+DEFAULT_PARAMS = {"t": 2000, "m": 1024, "p": 1}
+
+# dict: The costs our hashes were made with before we started storing them per row
+LEGACY_PARAMS = {"t": 2000, "m": 1024, "p": 1}
+
+
+class CredentialServiceBusy(Exception):
+    """
+    Raised when too many hashes are already queued up
+    """
+    pass
+
+
+def _argon2(password, salt, params):
+    """
+    Runs in a worker process. Exceptions are handed back rather than raised, so that our
+    completion callbacks always fire (Python 2's apply_async has no error callback)
+    """
+    try:
+        return bytes(argon2_hash(password, bytes(salt), t=params["t"], m=params["m"], p=params["p"])), None
+    except Exception as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+def _verify(password, salt, hashed, params):
+    digest, error = _argon2(password, salt, params)
+    if error is not None:
+        return None, error
+    return hmac.compare_digest(digest, bytes(hashed)), None
+
+def _unwrap(result):
+    value, error = result
+    if error is not None:
+        raise ValueError(error)
+    return value
+
+
+class CredentialService(object):
+    """
+    A bounded process pool for argon2 hashing and verification
+    """
+
+    def __init__(self, processes=None, max_queue=64, params=None, timeout=30):
+        """
+        Args:
+            processes (int) Number of worker processes. Defaults to the number of CPUs
+            max_queue (int) Max number of hashes in flight (running or waiting) at once
+            params (dict) argon2 costs for new hashes, {"t": .., "m": .., "p": ..}
+            timeout (float) Max number of seconds the sync API waits on a result
+        """
+        self.processes = processes
+        self.max_queue = max_queue
+        self.params = dict(params or DEFAULT_PARAMS)
+        self.timeout = timeout
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+
+    def close(self):
+        """
+        Shut our worker processes down. They'll be started again if needed
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+    def queued(self):
+        """
+        Return the number of hashes currently in flight
+        """
+        return self._in_flight
+
+    def _submit(self, func, args, callback=None):
+        """
+        Queue up some work, returning a multiprocessing AsyncResult
+        """
+        with self._in_flight_lock:
+            if self._in_flight >= self.max_queue:
+                raise CredentialServiceBusy("{} credential checks already queued".format(self.max_queue))
+            self._in_flight += 1
+
+        def release():
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+        def done(result):
+            release()
+            if callback is not None:
+                callback(result)
+
+        try:
+            return self._get_pool().apply_async(func, args, callback=done)
+        except:
+            release()
+            raise
+
+    def _awaitable(self, func, args):
+        if asyncio is None:
+            raise RuntimeError("Awaitable credential checks require Python 3 (asyncio)")
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def resolve(result):
+            value, error = result
+            if error is not None:
+                loop.call_soon_threadsafe(future.set_exception, ValueError(error))
+            else:
+                loop.call_soon_threadsafe(future.set_result, value)
+
+        self._submit(func, args, callback=resolve)
+        return future
+
+    def hash_password(self, password, salt, params=None):
+        """
+        Hash a password, blocking until it's done
+
+        Returns:
+            A tuple of (hash, params used)
+        """
+        params = dict(params or self.params)
+        return _unwrap(self._submit(_argon2, (password, salt, params)).get(self.timeout)), params
+
+    def verify(self, password, salt, hashed, params=None):
+        """
+        Check a password against a hash made with `params` (LEGACY_PARAMS when None),
+        blocking until it's done
+        """
+        params = params or LEGACY_PARAMS
+        return _unwrap(self._submit(_verify, (password, salt, hashed, params)).get(self.timeout))
+
+    def hash_password_async(self, password, salt, params=None):
+        """
+        Awaitable hash_password(), for the running event loop. Resolves to just the hash,
+        made with `params` or ours. Python 3 only
+        """
+        return self._awaitable(_argon2, (password, salt, dict(params or self.params)))
+
+    def verify_async(self, password, salt, hashed, params=None):
+        """
+        Awaitable verify(), for the running event loop. Python 3 only
+        """
+        return self._awaitable(_verify, (password, salt, hashed, params or LEGACY_PARAMS))
+
+    def needs_rehash(self, params):
+        """
+        Whether or not a hash made with `params` is weaker than (or just different to) ours
+        """
+        return (params or LEGACY_PARAMS) != self.params
+
+
+# Our per-process service. Built on first use, see `configure()`
+_service = []
+
+
+def configure(processes=None, max_queue=64, params=None, timeout=30):
+    """
+    Replace our shared CredentialService with one using these settings
+    """
+    if _service:
+        _service.pop().close()
+
+    _service.append(CredentialService(processes, max_queue, params, timeout))
+    return _service[0]
+
+def get_service():
+    return _service[0] if _service else configure()
+
+def hash_password(password, salt, params=None):
+    return get_service().hash_password(password, salt, params)
+
+def verify(password, salt, hashed, params=None):
+    return get_service().verify(password, salt, hashed, params)
+
+@atexit.register
+def _shutdown():
+    # Stop our workers while the interpreter can still talk to them
+    if _service:
+        _service[0].close()
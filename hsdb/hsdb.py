@@ -1,13 +1,33 @@
 #! /usr/bin/env python2.7
 # -*- coding: latin-1 -*-
 
-import ConfigParser
+import threading
+import json
+import time
+import base64
+import binascii
+import itertools
+import resource
 import os
+import re
+
+from contextlib import contextmanager
+
+try:
+    import ConfigParser
+except ImportError:
+    import configparser as ConfigParser
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
 
 from uuid import uuid4
 from uuid import UUID
 
 from datetime import datetime
+from collections import namedtuple
 
 from sqlalchemy import create_engine
 
@@ -15,27 +35,56 @@ from sqlalchemy import exc
 from sqlalchemy import event
 from sqlalchemy import Table
 from sqlalchemy import Column
+from sqlalchemy import or_
+from sqlalchemy import and_
 from sqlalchemy import select
+from sqlalchemy import bindparam
+from sqlalchemy import func
+from sqlalchemy import literal_column
+from sqlalchemy import TypeDecorator
 from sqlalchemy import VARCHAR
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import LargeBinary
 from sqlalchemy import ForeignKey
+from sqlalchemy.orm import exc as orm_exc
 from sqlalchemy.orm import synonym
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm.attributes import QueryableAttribute
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.inspection import inspect
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.dialects.mysql import BINARY
-from sqlalchemy.dialects.mysql import BOOLEAN
 from sqlalchemy.dialects.mysql import INTEGER
-from sqlalchemy.dialects.mysql import DATETIME
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.ext import baked
 from sqlalchemy.ext.hybrid import Comparator
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm.relationships import RelationshipProperty
+from sqlalchemy.sql import sqltypes
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.dml import Delete
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.elements import TextClause
+
+from .cache import TTLCache
+from .cache import QueryCache
+
+from . import credentials
 
 """
 This whole section is a bit of a hack, but it works. Try to load DB connection vars
 from our config file, overriding/setting where not defined. At a bare minimum, we
 need to have a username and password. Other vars will be set as defaults
 
+Nothing here runs at import time. The config file is only read (and the engine only
+built) the first time something actually needs to talk to the database, or when
+`configure()` is called explicitly
+
 file: ~/.config/homestack
 
 [homestack_databases]
@@ -45,54 +94,878 @@ host = localhost
 port = 3306
 name = MyDBName
 keep_alive = True
+ping_idle = 30
+
+Or, to run off of an embedded SQLite database instead (see `configure_sqlite()`):
+
+[homestack_databases]
+sqlite = /var/lib/homestack/homestack.db
+sqlite_readers = 4
 """
-try:
-    conf_path = os.environ.get("HOMESTACK_CONFIG", "~/.config/homestack")
-    parser = ConfigParser.ConfigParser()
-    parser.read(os.path.expanduser(conf_path))
+def read_config(conf_path=None):
+    """
+    Parse our config file, returning a dict of connection vars
 
-    db_user = parser.get("homestack_databases", "user")
-    db_pass = parser.get("homestack_databases", "pass")
+    Args:
+        conf_path (str) Path to the config file. Defaults to $HOMESTACK_CONFIG, then ~/.config/homestack
+    """
+    try:
+        conf_path = conf_path or os.environ.get("HOMESTACK_CONFIG", "~/.config/homestack")
+        parser = ConfigParser.ConfigParser()
+        parser.read(os.path.expanduser(conf_path))
+
+        if parser.has_option("homestack_databases", "sqlite"):
+            return read_sqlite_config(parser)
+
+        conf = {
+            "user" : parser.get("homestack_databases", "user"),
+            "pass" : parser.get("homestack_databases", "pass")
+        }
+
+    except Exception as e:
+        raise Exception("\nA username and password for the database must be set in ~/.config/homestack\n{}".format(e))
+
+    try:
+        conf["host"] = parser.get("homestack_databases", "host")
+    except ConfigParser.NoOptionError:
+        conf["host"] = "localhost"
+
+    try:
+        conf["port"] = parser.get("homestack_databases", "port")
+    except ConfigParser.NoOptionError:
+        conf["port"] = 3306
+
+    try:
+        conf["name"] = parser.get("homestack_databases", "name")
+    except ConfigParser.NoOptionError:
+        conf["name"] = "homestack"
+
+    try:
+        conf["keep_alive"] = parser.getboolean("homestack_databases", "keep_alive")
+    except:
+        conf["keep_alive"] = False
+
+    try:
+        conf["ping_idle"] = parser.getfloat("homestack_databases", "ping_idle")
+    except:
+        conf["ping_idle"] = None
+
+    return conf
+
+def read_sqlite_config(parser):
+    conf = {
+        "sqlite"        : parser.get("homestack_databases", "sqlite"),
+        "keep_alive"    : False,
+        "ping_idle"     : None
+    }
+
+    try:
+        conf["sqlite_readers"] = parser.getint("homestack_databases", "sqlite_readers")
+    except ConfigParser.NoOptionError:
+        conf["sqlite_readers"] = 4
+
+    return conf
+
+def config_url(conf):
+    """
+    Build a MySQL connection URL out of a dict returned by `read_config()`
+    """
+    return "mysql://{}:{}@{}:{}/{}?charset=utf8".format(
+        conf["user"],
+        conf["pass"],
+        conf["host"],
+        conf["port"],
+        conf["name"])
+
+# Engine options we've always used against MySQL. Only applied to mysql:// URLs, as
+#   other backends (namely SQLite) choke on pool_size and friends
+mysql_engine_defaults = {
+    "encoding"      : "utf8",
+    "pool_recycle"  : 1800,
+    "pool_size"     : 5
+}
+
+# Engine options for an embedded SQLite database, see `configure_sqlite()`. SQLAlchemy hands
+#   file databases a NullPool, re-opening the file (and throwing away its page cache) on every
+#   checkout, so we keep a real pool, shared between threads
+sqlite_engine_defaults = {
+    "poolclass"     : QueuePool,
+    "max_overflow"  : 0,
+    "pool_timeout"  : 30,
+    "connect_args"  : {"check_same_thread": False}
+}
+
+# PRAGMAs run on every connection to an embedded SQLite database. Tuned for a single,
+#   low-power box (ie: a Raspberry Pi running off of an SD card)
+sqlite_pragmas = [
+    ("journal_mode",    "WAL"),                 # Readers and the writer don't block each other
+    ("synchronous",     "NORMAL"),              # Under WAL, only fsync on checkpoints rather than every commit
+    ("mmap_size",       64 * 1024 * 1024),      # Read pages straight out of the OS page cache
+    ("cache_size",      -8192),                 # Per connection page cache, in KiB (when negative)
+    ("temp_store",      "MEMORY"),
+    ("busy_timeout",    5000),                  # ms to wait on another process's write lock
+    ("foreign_keys",    "ON")                   # Enforce them, as InnoDB does
+]
 
-except Exception as e:
-    raise Exception("\nA username and password for the database must be set in ~/.config/homestack\n{}".format(e))
+"""
+Column types. Our schema was designed against MySQL, and these spell out exactly the same
+DDL there (unsigned INTs, fixed width BINARYs). Elsewhere (namely SQLite) they fall back to
+the closest generic type
+"""
+def UnsignedInteger():
+    """
+    INT UNSIGNED on MySQL, a plain INTEGER elsewhere (so SQLite primary keys alias the rowid)
+    """
+    return Integer().with_variant(INTEGER(unsigned=True), "mysql")
 
-try:
-    db_host = parser.get("homestack_databases", "host")
-except ConfigParser.NoOptionError:
-    db_host = "localhost"
+def FixedBinary(length):
+    """
+    BINARY(length) on MySQL, a BLOB elsewhere
+    """
+    return LargeBinary(length).with_variant(BINARY(length), "mysql")
 
-try:
-    db_port = parser.get("homestack_databases", "port")
-except ConfigParser.NoOptionError:
-    db_port = 3306
+# Our ORM base. Declaring models against it doesn't require an engine
+hs_base = declarative_base()
 
-try:
-    db_name = parser.get("homestack_databases", "name")
-except ConfigParser.NoOptionError:
-    db_name = "homestack"
+"""
+Lazily initialized engine state. Everything in here is None until `configure()`
+or `get_engine()` is called. Don't poke at these directly, use the accessors below
+"""
+_settings = {
+    "url"               : None,
+    "engine_factory"    : create_engine,
+    "keep_alive"        : None,
+    "ping_idle"         : None,
+    "scopefunc"         : None,
+    "replicas"          : (),
+    "replica_strategy"  : "round_robin",
+    "sticky_window"     : 5.0,
+    "engine_opts"       : {},
+    "sqlite"            : None
+}
+_state = {
+    "engine"            : None,
+    "replicas"          : [],
+    "session_maker"     : None,
+    "session"           : None
+}
+_state_lock = threading.RLock()
+
+# Callables run against every engine we build, see `on_engine_created()`
+_engine_hooks = []
+
+def configure(url=None, engine_factory=None, keep_alive=None, ping_idle=None, scopefunc=None,
+              replicas=(), replica_strategy="round_robin", sticky_window=5.0, **engine_opts):
+    """
+    Explicitly configure our database connection. Any existing engine is disposed
+    of and will be rebuilt, using these settings, the next time it's needed
+
+    When never called, we fall back to reading ~/.config/homestack on first use
+
+    Examples:
+        hsdb.configure(url="mysql://user:pass@db/homestack", pool_size=10)
+        hsdb.configure(url="sqlite:////tmp/homestack.db")
+        hsdb.configure(url="mysql://primary/homestack", replicas=["mysql://replica1/homestack"])
+
+    Args:
+        url (str) A SQLAlchemy database URL. None means "read it from the config file"
+        engine_factory (callable) Called as `engine_factory(url, **engine_opts)` to build
+            the engine. Defaults to sqlalchemy's `create_engine`
+        keep_alive (bool) Whether or not to install our connection keep-alive listeners.
+            None means "use whatever the config file says"
+        ping_idle (float) With keep_alive on, only ping connections that have sat idle in the
+            pool for longer than this many seconds. None means "ping on every checkout", or
+            whatever the config file says
+        scopefunc (callable) Returns a hashable token identifying the current scope (request,
+            greenlet, task...). Sessions are handed out one per token. Defaults to one per thread
+        replicas (list) URLs of read replicas. When given, reads are spread across them and
+            writes go to `url`, see RoutingSession
+        replica_strategy (str) How to pick a replica for a read, "round_robin" or "least_loaded"
+            (the one with the fewest connections checked out)
+        sticky_window (float) Number of seconds after a scope commits a write during which its
+            reads keep going to the primary, so it reads its own writes
+        engine_opts Additional keyword args (pool_size, pool_recycle, echo...) handed to the factory
+    """
+    with _state_lock:
+        reset()
+        _settings["url"] = url
+        _settings["engine_factory"] = engine_factory or create_engine
+        _settings["keep_alive"] = keep_alive
+        _settings["ping_idle"] = ping_idle
+        _settings["scopefunc"] = scopefunc
+        _settings["replicas"] = tuple(replicas)
+        _settings["replica_strategy"] = replica_strategy
+        _settings["sticky_window"] = sticky_window
+        _settings["engine_opts"] = engine_opts
+        _settings["sqlite"] = None
+
+def configure_sqlite(path, readers=4, pragmas=None, **kwargs):
+    """
+    Run off of an embedded SQLite database rather than a MySQL server (ie: on a single
+    Raspberry Pi). The database file is put in WAL mode and tuned with `sqlite_pragmas`
+
+    SQLite only ever allows one writer, so writes go through a single connection, which
+    BEGINs IMMEDIATE (taking the write lock up front, rather than failing part way through a
+    transaction). Everything else waits its turn on the pool. Plain reads are spread over
+    `readers` read only connections, the same way reads go to replicas (see RoutingSession),
+    and WAL lets them carry on while a write is in progress
+
+    Examples:
+        hsdb.configure_sqlite("/var/lib/homestack/homestack.db")
+        hsdb.configure_sqlite("/var/lib/homestack/homestack.db", readers=2, pragmas={"mmap_size": 0})
+
+    Args:
+        path (str) Path to the database file
+        readers (int) Number of read only connections. 0 sends everything through the writer
+        pragmas (dict) PRAGMAs to set on top of (or, with a value of None, leave out of)
+            `sqlite_pragmas`
+        kwargs Anything else `configure()` takes
+    """
+    with _state_lock:
+        configure(url=_sqlite_url(path), **kwargs)
+        _use_sqlite(path, readers, pragmas)
 
-try:
-    db_keep_alive = parser.getboolean("homestack_databases", "keep_alive")
-except:
-    pass
+def _sqlite_url(path):
+    return "sqlite:///{}".format(os.path.abspath(os.path.expanduser(path)))
 
-# Set up our Engine
-hs_engine = create_engine(
-    "mysql://{}:{}@{}:{}/{}?charset=utf8".format(
-        db_user,
-        db_pass,
-        db_host,
-        db_port,
-        db_name),
-    encoding = "utf8",
-    pool_recycle=1800,
-    pool_size=5)
-
-# Initialize our ORM
-hs_base = declarative_base()
-hs_base.metadata.bind = hs_engine
-hs_session_maker = sessionmaker(bind=hs_engine)
+def _use_sqlite(path, readers, pragmas=None):
+    """
+    Point our settings at an embedded SQLite database. Returns its URL
+    """
+    pragmas = dict(pragmas or {})
+    url = _sqlite_url(path)
+
+    _settings["sqlite"] = {
+        "readers"   : readers,
+        "pragmas"   : [ (name, pragmas.pop(name, value)) for name, value in sqlite_pragmas ] + sorted(pragmas.items())
+    }
+    _settings["replicas"] = (url,) if readers else ()
+    _settings["sticky_window"] = 0
+    return url
+
+def on_engine_created(hook):
+    """
+    Register a callable to be run against each of our engines (the primary and any
+    replicas) as soon as it's built (or right away, if it already has been). Handy for attaching event listeners without forcing
+    the engine into existence at import time. Can be used as a decorator
+
+    Examples:
+        @on_engine_created
+        def log_connects(engine):
+            event.listen(engine, "connect", ...)
+    """
+    with _state_lock:
+        _engine_hooks.append(hook)
+        if _state["engine"] is not None:
+            for engine in [_state["engine"]] + _state["replicas"]:
+                hook(engine)
+
+    return hook
+
+def reset():
+    """
+    Drop our engine, sessionmaker and session. They'll be rebuilt on next use
+    """
+    with _state_lock:
+        if _state["session"] is not None:
+            _state["session"].remove()
+
+        if _state["engine"] is not None:
+            _state["engine"].dispose()
+
+        for replica in _state["replicas"]:
+            replica.dispose()
+
+        hs_base.metadata.bind = None
+        _state["engine"] = _state["session_maker"] = _state["session"] = None
+        _state["replicas"] = []
+        _sticky_scopes.clear()
+
+def get_engine():
+    """
+    Return our engine, building it (and reading our config, if needed) on first call
+    """
+    if _state["engine"] is not None:
+        return _state["engine"]
+
+    with _state_lock:
+        if _state["engine"] is not None:
+            return _state["engine"]
+
+        url = _settings["url"]
+        keep_alive = _settings["keep_alive"]
+        ping_idle = _settings["ping_idle"]
+
+        # No explicit URL, so fall back on the config file like we always have
+        if url is None:
+            conf = read_config()
+            url = _use_sqlite(conf["sqlite"], conf["sqlite_readers"]) if "sqlite" in conf else config_url(conf)
+            if keep_alive is None:
+                keep_alive = conf["keep_alive"]
+            if ping_idle is None:
+                ping_idle = conf["ping_idle"]
+
+        engine = _build_engine(url, keep_alive, ping_idle)
+        _state["replicas"] = [ _build_engine(replica, keep_alive, ping_idle, writer=False) for replica in _settings["replicas"] ]
+
+        hs_base.metadata.bind = engine
+        _state["engine"] = engine
+
+    return engine
+
+def get_replicas():
+    """
+    Return our read replica engines (if any), building everything if needed
+    """
+    get_engine()
+    return _state["replicas"]
+
+def _build_engine(url, keep_alive, ping_idle, writer=True):
+    backend = make_url(url).get_backend_name()
+    sqlite = _settings["sqlite"] if backend == "sqlite" else None
+
+    engine_opts = {}
+    if backend == "mysql":
+        engine_opts.update(mysql_engine_defaults)
+    elif sqlite is not None:
+        engine_opts.update(sqlite_engine_defaults)
+        engine_opts["pool_size"] = 1 if writer else sqlite["readers"]
+    engine_opts.update(_settings["engine_opts"])
+
+    engine = _settings["engine_factory"](url, **engine_opts)
+
+    if keep_alive:
+        install_keep_alive(engine, ping_idle)
+
+    if sqlite is not None:
+        install_sqlite_profile(engine, sqlite["pragmas"], writer)
+
+    for hook in _engine_hooks:
+        hook(engine)
+
+    return engine
+
+def install_sqlite_profile(engine, pragmas, writer=True):
+    """
+    Set our PRAGMAs on every new connection to an embedded SQLite database, and take over
+    BEGINning transactions from pysqlite (which only BEGINs lazily, right before the first
+    INSERT/UPDATE/DELETE, so reads aren't part of the transaction). The writer BEGINs
+    IMMEDIATE, readers are query only
+
+    Args:
+        engine (Engine) A SQLite engine
+        pragmas (list) (name, value) pairs. Those with a value of None are skipped
+        writer (bool) Whether or not this engine is our writer
+    """
+    begin = "BEGIN IMMEDIATE" if writer else "BEGIN"
+
+    @event.listens_for(engine, "connect")
+    def sqlite_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            if value is not None:
+                cursor.execute("PRAGMA {}={}".format(name, value))
+        if not writer:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def sqlite_begin(connection):
+        connection.execute(begin)
+
+# Pools we've inherited from a parent process, see `after_fork()`
+_inherited_pools = []
+
+def after_fork():
+    """
+    Call this in a freshly forked child (ie: gunicorn's `post_fork` hook) before touching
+    the database. The child gets a brand new, empty connection pool and session registry,
+    rather than discarding inherited connections one failed checkout at a time
+
+    On Pythons with `os.register_at_fork` (3.7+) this happens automatically
+
+    Inherited connections are deliberately left open (and referenced, so they're never
+    garbage collected). Closing them would send a QUIT down sockets the parent is still using
+    """
+    global _state_lock
+
+    # Another thread may have been holding our lock when we forked. It won't ever let go
+    _state_lock = threading.RLock()
+
+    engines = [_state["engine"]] + _state["replicas"] if _state["engine"] is not None else []
+    for engine in engines:
+        _inherited_pools.append(engine.pool)
+        engine.pool = engine.pool.recreate()
+
+    # Same deal for sessions, which may be holding on to the parent's connections
+    if _state["session"] is not None:
+        _inherited_pools.append(_state["session"])
+        _state["session"] = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=after_fork)
+
+def get_session_maker():
+    """
+    Return the sessionmaker bound to our engine, building both if needed
+    """
+    if _state["session_maker"] is not None:
+        return _state["session_maker"]
+
+    with _state_lock:
+        if _state["session_maker"] is None:
+            session_class = RoutingSession if get_replicas() else Session
+            _state["session_maker"] = sessionmaker(bind=get_engine(), class_=session_class)
+
+    return _state["session_maker"]
+
+"""
+Read/write splitting. When replicas are configured, our sessions are RoutingSessions,
+which send plain reads to a replica and everything else to the primary
+"""
+
+# TTLCache: scope token -> True, for scopes that recently committed a write
+_sticky_scopes = TTLCache(maxsize=100000, ttl=None)
+
+def _scope_token():
+    own = getattr(_own_sessions, "scope", None)
+    if own is not None:
+        return own
+
+    scopefunc = _settings["scopefunc"]
+    return scopefunc() if scopefunc is not None else threading.current_thread().ident
+
+class RoutingSession(Session):
+    """
+    A Session that spreads reads across our replicas. Statements go to the primary when:
+
+        We're flushing, or running an INSERT/UPDATE/DELETE
+        The SELECT locks rows (with_for_update())
+        It's a text() statement that isn't a plain SELECT
+        We're inside a transaction() or use_primary() block
+        This session has flushed anything in its current transaction
+        This scope committed a write less than `sticky_window` seconds ago ("read your writes")
+
+    Everything else is a read, and goes to a replica
+    """
+
+    _round_robin = itertools.count()
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = get_engine()
+        replicas = _state["replicas"]
+
+        if (not replicas
+                or self._flushing
+                or isinstance(clause, UpdateBase)
+                or getattr(clause, "_for_update_arg", None) is not None
+                or (isinstance(clause, TextClause) and not _read_only_text(clause))
+                or self.info.get("transaction_depth")
+                or self.info.get("use_primary")
+                or self.info.get("wrote")
+                or _scope_token() in _sticky_scopes):
+            return primary
+
+        if _settings["replica_strategy"] == "least_loaded":
+            return min(replicas, key=_checked_out)
+
+        return replicas[next(self._round_robin) % len(replicas)]
+
+# Raw SQL we're happy to send to a replica: a SELECT that doesn't lock anything
+_read_only_sql = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+_locking_sql = re.compile(r"\bFOR\s+(UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b", re.IGNORECASE)
+
+def _read_only_text(clause):
+    return bool(_read_only_sql.match(clause.text)) and not _locking_sql.search(clause.text)
+
+def _checked_out(engine):
+    checkedout = getattr(engine.pool, "checkedout", None)
+    return checkedout() if checkedout is not None else 0
+
+@event.listens_for(RoutingSession, "after_flush")
+def routing_after_flush(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def routing_after_commit(session):
+    if session.info.pop("wrote", False) and _settings["sticky_window"]:
+        _sticky_scopes.set(_scope_token(), True, ttl=_settings["sticky_window"])
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def routing_after_transaction_end(session, transaction):
+    # Rolled back (committing already popped it), so there's nothing of ours to go read back
+    if transaction.parent is None:
+        session.info.pop("wrote", None)
+
+"""
+Second-level query cache. Off unless a model sets `__query_cache__ = True`, in which case
+its prepared filter_by() and list() calls are answered from `query_cache`, keyed on the
+query's shape and parameters. Any write to one of those tables clears the cache
+"""
+
+# QueryCache: Shared by every session. Swap the backend with `query_cache.use(...)`
+query_cache = QueryCache()
+
+# set: Tables we've put rows from into the cache, which stay invalidated on writes even if
+#   their model opts back out
+_query_cached_tables = set()
+
+def _query_cached(table):
+    """
+    Whether or not writes to `table` have to clear the query cache. Worked out on each write
+    rather than up front, as models can opt in (or out) at any time
+    """
+    if table.name in _query_cached_tables:
+        return True
+    return any( cls.__table__ is table and getattr(cls, "__query_cache__", False)
+                for cls in HomestackDatabase.__subclasses__() )
+
+"""
+Prepared statements. filter_by() and list() recognise the shape of the query they're
+asked for (model, filter_by keys, eager loading) and build it once, as a baked query.
+After that, each call only binds new parameter values; building the Query, compiling it
+to SQL and working out how to load its rows are all skipped
+"""
+
+class StatementCache(object):
+    """
+    Our baked (prepared) query cache, with hit/miss counters
+
+    Examples:
+        hsdb.statement_cache.resize(1000)
+        hsdb.statement_cache.stats()        {"hits": 10412, "misses": 31, "hit_rate": 0.997, ...}
+    """
+
+    def __init__(self, size=500):
+        self.resize(size)
+
+    def resize(self, size):
+        """
+        Start over with room for `size` statements. A size of 0 turns preparing statements
+        off, and our helpers go back to building a fresh Query every call
+        """
+        self.size = size
+        self.bakery = baked.bakery(size=max(size, 1))
+        self.shapes = TTLCache(maxsize=max(size, 1), ttl=None)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def __call__(self, initial_fn, *args):
+        return self.bakery(initial_fn, *args)
+
+    def run(self, bq, session, params):
+        """
+        Run a baked query, returning all of its rows
+        """
+        if bq._effective_key(session) in self.bakery.cache:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return bq(session).params(**params).all()
+
+    def clear(self):
+        self.resize(self.size)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            "hit_rate"  : float(self.hits) / total if total else 0.0,
+            "size"      : len(self.bakery.cache),
+            "shapes"    : len(self.shapes),
+            "maxsize"   : self.size
+        }
+
+# StatementCache: Shared by every session
+statement_cache = StatementCache()
+
+# Steps shared by every PreparedQuery. Baked query steps are cached by their code, so
+#   these have to be the same functions every time
+_first_row = lambda query: query.slice(0, 1)
+_count_rows = lambda query: query.from_self(func.count(literal_column("*")))
+
+class PreparedQuery(object):
+    """
+    What filter_by() and list() hand back for query shapes we can prepare. Runs all(),
+    first(), one(), one_or_none(), count(), scalar() and iteration from the statement
+    cache (and the second-level query cache, for models that opted in)
+
+    Anything else (filter(), order_by(), [0], [:10]...) is handed to the regular Query it
+    stands for, so chaining hands back a plain Query and carries on from there
+    """
+
+    def __init__(self, model, shape, bq, params):
+        self.model = model
+        self.shape = shape
+        self.session = model.get_session()
+        self._bq = bq
+        self._prepared_params = params
+
+    def _query(self):
+        return self._bq(self.session).params(**self._prepared_params)._as_query()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self._query(), name)
+
+    def __getitem__(self, item):
+        return self._query()[item]
+
+    def __clause_element__(self):
+        return self._query().__clause_element__()
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __str__(self):
+        return str(self._query())
+
+    def _run(self, variant, bq):
+        session = self.session
+        model, keys, eager = self.shape
+
+        if not getattr(model, "__query_cache__", False) or eager is not None \
+                or session.new or session.dirty or session.deleted:
+            return statement_cache.run(bq, session, self._prepared_params)
+
+        key = "{}.{}({}) {} {}".format(model.__name__, "filter_by" if keys else "list", ",".join(keys), variant,
+                                      repr(sorted(self._prepared_params.items())))
+
+        rows = query_cache.get(key)
+        if rows is TTLCache.MISSING:
+            _query_cached_tables.add(model.__table__.name)
+            generation = query_cache.generation()
+            rows = statement_cache.run(bq, session, self._prepared_params)
+            query_cache.set(key, rows, generation)
+            return rows
+
+        if variant == "count":
+            return rows
+        return [ session.merge(row, load=False) for row in rows ]
+
+    def all(self):
+        return self._run("all", self._bq)
+
+    def first(self):
+        rows = self._run("first", self._bq.with_criteria(_first_row))
+        return rows[0] if rows else None
+
+    def one_or_none(self):
+        rows = self.all()
+        if len(rows) > 1:
+            raise orm_exc.MultipleResultsFound("Multiple rows were found for one_or_none()")
+        return rows[0] if rows else None
+
+    def one(self):
+        rows = self.all()
+        if not rows:
+            raise orm_exc.NoResultFound("No row was found for one()")
+        if len(rows) > 1:
+            raise orm_exc.MultipleResultsFound("Multiple rows were found for one()")
+        return rows[0]
+
+    def scalar(self):
+        return self.one_or_none()
+
+    def count(self):
+        return self._run("count", self._bq.with_criteria(_count_rows))[0][0]
+
+
+def get_session():
+    """
+    Return our scoped session registry, creating it on first use
+
+    The registry hands out one Session per scope (per thread, unless `configure()` was
+    given a `scopefunc`), and proxies Session methods (add, commit, query...) through to
+    the Session belonging to the current scope. Call it to get at the Session itself
+    """
+    if _state["session"] is not None:
+        return _state["session"]
+
+    with _state_lock:
+        if _state["session"] is None:
+            session = scoped_session(get_session_maker(), scopefunc=_settings["scopefunc"])
+            session.registry = _LimitedRegistry(session.registry)
+            _state["session"] = session
+
+    return _state["session"]
+
+# threading.local: The Session (and scope token) `own_session()` has put this thread on, if any
+_own_sessions = threading.local()
+
+@contextmanager
+def own_session(scope=None):
+    """
+    Run the block on a Session of its own, straight from our sessionmaker. Every helper
+    called on this thread inside the block uses it in place of the scoped session, without
+    ever calling `scopefunc`. The session is closed on the way out
+
+    Meant for worker threads doing work on somebody else's behalf (see hsdb.aio), where
+    a `scopefunc` (ie: one session per asyncio task) means nothing, or can't even be called
+
+    Args:
+        scope (hashable) The scope token to do the work as, so read-your-writes (see
+            RoutingSession) follows whoever the work is for. Defaults to a token of its own
+    """
+    previous = getattr(_own_sessions, "session", None), getattr(_own_sessions, "scope", None)
+    session = get_session_maker()()
+    _own_sessions.session = session
+    _own_sessions.scope = scope if scope is not None else object()
+
+    try:
+        yield session
+    finally:
+        _own_sessions.session, _own_sessions.scope = previous
+        session.close()
+
+
+"""
+Session lifetime limits, for long-running workers. Each time the scoped session is used
+(`Model.query()`, `insert()`, `get_session()`...), we check whether it's outlived any of
+`_session_limits`, and if so, close it out and start the scope on a fresh one. That only
+happens at a commit boundary: no database transaction open on it, and nothing pending.
+Closing it empties its identity map, which is the whole point, so anything loaded through
+it before then is detached
+"""
+
+_session_limits = {
+    "enabled"           : False,
+    "max_operations"    : None,
+    "max_age"           : None,
+    "max_objects"       : None,
+    "max_memory"        : None,
+    "memory_interval"   : 1.0
+}
+
+# int: Number of sessions we've recycled in this process
+_session_recycles = [0]
+
+def limit_sessions(max_operations=None, max_age=None, max_objects=None, max_memory=None, memory_interval=1.0):
+    """
+    Recycle sessions that have been used too much, lived too long or grown too big. Call
+    with no arguments to turn limits back off
+
+    A session that's over a limit is recycled the next time it's used after a commit (or
+    rollback), with nothing left unflushed. Objects loaded through it are detached at that
+    point, and anything a commit expired on them can't be loaded again, so hang on to ids
+    (or reload) between jobs rather than holding on to objects
+
+    Examples:
+        hsdb.limit_sessions(max_operations=10000, max_age=300)
+        hsdb.limit_sessions(max_objects=5000)     Keep the identity map bounded
+
+    Args:
+        max_operations (int) Recycle after the session has been used this many times
+        max_age (float) Recycle once the session is this many seconds old
+        max_objects (int) Recycle once the session's identity map holds this many objects
+        max_memory (int) Recycle once the process' resident memory is over this many bytes
+        memory_interval (float) Check memory at most once per this many seconds
+    """
+    limits = (max_operations, max_age, max_objects, max_memory)
+    _session_limits.update({
+        "enabled"           : any(limit is not None for limit in limits),
+        "max_operations"    : max_operations,
+        "max_age"           : max_age,
+        "max_objects"       : max_objects,
+        "max_memory"        : max_memory,
+        "memory_interval"   : memory_interval
+    })
+
+def _resident_memory():
+    """
+    Return our resident set size in bytes. Falls back to the peak RSS off of Linux
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _session_expired(session, info, now):
+    limits = _session_limits
+
+    if limits["max_operations"] is not None and info["operations"] >= limits["max_operations"]:
+        return True
+
+    if limits["max_age"] is not None and now - info["created"] >= limits["max_age"]:
+        return True
+
+    if limits["max_objects"] is not None and len(session.identity_map) >= limits["max_objects"]:
+        return True
+
+    if limits["max_memory"] is not None and now - info.get("memory_checked", 0) >= limits["memory_interval"]:
+        info["memory_checked"] = now
+        if _resident_memory() >= limits["max_memory"]:
+            return True
+
+    return False
+
+def _recycle_safe(session):
+    info = session.info
+    return not info.get("in_transaction") and not info.get("transaction_depth") and not info.get("use_primary") \
+        and not session.new and not session.dirty and not session.deleted
+
+@event.listens_for(Session, "after_begin")
+def limits_after_begin(session, transaction, connection):
+    session.info["in_transaction"] = True
+
+@event.listens_for(Session, "after_transaction_end")
+def limits_after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("in_transaction", None)
+
+class _LimitedRegistry(object):
+    """
+    Wraps a scoped_session's registry, enforcing `_session_limits` each time the current
+    scope's session is fetched
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __call__(self):
+        session = getattr(_own_sessions, "session", None)
+        if session is not None:
+            return session
+
+        session = self.registry()
+        if not _session_limits["enabled"]:
+            return session
+
+        info = session.info
+        now = time.time()
+        if "created" not in info:
+            info["created"] = now
+            info["operations"] = 0
+
+        info["operations"] += 1
+        if _recycle_safe(session) and _session_expired(session, info, now):
+            session.close()
+            _session_recycles[0] += 1
+            info["created"] = now
+            info["operations"] = 0
+
+        return session
+
+    def has(self):
+        return getattr(_own_sessions, "session", None) is not None or self.registry.has()
+
+    def set(self, obj):
+        self.registry.set(obj)
+
+    def clear(self):
+        # An own_session() is closed at the end of its block, it isn't ours to discard
+        if getattr(_own_sessions, "session", None) is None:
+            self.registry.clear()
 
 
 """
@@ -101,12 +974,22 @@ When using flask-sqlalchemy, this is all handled for you (amongst other stuff)
     but since we wanted to diorce our models from our web app (so we can easily
     use them elsewhere), we now have to handle this ourselves
 """
-if db_keep_alive:
+def install_keep_alive(engine, ping_idle=None):
+    """
+    Attach our keep-alive and pid-tracking listeners to the given engine
+
+    Args:
+        engine (Engine) The engine to attach to
+        ping_idle (float) Only ping connections that have been sitting idle in the pool for
+            longer than this many seconds. A connection that was in use a moment ago is all
+            but guaranteed to still be alive, and pinging it is a wasted round trip. None
+            (or 0) pings on every checkout
+    """
 
     """
     Listen for engine connections, and ensure they're alive
     """
-    @event.listens_for(hs_engine, "engine_connect")
+    @event.listens_for(engine, "engine_connect")
     def ping_connection(connection, branch):
         """
         Branch refers to a child connection of a given connection.
@@ -115,6 +998,15 @@ if db_keep_alive:
         if branch:
             return
 
+        """
+        Skip the ping for connections that were in use recently. `last_used` lives on the
+        connection record, and is stamped on connect and on every checkin
+        """
+        if ping_idle:
+            last_used = connection.info.get("last_used")
+            if last_used is not None and time.time() - last_used < ping_idle:
+                return
+
         """
         Disable "close with result".  This flag is only used with "connectionless"
         execution, otherwise will be False by default
@@ -161,14 +1053,22 @@ if db_keep_alive:
     Possible improvements for pool when involved in subprocesses
     Reference: http://docs.sqlalchemy.org/en/latest/core/pooling.html
     """
-    @event.listens_for(hs_engine, "connect")
+    @event.listens_for(engine, "connect")
     def connect(dbapi_connection, connection_record):
         connection_record.info['pid'] = os.getpid()
+        connection_record.info['last_used'] = time.time()
+
+    """
+    Track when each connection was last handed back to the pool, see `ping_idle`
+    """
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        connection_record.info['last_used'] = time.time()
 
     """
     Prohibit interprocess hijacking of connetions
     """
-    @event.listens_for(hs_engine, "checkout")
+    @event.listens_for(engine, "checkout")
     def checkout(dbapi_connection, connection_record, connection_proxy):
         pid = os.getpid()
         if connection_record.info['pid'] != pid:
@@ -178,6 +1078,59 @@ if db_keep_alive:
                     connection_record.info['pid'],
                     pid))
 
+def _batches(iterable, size):
+    """
+    Chop an iterable up into lists of at most `size` items
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+def _group_by_keys(params):
+    """
+    Split a list of dicts into lists of dicts that all share the same keys
+    """
+    groups = {}
+    for row in params:
+        groups.setdefault(frozenset(row), []).append(row)
+    return groups.values()
+
+def _encode_binary(value):
+    return base64.b64encode(value).decode("ascii")
+
+def _is_binary(type_):
+    # Looking through with_variant() (ie: FixedBinary) to the generic type
+    type_ = getattr(type_, "impl", type_)
+    return isinstance(type_, (LargeBinary, sqltypes.BINARY))
+
+def json_default(value):
+    """
+    What serialize_iter() and serialize_json_array() hand json.dumps() for values it can't
+    handle natively: base64 for bytes, ISO 8601 for datetimes
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return _encode_binary(bytes(value))
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+class _lazy(object):
+    """
+    Tiny descriptor that defers class-level attributes (our engine, session...) until
+    they're first accessed, so that simply importing our models doesn't hit the DB
+    """
+    def __init__(self, getter):
+        self.getter = getter
+
+    def __get__(self, instance, owner):
+        return self.getter()
+
 """
 Begin actually defining our databaes!
 """
@@ -190,27 +1143,159 @@ class HomestackDatabase(object):
     """
 
     _base           = hs_base
-    _engine         = hs_engine
-    _session_maker  = hs_session_maker
-    _session        = hs_session_maker()
+    _engine         = _lazy(get_engine)
+    _session_maker  = _lazy(get_session_maker)
+    _session        = _lazy(get_session)
 
     @classmethod
     def get_session(cls):
         """
         Sometimes, we just need a damn session. This lets us simple do
         things like `session = Users.get_session()`. Is nice, I take.
+
+        Returns the Session belonging to the current scope (thread, by default)
+        """
+        return cls._session()
+
+    @classmethod
+    def begin_session(cls):
+        """
+        Start a fresh session for the current scope, discarding any session that was
+        left lying around in it. Call this at the start of a request/job
+
+        Examples:
+            @app.before_request
+            def before_request():
+                HomestackDatabase.begin_session()
+        """
+        cls._session.remove()
+        return cls._session()
+
+    @classmethod
+    def remove_session(cls):
+        """
+        Close and discard the session for the current scope, rolling back anything left
+        uncommitted and returning its connection to the pool. Call this at the end of a
+        request/job
+
+        Examples:
+            @app.teardown_request
+            def teardown_request(exception=None):
+                HomestackDatabase.remove_session()
+        """
+        cls._session.remove()
+
+    @classmethod
+    def session_stats(cls):
+        """
+        Report on the current scope's session, and how many sessions we've recycled
+
+        Examples:
+            HomestackDatabase.session_stats()
+                {"objects": 1200, "new": 0, "dirty": 3, "deleted": 0, "operations": 815, "age": 41.2, "recycles": 6}
         """
-        return cls._session
+        session = cls.get_session()
+        info = session.info
+        return {
+            "objects"       : len(session.identity_map),
+            "new"           : len(session.new),
+            "dirty"         : len(session.dirty),
+            "deleted"       : len(session.deleted),
+            "operations"    : info.get("operations"),
+            "age"           : time.time() - info["created"] if "created" in info else None,
+            "recycles"      : _session_recycles[0]
+        }
+
+    @classmethod
+    @contextmanager
+    def transaction(cls):
+        """
+        Group a bunch of helper calls into a single transaction. Inside the block, insert(),
+        delete() and friends only stage their changes, and everything is committed once on
+        the way out (or rolled back, if something blows up)
+
+        Blocks can be nested. Inner blocks are wrapped in a SAVEPOINT, so an exception
+        inside one only rolls back that block's work
+
+        Staged rows don't have their primary keys until they're flushed. Wire rows together
+        with relationships (`ApiKey.insert(user=user)`), or call `session.flush()` if you
+        need an id in the middle of the block
+
+        Examples:
+            with User.transaction():
+                user = User.insert(username="mike")
+                user.user_groups.append(UserGroup.filter_by(name="user").first())
+                ApiKey.insert(user=user, description="mike's key")
+        """
+        session = cls.get_session()
+        depth = session.info.get("transaction_depth", 0)
+        savepoint = session.begin_nested() if depth else None
+        session.info["transaction_depth"] = depth + 1
+
+        try:
+            yield session
+
+        except:
+            session.info["transaction_depth"] = depth
+            if savepoint is not None:
+                savepoint.rollback()
+            else:
+                session.rollback()
+            raise
+
+        session.info["transaction_depth"] = depth
+        if savepoint is not None:
+            savepoint.commit()
+        else:
+            session.commit()
+
+    @classmethod
+    @contextmanager
+    def use_primary(cls):
+        """
+        Send every statement inside the block to the primary, even plain reads. Only
+        matters when read replicas are configured
+
+        Examples:
+            with User.use_primary():
+                user = User.filter_by(username="mike").first()
+        """
+        session = cls.get_session()
+        session.info["use_primary"] = session.info.get("use_primary", 0) + 1
+
+        try:
+            yield session
+        finally:
+            session.info["use_primary"] -= 1
+
+    @classmethod
+    def _commit(cls):
+        """
+        Commit our session, unless we're inside a transaction() block, in which case
+        committing is left to the block
+        """
+        session = cls.get_session()
+        if not session.info.get("transaction_depth"):
+            session.commit()
 
     @classmethod
     def filter_by(cls, *args, **kwargs):
         """
         `filter_by()` is for simple 'where' clauses. This makes that feel more natural
 
+        Pass `eager=` to eager load relationships, see `eager()`
+
         Examples:
             Users.filter_by(name='Mike')    Literally, get all rows from `Users` where `name=Mike`
+            UserGroup.filter_by(name='user', eager=2)
         """
-        return cls.query().filter_by(*args, **kwargs)
+        eager = kwargs.pop("eager", None)
+
+        prepared = cls._prepared(kwargs, eager) if not args else None
+        if prepared is not None:
+            return prepared
+
+        return cls.eager(cls.query(), eager).filter_by(*args, **kwargs)
 
     @classmethod
     def filter(cls, *args, **kwargs):
@@ -219,12 +1304,15 @@ class HomestackDatabase(object):
         This again, lets us write a little less code, but otherwise functions exactly
             the same as the built-in filter() function
 
+        Pass `eager=` to eager load relationships, see `eager()`
+
         Examples:
             Users.filter(or_(Users.name='Mike', Users.username='mDog'))
                 instead of...
             Users.query().filter(...)
         """
-        return cls.query().filter(*args, **kwargs)
+        eager = kwargs.pop("eager", None)
+        return cls.eager(cls.query(), eager).filter(*args, **kwargs)
 
     @classmethod
     def search(cls, *args, **kwargs):
@@ -232,62 +1320,450 @@ class HomestackDatabase(object):
         Functions exactly the same way as our filter() method, returning the same data
         This just reads more nicely in code than filter() does
         """
-        return cls.query().filter(*args, **kwargs)
+        return cls.filter(*args, **kwargs)
+
+    @classmethod
+    def list(cls, eager=None):
+        """
+        Another helper/idiot method to literally just return a list of objects
+
+        Examples:
+            user_list = Users.list()
+            group_list = UserGroup.list(eager=2)    Load everything serialize(depth=2) will need
+        """
+        prepared = cls._prepared({}, eager)
+        if prepared is not None:
+            return prepared.all()
+
+        return cls.eager(cls.query(), eager).all()
+
+    @classmethod
+    def _prepared(cls, kwargs, eager):
+        """
+        Return a PreparedQuery for `filter_by(**kwargs)`, or None when it can't be prepared
+        (ie: it compares against None, which has to be spelled IS NULL, or against something
+        that isn't a plain column, or it's eager loading with loader options, which are new
+        objects every call and would never be the same shape twice)
+        """
+        if not statement_cache.enabled or None in kwargs.values():
+            return None
+
+        if isinstance(eager, list):
+            if not all(isinstance(option, (string_types, QueryableAttribute)) for option in eager):
+                return None
+            eager = tuple(eager)
+        elif eager is not None and not isinstance(eager, int):
+            return None
+
+        keys = tuple(sorted(kwargs))
+        shape = (cls, keys, eager)
+
+        bq = statement_cache.shapes.get(shape)
+        if bq is TTLCache.MISSING:
+            try:
+                criteria = [ getattr(cls, key) == bindparam("filter_{}".format(key)) for key in keys ]
+            except Exception:
+                criteria = None
+
+            if criteria is None:
+                bq = False
+            else:
+                bq = statement_cache(lambda session: session.query(cls), cls)
+                bq.add_criteria(lambda query: cls.eager(query, list(eager) if isinstance(eager, tuple) else eager).filter(*criteria), keys, eager)
+
+            statement_cache.shapes.set(shape, bq)
+
+        if bq is False:
+            return None
+
+        return PreparedQuery(cls, shape, bq, dict( ("filter_{}".format(key), value) for key, value in kwargs.items() ))
+
+    @classmethod
+    def eager(cls, query, eager):
+        """
+        Apply eager loading to a query, so walking relationships afterwards (ie: in
+        serialize()) doesn't fire off a lazy load per object. Relationships are loaded
+        with SELECT ... IN, so it's one extra query per relationship, not per row
+
+        Args:
+            query (Query) The query to apply our loader options to
+            eager (int|list) Either:
+                An int `n`, to load everything that serialize(depth=n) will walk through
+                A list of relationships (`UserGroup.roles`) or loader options (`joinedload(...)`)
+                None to leave things lazy
+        """
+        if not eager:
+            return query
+
+        if isinstance(eager, int):
+            return query.options(*cls._serialize_loaders(eager))
+
+        return query.options(*[ selectinload(option) if isinstance(option, (string_types, QueryableAttribute)) else option for option in eager ])
+
+    # dict: (class, depth) -> loader options, see `_serialize_loaders()`
+    _serialize_loader_cache = {}
+
+    @classmethod
+    def _serialize_loaders(cls, depth):
+        """
+        Build selectinload() chains along every relationship serialize(depth) will walk
+        """
+        loaders = HomestackDatabase._serialize_loader_cache.get((cls, depth))
+        if loaders is not None:
+            return loaders
+
+        loaders = []
+        for path in cls._serialize_paths(depth):
+            loader = selectinload(path[0])
+            for attr in path[1:]:
+                loader = loader.selectinload(attr)
+            loaders.append(loader)
+
+        loaders = HomestackDatabase._serialize_loader_cache[(cls, depth)] = tuple(loaders)
+        return loaders
+
+    @classmethod
+    def _serialize_paths(cls, depth):
+        """
+        Return every relationship path serialize(depth) walks, as tuples of attributes
+            ie: [(User.user_groups, UserGroup.roles)]
+        """
+        paths = []
+        for key, uselist, target in cls._serialize_plan(depth, False)[1]:
+            attr = getattr(cls, key)
+            children = target._serialize_paths(depth - 1)
+
+            if children:
+                paths.extend((attr,) + child for child in children)
+            else:
+                paths.append((attr,))
+
+        return paths
+
+    @classmethod
+    def paginate(cls, order_by=None, after=None, limit=50, desc=False, query=None):
+        """
+        Keyset (aka "seek") pagination. Rather than OFFSET, which makes the DB walk past
+        every row on every page before it, each page picks up right after the last row
+        of the previous one. With `order_by` on indexed columns, page 1000 costs the same
+        as page 1
+
+        The primary key is always tacked on to `order_by` as a tie-breaker. InnoDB secondary
+        indexes carry the primary key, so an index on `User.time` covers (time, user_id)
+
+        Examples:
+            page = User.paginate(order_by=[User.time], limit=100)
+            page = User.paginate(order_by=[User.time], after=page.next_cursor, limit=100)
+            page = ApiKey.paginate(order_by=[ApiKey.created], desc=True, query=ApiKey.filter_by(user_id=1))
+
+        Args:
+            order_by (list) Columns to order by. Defaults to the primary key
+            after (str) The `next_cursor` from the previous page. None for the first page.
+                Anything that isn't a cursor for these columns raises ValueError
+            limit (int) The max number of rows per page
+            desc (bool) Walk in descending order instead
+            query (Query) Page through this query rather than the whole table
+
+        Returns:
+            A Page(items, next_cursor). `next_cursor` is None on the last page
+        """
+        columns = cls._paginate_columns(order_by)
+        query = cls.query() if query is None else query
+
+        if after is not None:
+            query = query.filter(_seek_clause(columns, _decode_cursor(after, len(columns)), desc))
+
+        query = query.order_by(*[ column.desc() if desc else column.asc() for column in columns ])
+
+        # Grab an extra row so we know whether or not there's another page
+        items = query.limit(limit + 1).all()
+        if len(items) <= limit:
+            return Page(items, None)
+
+        items = items[:limit]
+        last = items[-1]
+        return Page(items, _encode_cursor([ getattr(last, column.key) for column in columns ]))
+
+    @classmethod
+    def iter_pages(cls, order_by=None, after=None, limit=50, desc=False, query=None):
+        """
+        Walk through every page that `paginate()` would hand back, one at a time
+
+        Examples:
+            for page in User.iter_pages(order_by=[User.time], limit=500):
+                for user in page.items:
+                    ...
+        """
+        while True:
+            page = cls.paginate(order_by=order_by, after=after, limit=limit, desc=desc, query=query)
+            yield page
+
+            if page.next_cursor is None:
+                return
+
+            after = page.next_cursor
+
+    @classmethod
+    def _paginate_columns(cls, order_by):
+        """
+        Return our pagination columns, with the primary key tacked on if it isn't there
+        """
+        columns = list(order_by or [])
+        keys = [ column.key for column in columns ]
+
+        for prop in inspect(cls).column_attrs:
+            if prop.columns[0].primary_key and prop.key not in keys:
+                columns.append(getattr(cls, prop.key))
+
+        return columns
+
+    @classmethod
+    def query(cls, *args):
+        """
+        Helper class to let us easily query. query() normally takes a Class as a param,
+            as it's a _session function, but here we expose it and make it more natural
+
+        Examples:
+            Users.query(name).first()       Get the `name` from `Users` of the first() row
+            Users.query().first()           Get the first row returned from `Users`
+
+        Ref: http://docs.sqlalchemy.org/en/latest/orm/tutorial.html#querying
+        """
+
+        # If we have arguments, assume we're querying against what ever class is calling
+        if len(args):
+            return cls._session.query(cls, cls, *args)
+
+        # No args, so assume we're running a generic query() against `this` class
+        return cls._session.query(cls)
+
+    @classmethod
+    def insert(cls, **kwargs):
+        """
+        Helper method to simplify inserts. Create an instance, insert it, commit it, and return it
+
+        Inside a transaction() block, the instance is only staged and committed with the block
+        """
+
+        instance = cls(**kwargs)
+
+        cls._session.add(instance)
+        cls._commit()
+
+        return instance
+
+    @classmethod
+    def insert_many(cls, rows, batch_size=1000, return_pks=False):
+        """
+        Helper method for inserting lots of rows at once. Rather than a round trip and a
+        commit per row (like insert() does), rows are sent `batch_size` at a time using
+        executemany, and committed once at the end
+
+        Rows are dicts of the same kwargs you'd hand to insert(), so hybrids and synonyms
+        (`api_key`, `id`...) work as expected
+
+        Examples:
+            Role.insert_many([{"name": "hue_ro"}, {"name": "nest_ro"}])
+            ids = HueBridge.insert_many(bridges, return_pks=True)
+
+        Args:
+            rows (iterable) Dicts of column values, one per row
+            batch_size (int) The max number of rows to send per executemany
+            return_pks (bool) Whether or not to return the generated primary keys. Note that
+                fetching these means the backend has to insert rows one at a time
+
+        Returns:
+            The number of rows inserted, or a list of primary keys if `return_pks` is set
+        """
+
+        session = cls._session
+        count = 0
+        pks = []
+
+        for batch in _batches(rows, batch_size):
+            instances = [ cls(**row) for row in batch ]
+            session.bulk_save_objects(instances, return_defaults=return_pks)
+            count += len(instances)
+
+            if return_pks:
+                pks.extend(cls._primary_key_of(instance) for instance in instances)
+
+        cls._commit()
+
+        return pks if return_pks else count
 
     @classmethod
-    def list(cls):
+    def upsert_many(cls, rows, conflict_keys=None, batch_size=1000):
         """
-        Another helper/idiot method to literally just return a list of objects
+        Helper method to insert rows, updating the existing row instead whenever one
+        already exists with the same `conflict_keys`
+
+        On MySQL, this is an `INSERT ... ON DUPLICATE KEY UPDATE` per batch (in which case
+        MySQL itself decides what a duplicate is, using every unique key on the table). Other
+        backends (ie: SQLite, for tests) fall back to looking up existing rows by
+        `conflict_keys`, then issuing one executemany for updates and one for inserts
 
         Examples:
-            user_list = Users.list()
+            HueBridge.upsert_many(bridges, conflict_keys=["user"])
+
+        Args:
+            rows (iterable) Dicts of column values, one per row
+            conflict_keys (list) Column names that identify an existing row. Defaults to the primary key
+            batch_size (int) The max number of rows to send per statement
+
+        Returns:
+            The number of rows sent
         """
-        return cls.query().all()
+
+        session = cls._session
+        table = cls.__table__
+        conflict_keys = conflict_keys or [ column.key for column in table.primary_key.columns ]
+        dialect = session.get_bind().dialect.name
+        count = 0
+
+        # Our existence checks have to see the primary, not a lagging replica
+        with cls.use_primary():
+            for batch in _batches(rows, batch_size):
+                params = [ cls._column_values(row) for row in batch ]
+                count += len(params)
+
+                # executemany wants every parameter set to have the same keys
+                for group in _group_by_keys(params):
+                    if dialect == "mysql":
+                        cls._upsert_mysql(session, group, conflict_keys)
+                    else:
+                        cls._upsert_generic(session, group, conflict_keys)
+
+        cls._commit()
+
+        return count
 
     @classmethod
-    def query(cls, *args):
-        """
-        Helper class to let us easily query. query() normally takes a Class as a param,
-            as it's a _session function, but here we expose it and make it more natural
+    def _upsert_mysql(cls, session, params, conflict_keys):
+        stmt = mysql_insert(cls.__table__)
+        pk_keys = [ column.key for column in cls.__table__.primary_key.columns ]
+        updates = dict( (key, stmt.inserted[key]) for key in params[0] if key not in conflict_keys and key not in pk_keys )
 
-        Examples:
-            Users.query(name).first()       Get the `name` from `Users` of the first() row
-            Users.query().first()           Get the first row returned from `Users`
+        # Nothing to update, so a duplicate simply becomes a no-op
+        if not updates:
+            key = conflict_keys[0]
+            updates = { key: stmt.inserted[key] }
 
-        Ref: http://docs.sqlalchemy.org/en/latest/orm/tutorial.html#querying
-        """
+        session.execute(stmt.on_duplicate_key_update(**updates), params)
 
-        # If we have arguments, assume we're querying against what ever class is calling
-        if len(args):
-            return cls._session.query(cls, cls, *args)
+    @classmethod
+    def _upsert_generic(cls, session, params, conflict_keys):
+        table = cls.__table__
+        pk_columns = list(table.primary_key.columns)
+
+        # Rows without a value for every conflict key (ie: no primary key yet) can't match
+        #   anything, so they're plain inserts
+        keyed = [ row for row in params if all(row.get(key) is not None for key in conflict_keys) ]
+
+        # Look up which of our rows already exist, and grab their primary keys. With composite
+        #   keys this selects a superset, which the exact tuple lookup below weeds out
+        key_columns = [ table.c[key] for key in conflict_keys ]
+        existing = {}
+        if keyed:
+            # Labelled, so a conflict key that's also the primary key still comes back twice
+            selected = key_columns + [ column.label("_pk_{}".format(column.key)) for column in pk_columns ]
+            matches = and_(*[ column.in_(set(row[column.key] for row in keyed)) for column in key_columns ])
+            for result in session.execute(select(selected).where(matches)):
+                existing[tuple(result[:len(key_columns)])] = result[len(key_columns):]
+
+        inserts = []
+        updates = []
+        for row in params:
+            pk = existing.get(tuple(row.get(key) for key in conflict_keys))
+            if pk is None:
+                inserts.append(row)
+                continue
 
-        # No args, so assume we're running a generic query() against `this` class
-        return cls._session.query(cls)
+            update = dict( ("_new_{}".format(key), value) for key, value in row.items() )
+            update.update( ("_pk_{}".format(column.key), value) for column, value in zip(pk_columns, pk) )
+            updates.append(update)
+
+        if inserts:
+            session.execute(table.insert(), inserts)
+
+        if updates:
+            stmt = table.update().where(and_(*[ column == bindparam("_pk_{}".format(column.key)) for column in pk_columns ]))
+            stmt = stmt.values(dict( (key, bindparam("_new_{}".format(key))) for key in params[0] ))
+            session.execute(stmt, updates)
 
     @classmethod
-    def insert(cls, **kwargs):
+    def _column_values(cls, row):
         """
-        Helper method to simplify inserts. Create an instance, insert it, commit it, and return it
+        Turn a dict of insert() style kwargs into a dict keyed by table column, running
+        it through our constructor so hybrids and synonyms get applied
         """
+        instance = cls(**row)
+        values = {}
 
-        instance = cls(**kwargs)
+        for prop in cls.__mapper__.column_attrs:
+            if prop.key in instance.__dict__:
+                values[prop.columns[0].key] = instance.__dict__[prop.key]
 
-        cls._session.add(instance)
-        cls._session.commit()
+        return values
 
-        return instance
+    @classmethod
+    def _primary_key_of(cls, instance):
+        pk = cls.__mapper__.primary_key_from_instance(instance)
+        return pk[0] if len(pk) == 1 else tuple(pk)
 
     def delete(self):
         """
         Helper function that allows us to tack on .delete() on a select if we want
         """
         self.__class__._session.delete(self)
-        self.__class__._session.commit()
+        self.__class__._commit()
 
     def _get_hybrid_properties(self):
         return dict( (key, prop) for key, prop in inspect(self).mapper.all_orm_descriptors.items() if isinstance(prop, hybrid_property) )
 
-    def serialize(self, depth=1, hybrid=True):
+    # dict: (class, depth, hybrid) -> compiled serialization plan, see `_serialize_plan()`
+    _serialize_plans = {}
+
+    @classmethod
+    def _serialize_plan(cls, depth, hybrid):
+        """
+        Work out (once per class, depth and hybrid flag) what serialize() needs to walk
+        through, so that serializing thousands of rows doesn't mean inspecting our mapper
+        thousands of times
+
+        The plan is a tuple of:
+            columns     [(key, is_datetime, is_binary)]
+                                                Public column attributes
+            relations   [(key, uselist, class)] Relationships from `__serializable_relations__`
+                                                    to recurse through (only when depth > 1),
+                                                    and the class they point at
+            hybrids     [(key, getter)]         Hybrid properties (only when hybrid is set)
+        """
+        plan_key = (cls, depth, hybrid)
+        plan = HomestackDatabase._serialize_plans.get(plan_key)
+        if plan is not None:
+            return plan
+
+        mapper = inspect(cls)
+
+        columns = [ (prop.key, isinstance(prop.columns[0].type, DateTime), _is_binary(prop.columns[0].type))
+                        for prop in mapper.column_attrs if not prop.key.startswith("_") ]
+
+        relations = []
+        if depth > 1:
+            serializable = getattr(cls, "__serializable_relations__", ())
+            relations = [ (prop.key, prop.uselist, prop.mapper.class_)
+                            for prop in mapper.relationships if prop.key in serializable ]
+
+        hybrids = []
+        if hybrid:
+            hybrids = [ (key, prop.fget)
+                            for key, prop in mapper.all_orm_descriptors.items() if isinstance(prop, hybrid_property) ]
+
+        plan = HomestackDatabase._serialize_plans[plan_key] = (columns, relations, hybrids)
+        return plan
+
+    def serialize(self, depth=1, hybrid=True, binary=None):
         """
         Aren't recursive functions super fun?
 
@@ -302,9 +1778,14 @@ class HomestackDatabase(object):
 
         See the UserGroup class for an example. The `roles` relationship will be serialized
 
+        What gets walked is worked out once per class (see `_serialize_plan()`), so this
+        is cheap to call on lots of rows
+
         Args:
             depth (int) The max number of levels to recurse through
             hybrid (bool) Whether or not to include the serialization of hybrid properties
+            binary (callable) Called on the value of binary columns (salts, hashes...), ie: to
+                encode them for JSON. They're left as raw bytes by default
 
         """
 
@@ -312,85 +1793,350 @@ class HomestackDatabase(object):
         if depth == 0:
             return None
 
+        columns, relations, hybrids = self._serialize_plan(depth, hybrid)
+
         # Our return object
         ret = {}
 
-        # Quick check to see if we're serializiable
-        def is_serializable():
-            if hasattr(self, '__serializable_relations__') and key in self.__serializable_relations__ and depth > 1:
-                return True
-            return False
+        # Columns. Pull straight out of our __dict__ when they're loaded, and let getattr
+        #   take care of (re)loading them when they're not (ie: we've been expired)
+        loaded = self.__dict__
+        for key, is_datetime, is_binary in columns:
+            value = loaded[key] if key in loaded else getattr(self, key)
 
-        # Ensure our session is more fresh than Stunna's coke
-        # This ensures we don't hit weird edge-case scenerios where attributes don't exist
-        attributes = self.__dict__.items()
-        if not [ attr for attr in attributes if attr[0] is str and not attr[0].startswith('_') ]:
-            self._session.refresh(self)
-
-        # For each relationship we've explicitely set as serialziable via __serializable_relations__
-        #   load them!
-        # getattr returns a value, thus implicitely loading our property into this instance
-        properties = self.__mapper__.iterate_properties
-        for prop in properties:
-            if isinstance(prop, RelationshipProperty):
-                key = getattr(prop, 'key')
-                if is_serializable():
-                    getattr(self, key)
-
-        # Begin to actually walk through our object and begin to serialize the data
-        for key, value in self.__dict__.items():
-
-            # If our key looks private, ignore it and continue
-            if key.startswith("_"):
-                continue
+            # How to serialize datetime objects
+            if is_datetime and isinstance(value, datetime):
+                value = value.isoformat()
 
-            # If our value is an instance of HomestackDatabase
-            if isinstance(value, HomestackDatabase):
-                if is_serializable():
-                    ret[key] = value.serialize(depth=depth-1)
+            elif is_binary and binary is not None and value is not None:
+                value = binary(value)
+
+            ret[key] = value
+
+        # Relationships we've explicitely set as serialziable via __serializable_relations__
+        for key, uselist, target in relations:
+            value = getattr(self, key)
 
             # If our value is a list of objects
-            elif isinstance(value, list):
+            if uselist:
+                ret[key] = [ item.serialize(depth=depth-1, binary=binary) for item in value if isinstance(item, HomestackDatabase) ]
+
+            # If our value is an instance of HomestackDatabase
+            elif isinstance(value, HomestackDatabase):
+                ret[key] = value.serialize(depth=depth-1, binary=binary)
 
-                _ret = []
-                for item in value:
+            else:
+                ret[key] = value
 
-                    # Looping through all items, do the same work we do against a single
-                    if isinstance(item, HomestackDatabase):
-                        if is_serializable():
-                            _ret.append(item.serialize(depth=depth-1))
+        # Attempt to serialize our hybrid properties
+        for key, getter in hybrids:
+            value = getter(self)
 
-                ret[key] = _ret
+            # How to serialize datetime objects
+            if isinstance(value, datetime):
+                ret[key] = value.isoformat()
 
-            # Other weird edge cases for serialization
+            # Blind fallback #yolo
             else:
+                ret[key] = value
+
+        # Finally, return our dict
+        return ret
 
-                # How to serialize datetime objects
-                if isinstance(value, datetime):
-                    ret[key] = value.isoformat()
+    @classmethod
+    def serialize_iter(cls, query=None, chunk_size=1000, depth=1, hybrid=True, json_lines=False, default=None, exclude=()):
+        """
+        Serialize the results of a query one row at a time, without ever holding the whole
+        result set in memory like `list()` does. Rows are fetched `chunk_size` at a time in
+        primary key order, with keyset pagination (see `paginate()`), and each chunk has the
+        relationships serialize(depth) walks loaded eagerly before it's serialized
+
+        We deliberately don't stream a server-side cursor. Lazy loads (and eager loading's
+        SELECT ... IN queries) would need the connection while it's still busy streaming,
+        which MySQL drivers can't do
+
+        Examples:
+            for user in User.serialize_iter():
+                ...
+            for line in ApiKey.serialize_iter(ApiKey.filter_by(user_id=1), json_lines=True):
+                export.write(line)
+
+        With `json_lines`, binary columns (ie: `User.password_salt`) come out base64 encoded.
+        Leave anything sensitive out with `exclude`
 
-                # Blind fallback #yolo
+        Args:
+            query (Query) The query to serialize. Defaults to everything in this table. Any
+                ordering it has is replaced, and it shouldn't have a LIMIT or OFFSET
+            chunk_size (int) The number of rows to fetch per round trip
+            depth (int) Passed through to serialize()
+            hybrid (bool) Passed through to serialize()
+            json_lines (bool) Yield lines of JSON (newline terminated) instead of dicts
+            default (callable) Handed to json.dumps() for values it can't handle natively.
+                Defaults to `json_default()`
+            exclude (iterable) Top level keys to leave out
+        """
+        query = cls.query() if query is None else query
+        query = cls.eager(query.order_by(None), depth)
+        binary = _encode_binary if json_lines else None
+        exclude = frozenset(exclude)
+
+        for page in cls.iter_pages(limit=chunk_size, query=query):
+            for instance in page.items:
+                ret = instance.serialize(depth=depth, hybrid=hybrid, binary=binary)
+                for key in exclude:
+                    ret.pop(key, None)
+
+                if json_lines:
+                    yield json.dumps(ret, default=default or json_default) + "\n"
                 else:
-                    ret[key] = value
+                    yield ret
 
-        # Attempt to serialize our hybrid properties
-        if hybrid:
+    @classmethod
+    def serialize_json_array(cls, query=None, chunk_size=1000, depth=1, hybrid=True, default=None, exclude=()):
+        """
+        Stream the results of a query as a single JSON array, a chunk of rows at a time.
+        Meant to be handed straight to a streaming HTTP response
 
-            hybrid_properties = self._get_hybrid_properties()
+        Examples:
+            return Response(HueBridge.serialize_json_array(), mimetype="application/json")
+            return Response(User.serialize_json_array(exclude=["password_salt"]), mimetype="application/json")
 
-            for key, value in hybrid_properties.items():
-                value = value.fget(self)
+        Args:
+            Same as serialize_iter()
+        """
+        yield "["
 
-                # How to serialize datetime objects
-                if isinstance(value, datetime):
-                    ret[key] = value.isoformat()
+        buf = []
+        separator = ""
+        for line in cls.serialize_iter(query, chunk_size=chunk_size, depth=depth, hybrid=hybrid, json_lines=True,
+                                       default=default, exclude=exclude):
+            buf.append(line[:-1])
 
-                # Blind fallback #yolo
-                else:
-                    ret[key] = value
+            if len(buf) >= chunk_size:
+                yield separator + ",".join(buf)
+                separator = ","
+                buf = []
 
-        # Finally, return our dict
-        return ret
+        if buf:
+            yield separator + ",".join(buf)
+
+        yield "]"
+
+    # dict: (class, keys) -> compiled projection plan, see `_projection_plan()`
+    _projection_plans = {}
+
+    @classmethod
+    def _projection_plan(cls, keys):
+        """
+        Work out (once per class and set of keys) what a projection selects and how its
+        rows get turned into records
+
+        The plan is a tuple of:
+            record      A namedtuple class, with a field per key
+            columns     [Column]                Table columns to select, one per key
+            decoders    [(index, decode)]       Hybrids, decoded a whole column at a time
+        """
+        plan_key = (cls, keys)
+        plan = HomestackDatabase._projection_plans.get(plan_key)
+        if plan is not None:
+            return plan
+
+        mapper = inspect(cls)
+        hybrids = getattr(cls, "__projected_hybrids__", {})
+
+        # Default to the same columns and hybrids serialize() would give us
+        if not keys:
+            keys = tuple( prop.key for prop in mapper.column_attrs if not prop.key.startswith("_") ) + tuple(sorted(hybrids))
+
+        columns = []
+        decoders = []
+        for index, key in enumerate(keys):
+            name = key
+            if name in mapper.synonyms:
+                name = mapper.synonyms[name].name
+
+            if name in hybrids:
+                source, decode = hybrids[name]
+                columns.append(mapper.column_attrs[source].columns[0])
+                decoders.append((index, getattr(cls, decode)))
+            elif name in mapper.column_attrs:
+                columns.append(mapper.column_attrs[name].columns[0])
+            else:
+                raise ValueError("Can't project {}.{}, it isn't a column (or a hybrid in __projected_hybrids__)".format(cls.__name__, key))
+
+        record = namedtuple("{}Row".format(cls.__name__), keys)
+        plan = HomestackDatabase._projection_plans[plan_key] = (record, columns, decoders)
+        return plan
+
+    @classmethod
+    def project(cls, *columns):
+        """
+        Start a read-only projection of just the given columns (names or attributes).
+        Rows come back as plain namedtuples, straight from a Core select, so nothing gets
+        added to the session or tracked. Much cheaper than list() or filter_by() for big
+        reads that only need a few columns
+
+        Hybrids listed in a class's `__projected_hybrids__` (ie: ApiKey.api_key) can be
+        projected too, and are decoded a whole batch of rows at a time
+
+        Examples:
+            User.project("id", "username").filter_by(id=3).first()     UserRow(id=3, username=u'mike')
+            ApiKey.project(ApiKey.api_key, ApiKey.description).order_by(ApiKey.created).all()
+
+        Args:
+            columns Column names or attributes. Defaults to what serialize() would include
+
+        Returns:
+            A Projection
+        """
+        keys = tuple( column if isinstance(column, string_types) else column.key for column in columns )
+        return Projection(cls, *cls._projection_plan(keys))
+
+    @classmethod
+    def rows(cls, *columns, **kwargs):
+        """
+        Shortcut for `project(*columns).filter_by(**kwargs).all()`
+
+        Examples:
+            ApiKey.rows("id", "api_key", user_id=user.id)
+        """
+        return cls.project(*columns).filter_by(**kwargs).all()
+
+
+class Projection(object):
+    """
+    A read-only, chainable select of a few columns from a model, see HomestackDatabase.project()
+    """
+
+    def __init__(self, model, record, columns, decoders):
+        self.model = model
+        self.record = record
+        self._decoders = decoders
+        self._select = select(columns)
+
+    def _clone(self, stmt):
+        projection = Projection.__new__(Projection)
+        projection.__dict__.update(self.__dict__)
+        projection._select = stmt
+        return projection
+
+    def filter(self, *clauses):
+        return self._clone(self._select.where(and_(*clauses)))
+
+    def filter_by(self, **kwargs):
+        if not kwargs:
+            return self
+        return self.filter(*[ getattr(self.model, key) == value for key, value in kwargs.items() ])
+
+    def order_by(self, *columns):
+        return self._clone(self._select.order_by(*[ getattr(self.model, column) if isinstance(column, string_types) else column for column in columns ]))
+
+    def limit(self, limit):
+        return self._clone(self._select.limit(limit))
+
+    def offset(self, offset):
+        return self._clone(self._select.offset(offset))
+
+    def _records(self, rows):
+        make = self.record._make
+
+        if not self._decoders:
+            return [ make(row) for row in rows ]
+
+        rows = [ list(row) for row in rows ]
+        for index, decode in self._decoders:
+            for row, value in zip(rows, decode([ row[index] for row in rows ])):
+                row[index] = value
+
+        return [ make(row) for row in rows ]
+
+    def iter(self, chunk_size=1000):
+        """
+        Yield records, fetching (and decoding) `chunk_size` rows at a time
+        """
+        result = self.model.get_session().execute(self._select)
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for record in self._records(rows):
+                    yield record
+        finally:
+            result.close()
+
+    def __iter__(self):
+        return self.iter()
+
+    def all(self):
+        return self._records(self.model.get_session().execute(self._select).fetchall())
+
+    def first(self):
+        records = self._records(self.model.get_session().execute(self._select.limit(1)).fetchall())
+        return records[0] if records else None
+
+# What HomestackDatabase.paginate() hands back
+Page = namedtuple("Page", ["items", "next_cursor"])
+
+"""
+Pagination cursors are just the values of the last row's order_by columns, JSON encoded
+(with datetimes tagged so we can get them back) and base64'd so callers treat them as opaque
+"""
+def _encode_cursor(values):
+    values = [ {"dt": value.isoformat()} if isinstance(value, datetime) else value for value in values ]
+    return str(base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode("utf-8")).decode("ascii"))
+
+def _decode_cursor(cursor, count):
+    """
+    Turn a cursor back into `count` values, raising ValueError for anything that isn't one
+    of ours. Cursors come straight from callers, so tampered ones are a bad request, not a bug
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)).decode("utf-8"))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid pagination cursor: {}".format(e))
+
+    if not isinstance(values, list) or len(values) != count:
+        raise ValueError("Pagination cursor doesn't match the order_by columns")
+
+    ret = []
+    for value in values:
+        if isinstance(value, dict):
+            if list(value) != ["dt"] or not isinstance(value["dt"], string_types):
+                raise ValueError("Invalid pagination cursor: bad datetime {!r}".format(value))
+            fmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in value["dt"] else "%Y-%m-%dT%H:%M:%S"
+            value = datetime.strptime(value["dt"], fmt)
+        elif isinstance(value, list):
+            raise ValueError("Invalid pagination cursor: bad value {!r}".format(value))
+        ret.append(value)
+    return ret
+
+def _seek_clause(columns, values, desc=False):
+    """
+    Build the "rows after this one" clause for keyset pagination, spelled out as
+        (a > x) OR (a = x AND b > y) OR ...
+    rather than a row comparison, which MySQL won't always use an index for
+    """
+    if len(columns) != len(values):
+        raise ValueError("Pagination cursor doesn't match the order_by columns")
+
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [ columns[j] == values[j] for j in range(i) ]
+        seek = column < values[i] if desc else column > values[i]
+        clauses.append(and_(*(equal + [seek])))
+
+    return or_(*clauses)
+
+# What ApiKey.resolve() hands back
+ResolvedApiKey = namedtuple("ResolvedApiKey", ["api_key_id", "user_id", "roles"])
+
+# What HueBridge.for_user() and HueBridge.by_address() hand back. Plain tuples, so they're
+#   safe to share between threads and requests
+HueBridgeEntry = namedtuple("HueBridgeEntry", ["bridge_id", "user_id", "name", "address", "user"])
+
+# What HueBridge.sync() hands back, counts of rows affected
+SyncResult = namedtuple("SyncResult", ["inserted", "updated", "deleted"])
 
 """
 The following two tables are essentially pivot tables. They're what allows us
@@ -399,15 +2145,15 @@ to easily map roles to gruops, and visa-versa
 UserGroupToRole     = Table(
                         "UserGroupsToRoles",
                         hs_base.metadata,
-                        Column("user_group_id", INTEGER(unsigned=True), ForeignKey("UserGroups.group_id")),
-                        Column("role_id", INTEGER(unsigned=True), ForeignKey("Roles.role_id"))
+                        Column("user_group_id", UnsignedInteger(), ForeignKey("UserGroups.group_id"), primary_key=True),
+                        Column("role_id", UnsignedInteger(), ForeignKey("Roles.role_id"), primary_key=True)
                     )
 
 UserToUserGroup     = Table(
                         "UsersToUserGroups",
                         hs_base.metadata,
-                        Column("user_id", INTEGER(unsigned=True), ForeignKey("Users.user_id")),
-                        Column("user_group_id", INTEGER(unsigned=True), ForeignKey("UserGroups.group_id"))
+                        Column("user_id", UnsignedInteger(), ForeignKey("Users.user_id"), primary_key=True),
+                        Column("user_group_id", UnsignedInteger(), ForeignKey("UserGroups.group_id"), primary_key=True)
                     )
 
 class User(hs_base, HomestackDatabase):
@@ -419,20 +2165,20 @@ class User(hs_base, HomestackDatabase):
     __bind_key__    = "homestack"
 
     # int: The id of the user
-    user_id         = Column(INTEGER(unsigned=True), primary_key=True)
+    user_id         = Column(UnsignedInteger(), primary_key=True)
     id              = synonym("user_id")
 
     # datetime: The time the user record was originally created
-    time            = Column(DATETIME, default=datetime.utcnow, nullable=False, index=True)
+    time            = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     # datetime: The time the user last logged in
-    timestamp       = Column(DATETIME, default=datetime.utcnow, nullable=False, index=True)
+    timestamp       = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     # str: The username for this user
     username        = Column(VARCHAR(128), unique=True, nullable=False)
 
     # bin: The binary representation of a sha256 hash, generated by pbkdf2 hasking
-    password_salt   = Column(BINARY(32), nullable=False, index=True, default=lambda: os.urandom(32))
+    password_salt   = Column(FixedBinary(32), nullable=False, default=lambda: os.urandom(32))
 
     # list: Map the users groups
     user_groups     = relationship("UserGroup", secondary=UserToUserGroup)
@@ -442,17 +2188,46 @@ class User(hs_base, HomestackDatabase):
     is_anonymous    = False
     is_active       = True
 
+    # TTLCache: user_id -> (frozenset of group names, frozenset of role names)
+    #   Cleared whenever the pivot tables, UserGroups or Roles are written to, or a user is deleted
+    permission_cache = TTLCache(maxsize=10000, ttl=60)
+
+    @classmethod
+    def get_permissions(cls, user_id):
+        """
+        Return a tuple of (group names, role names) for the given user, as frozensets
+
+        Both are resolved with a single query and cached, so repeated permission checks
+        for the same user don't touch the database. Changes to a user's groups (or to a
+        group's roles) are picked up once they're flushed
+        """
+        permissions = cls.permission_cache.get(user_id)
+        if permissions is not TTLCache.MISSING:
+            return permissions
+
+        bq = statement_cache(lambda session: session.query(UserGroup.name, Role.name) \
+                .select_from(UserToUserGroup) \
+                .join(UserGroup, UserGroup.group_id == UserToUserGroup.c.user_group_id) \
+                .outerjoin(UserGroupToRole, UserGroupToRole.c.user_group_id == UserGroup.group_id) \
+                .outerjoin(Role, Role.role_id == UserGroupToRole.c.role_id) \
+                .filter(UserToUserGroup.c.user_id == bindparam("user_id")))
+        rows = statement_cache.run(bq, cls.get_session(), {"user_id": user_id})
+
+        permissions = (
+            frozenset(group for group, role in rows),
+            frozenset(role for group, role in rows if role is not None)
+        )
+        cls.permission_cache.set(user_id, permissions)
+
+        return permissions
+
     # Determine whether or not this user has a given role
     def has_role(self, name):
-        for group in self.user_groups:
-            for role in group.roles:
-                if name == role.name:
-                    return True
-        return False
+        return name in self.get_permissions(self.user_id)[1]
 
     # Determine whether or not this user is in the specified group
     def in_group(self, name):
-        return name in [ v.name for v in self.user_groups ]
+        return name in self.get_permissions(self.user_id)[0]
 
     # Per Miguel Grinberg's suggestion, return Flask-Login friendly unique ID in Unicode
     def get_id(self):
@@ -471,11 +2246,56 @@ class Password(hs_base, HomestackDatabase):
     __bind_key__    = "homestack"
 
     # int: The ID of the password row
-    password_id     = Column(INTEGER(unsigned=True), primary_key=True)
+    password_id     = Column(UnsignedInteger(), primary_key=True)
     id              = synonym('password_id')
 
     # bin: the binary representation of a sha256 encrypted password
-    hashed_password = Column(BINARY(128), nullable=False, index=True)
+    hashed_password = Column(FixedBinary(128), nullable=False)
+
+    # int: The argon2 costs this hash was made with. NULL for hashes made before we
+    #   started keeping track, which were made with credentials.LEGACY_PARAMS
+    time_cost       = Column(UnsignedInteger())
+    memory_cost     = Column(UnsignedInteger())
+    parallelism     = Column(UnsignedInteger())
+
+    @property
+    def params(self):
+        """
+        The argon2 costs this hash was made with, in the form hsdb.credentials wants them
+        """
+        if self.time_cost is None:
+            return None
+        return {"t": self.time_cost, "m": self.memory_cost, "p": self.parallelism}
+
+    @classmethod
+    def create(cls, password, salt, service=None):
+        """
+        Hash (on our credential service's worker processes) and insert a new password
+        """
+        service = service or credentials.get_service()
+        hashed, params = service.hash_password(password, salt)
+        return cls.insert(hashed_password=bytearray(hashed), time_cost=params["t"], memory_cost=params["m"], parallelism=params["p"])
+
+    def verify(self, password, salt, service=None):
+        """
+        Check a password against this hash. When it matches, but was hashed with costs
+        other than our current ones, it's re-hashed with the current costs and saved
+
+        Examples:
+            if Password.filter_by(id=user.id).first().verify(form.password, user.password_salt):
+                login_user(user)
+        """
+        service = service or credentials.get_service()
+        if not service.verify(password, salt, self.hashed_password, self.params):
+            return False
+
+        if service.needs_rehash(self.params):
+            hashed, params = service.hash_password(password, salt)
+            self.hashed_password = bytearray(hashed)
+            self.time_cost, self.memory_cost, self.parallelism = params["t"], params["m"], params["p"]
+            self._commit()
+
+        return True
 
 
 class UserGroup(hs_base, HomestackDatabase):
@@ -491,7 +2311,7 @@ class UserGroup(hs_base, HomestackDatabase):
     __serializable_relations__ = ['roles']
 
     # int: the ID of this group
-    group_id        = Column(INTEGER(unsigned=True), primary_key=True)
+    group_id        = Column(UnsignedInteger(), primary_key=True)
     id              = synonym("group_id")
 
     # str: the name of this group
@@ -512,7 +2332,7 @@ class Role(hs_base, HomestackDatabase):
     __bind_key__    = 'homestack'
 
     # int: the ID of this role
-    role_id         = Column(INTEGER(unsigned=True), primary_key=True)
+    role_id         = Column(UnsignedInteger(), primary_key=True)
     id              = synonym("role_id")
 
     # str: the name of this role
@@ -531,25 +2351,125 @@ class ApiKey(hs_base, HomestackDatabase):
     __bind_key__    = 'homestack'
 
     # int: API key id
-    api_key_id      = Column(INTEGER(unsigned=True), primary_key=True)
+    api_key_id      = Column(UnsignedInteger(), primary_key=True)
     key_id          = synonym("api_key_id")
     id              = synonym("api_key_id")
 
     # int: User id for this key
-    user_id         = Column(INTEGER(unsigned=True), ForeignKey("Users.user_id"), nullable=False)
+    user_id         = Column(UnsignedInteger(), ForeignKey("Users.user_id"), nullable=False)
 
     # bin: A UUID in binary format
-    _api_key        = Column('api_key', BINARY(16), unique=True, nullable=False, default=lambda: str(uuid4()).replace('-', '').decode('hex'))
+    _api_key        = Column('api_key', FixedBinary(16), unique=True, nullable=False, default=lambda: uuid4().bytes)
 
     # str: brief description for usage of this key
     description     = Column(VARCHAR(255))
 
     # datetime: The time the record was originally created
-    created         = Column(DATETIME, default=datetime.utcnow, nullable=False, index=True)
+    created         = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     # object: Convienience relationship to our User class
     user            = relationship("User")
 
+    # dict: Hybrids project() can select, as name -> (column they're computed from, name of
+    #   a method that decodes a list of raw column values)
+    __projected_hybrids__ = {"api_key": ("_api_key", "_decode_api_keys")}
+
+    # TTLCache: binary api key -> (api_key_id, user_id), or None for keys that don't exist
+    resolve_cache   = TTLCache(maxsize=100000, ttl=300)
+
+    # float: How long (in seconds) we remember that a key doesn't exist
+    negative_ttl    = 30
+
+    @staticmethod
+    def _key_bytes(key):
+        """
+        Return the binary form of an api key string, or None if it isn't a valid key
+        """
+        try:
+            return UUID(key).bytes
+        except (ValueError, TypeError, AttributeError):
+            return None
+
+    @staticmethod
+    def _decode_api_keys(values):
+        """
+        Format a batch of binary keys the way our api_key hybrid does, without building a
+        UUID object per key
+        """
+        ret = []
+        for value in values:
+            if value is None:
+                ret.append(None)
+                continue
+            h = str(binascii.hexlify(value).decode("ascii"))
+            ret.append("{}-{}-{}-{}-{}".format(h[:8], h[8:12], h[12:16], h[16:20], h[20:]))
+        return ret
+
+    @classmethod
+    def _resolved(cls, entry):
+        if entry is None:
+            return None
+
+        api_key_id, user_id = entry
+        return ResolvedApiKey(api_key_id, user_id, User.get_permissions(user_id)[1])
+
+    @classmethod
+    def resolve(cls, key):
+        """
+        Look up an api key, returning a ResolvedApiKey(api_key_id, user_id, roles) or None
+        if the key doesn't exist
+
+        Lookups (including misses, so brute forcing keys doesn't hammer the DB) are cached.
+        The cache is dropped as soon as any key is inserted, changed or deleted
+
+        Examples:
+            resolved = ApiKey.resolve(request.headers["X-Api-Key"])
+            if resolved is None or "hue_rw" not in resolved.roles:
+                abort(403)
+        """
+        return cls.resolve_many([key])[key]
+
+    @classmethod
+    def resolve_many(cls, keys):
+        """
+        Look up a bunch of api keys at once, returning a dict of key -> ResolvedApiKey (or
+        None). Anything not already cached is fetched with a single query
+        """
+        ret = {}
+        missing = {}
+
+        for key in keys:
+            key_bytes = cls._key_bytes(key)
+
+            # Garbage in, garbage out. Don't even bother asking the DB
+            if key_bytes is None:
+                ret[key] = None
+                continue
+
+            entry = cls.resolve_cache.get(key_bytes)
+            if entry is TTLCache.MISSING:
+                missing.setdefault(key_bytes, []).append(key)
+            else:
+                ret[key] = cls._resolved(entry)
+
+        if missing:
+            bq = statement_cache(lambda session: session.query(cls._api_key, cls.api_key_id, cls.user_id) \
+                    .filter(cls._api_key.in_(bindparam("keys", expanding=True))))
+            rows = statement_cache.run(bq, cls.get_session(), {"keys": list(missing)})
+            found = dict( (bytes(key_bytes), (api_key_id, user_id)) for key_bytes, api_key_id, user_id in rows )
+
+            for key_bytes, originals in missing.items():
+                entry = found.get(key_bytes)
+                if entry is None:
+                    cls.resolve_cache.set(key_bytes, None, ttl=cls.negative_ttl)
+                else:
+                    cls.resolve_cache.set(key_bytes, entry)
+
+                for key in originals:
+                    ret[key] = cls._resolved(entry)
+
+        return ret
+
 
     """
     The below can safely be ignored
@@ -571,11 +2491,23 @@ class ApiKey(hs_base, HomestackDatabase):
         http://docs.sqlalchemy.org/en/latest/orm/extensions/hybrid.html#building-custom-comparators
         """
         def __eq__(self, other):
-            return self.__clause_element__() == other.replace('-', '').decode('hex')
+            # Prepared statements hand us a bind parameter, so convert the key once it's bound
+            if isinstance(other, BindParameter):
+                return self.__clause_element__() == bindparam(other.key, type_=ApiKey.ApiKeyString)
+            return self.__clause_element__() == binascii.unhexlify(other.replace('-', ''))
+
+    class ApiKeyString(TypeDecorator):
+        """
+        Binds api key strings as the binary they're stored as
+        """
+        impl = BINARY
+
+        def process_bind_param(self, value, dialect):
+            return None if value is None else binascii.unhexlify(value.replace('-', ''))
 
     @hybrid_property
     def api_key(self):
-        return str(UUID(self._api_key.encode("hex")))
+        return str(UUID(bytes=bytes(self._api_key)))
 
     @api_key.comparator
     def api_key(cls):
@@ -583,7 +2515,7 @@ class ApiKey(hs_base, HomestackDatabase):
 
     @api_key.setter
     def api_key(self, key_string):
-        self._api_key = key_string.replace('-', '').decode('hex')
+        self._api_key = binascii.unhexlify(key_string.replace('-', ''))
 
 
 class HueBridge(hs_base, HomestackDatabase):
@@ -595,10 +2527,10 @@ class HueBridge(hs_base, HomestackDatabase):
     __bind_key__    = "homestack"
 
     # int: the ID of this bridge
-    bridge_id       = Column(INTEGER(unsigned=True), primary_key=True)
+    bridge_id       = Column(UnsignedInteger(), primary_key=True)
     id              = synonym("bridge_id")
 
-    user_id         = Column(INTEGER(unsigned=True), ForeignKey("Users.user_id"), nullable=False)
+    user_id         = Column(UnsignedInteger(), ForeignKey("Users.user_id"), nullable=False)
 
     # str: Description and short name for this bridge so we know which one it is
     name            = Column(VARCHAR(150), nullable=False)
@@ -610,6 +2542,222 @@ class HueBridge(hs_base, HomestackDatabase):
     # The "api key" that Hue uses
     user            = Column(VARCHAR(40), nullable=False, unique=True)
 
+    # TTLCache: user_id -> (tuple of HueBridgeEntry, dict of address -> HueBridgeEntry)
+    #   Cleared whenever HueBridges is written to
+    index_cache     = TTLCache(maxsize=10000, ttl=60)
+
+    @classmethod
+    def _index(cls, user_id):
+        index = cls.index_cache.get(user_id)
+        if index is not TTLCache.MISSING:
+            return index
+
+        table = cls.__table__
+        rows = cls.get_session().execute(
+                select([ table.c.bridge_id, table.c.user_id, table.c.name, table.c.address, table.c.user ]) \
+                .where(table.c.user_id == user_id) \
+                .order_by(table.c.bridge_id))
+
+        bridges = tuple( HueBridgeEntry(*row) for row in rows )
+        index = (bridges, dict( (bridge.address, bridge) for bridge in bridges ))
+        cls.index_cache.set(user_id, index)
+
+        return index
+
+    @classmethod
+    def for_user(cls, user_id):
+        """
+        Return a tuple of HueBridgeEntry for every bridge belonging to a user. Cached per
+        user, so repeated lookups don't touch the database
+        """
+        return cls._index(user_id)[0]
+
+    @classmethod
+    def by_address(cls, user_id, address):
+        """
+        Return the HueBridgeEntry for a user's bridge at `address`, or None. Served from
+        the same cache as for_user()
+        """
+        return cls._index(user_id)[1].get(address)
+
+    @classmethod
+    def sync(cls, user_id, discovered):
+        """
+        Bring a user's stored bridges in line with what discovery just found. Bridges are
+        matched up on their `user`; new ones are inserted, changed ones are updated and
+        any of this user's bridges that weren't discovered are deleted
+
+        Stored rows are read with a single query, and the changes are sent as (at most) one
+        executemany each for inserts, updates and deletes, all in one transaction. A bridge
+        that's stored against another user is moved over to this one
+
+        Examples:
+            HueBridge.sync(user.id, [
+                {"name": "upstairs", "address": "10.0.0.20", "user": "a1b2c3..."},
+                {"name": "garage", "address": "10.0.0.21", "user": "d4e5f6..."}
+            ])
+
+        Args:
+            user_id (int) The user these bridges belong to
+            discovered (iterable) Dicts of name, address and user, one per bridge
+
+        Returns:
+            A SyncResult(inserted, updated, deleted)
+        """
+        table = cls.__table__
+        columns = ("name", "address", "user")
+
+        wanted = {}
+        for bridge in discovered:
+            row = dict( (key, bridge[key]) for key in columns )
+            row["user_id"] = user_id
+            wanted[row["user"]] = row
+
+        with cls.use_primary(), cls.transaction() as session:
+            matches = table.c.user_id == user_id
+            if wanted:
+                matches = or_(matches, table.c.user.in_(list(wanted)))
+
+            stored = dict( (row.user, row) for row in session.execute(
+                    select([ table.c.bridge_id, table.c.user_id, table.c.name, table.c.address, table.c.user ]).where(matches)) )
+
+            inserts = [ values for key, values in wanted.items() if key not in stored ]
+            updates = []
+            deletes = []
+
+            for key, row in stored.items():
+                if key not in wanted:
+                    # Only ever delete this user's bridges, never someone else's
+                    if row.user_id == user_id:
+                        deletes.append(row.bridge_id)
+                    continue
+
+                new = wanted[key]
+                if any(row[column] != new[column] for column in ("user_id",) + columns):
+                    update = dict( ("_new_{}".format(column), new[column]) for column in ("user_id",) + columns )
+                    update["_pk_bridge_id"] = row.bridge_id
+                    updates.append(update)
+
+            if deletes:
+                session.execute(table.delete().where(table.c.bridge_id.in_(deletes)))
+
+            if updates:
+                stmt = table.update().where(table.c.bridge_id == bindparam("_pk_bridge_id"))
+                stmt = stmt.values(dict( (column, bindparam("_new_{}".format(column))) for column in ("user_id",) + columns ))
+                session.execute(stmt, updates)
+
+            if inserts:
+                session.execute(table.insert(), inserts)
+
+            # We went around the ORM, so don't let it hand back stale bridges
+            if deletes or updates:
+                for instance in list(session.identity_map.values()):
+                    if isinstance(instance, cls):
+                        session.expire(instance)
+
+        return SyncResult(len(inserts), len(updates), len(deletes))
+
+def _mark_changed(connection, key):
+    """
+    Note that this connection's transaction changed something we cache, so we can drop it
+    again on commit/rollback. Connectionless execution (`engine.execute()`) has already
+    autocommitted and closed the connection by the time after_execute runs, so there's no
+    transaction left to wait for
+    """
+    if not connection.closed:
+        connection.info[key] = True
+
+"""
+Drop cached api key lookups whenever the ApiKeys table is written to, so that deleted keys
+stop resolving right away, and new keys aren't stuck behind a cached "doesn't exist". This
+watches statements rather than mapper events, so bulk Query.delete() / update(),
+insert_many() and plain Core statements are covered too. We drop the cache again once the
+transaction commits (or rolls back), in case a key got re-cached in the meantime
+"""
+@on_engine_created
+def watch_api_key_table(engine):
+
+    @event.listens_for(engine, "after_execute")
+    def after_execute(connection, clauseelement, multiparams, params, result):
+        if isinstance(clauseelement, UpdateBase) and clauseelement.table is ApiKey.__table__:
+            _mark_changed(connection, "api_keys_changed")
+            ApiKey.resolve_cache.clear()
+
+    @event.listens_for(engine, "commit")
+    @event.listens_for(engine, "rollback")
+    def commit(connection):
+        if connection.info.pop("api_keys_changed", False):
+            ApiKey.resolve_cache.clear()
+
+"""
+Keep our permission cache honest. Any write to a table permissions are built from (the
+pivot tables, but also UserGroups and Roles, as renames and deletes change what a user
+has), whether it's coming from a relationship being flushed, a bulk Query.update() /
+delete(), or a plain Core statement, drops the cache. So does deleting users, but nothing
+else on Users does: permissions are keyed on user_id, and the login `timestamp` update
+(or a new user) doesn't change anybody's. We drop it again once the transaction commits
+(or rolls back), in case the old (or the uncommitted) permissions got re-cached in the
+meantime
+"""
+_permission_tables = set(["UsersToUserGroups", "UserGroupsToRoles", "UserGroups", "Roles"])
+
+def _changes_permissions(clauseelement):
+    if not isinstance(clauseelement, UpdateBase):
+        return False
+    return clauseelement.table.name in _permission_tables \
+        or (isinstance(clauseelement, Delete) and clauseelement.table is User.__table__)
+
+@on_engine_created
+def watch_permission_tables(engine):
+
+    @event.listens_for(engine, "after_execute")
+    def after_execute(connection, clauseelement, multiparams, params, result):
+        if _changes_permissions(clauseelement):
+            _mark_changed(connection, "permissions_changed")
+            User.permission_cache.clear()
+
+    @event.listens_for(engine, "commit")
+    @event.listens_for(engine, "rollback")
+    def commit(connection):
+        if connection.info.pop("permissions_changed", False):
+            User.permission_cache.clear()
+
+"""
+And our second-level query cache, for the tables that opted into it
+"""
+@on_engine_created
+def watch_query_cache_tables(engine):
+
+    @event.listens_for(engine, "after_execute")
+    def after_execute(connection, clauseelement, multiparams, params, result):
+        if isinstance(clauseelement, UpdateBase) and _query_cached(clauseelement.table):
+            _mark_changed(connection, "query_cache_changed")
+            query_cache.clear()
+
+    @event.listens_for(engine, "commit")
+    @event.listens_for(engine, "rollback")
+    def commit(connection):
+        if connection.info.pop("query_cache_changed", False):
+            query_cache.clear()
+
+"""
+Same deal for our bridge index. Bridges are written far less often than they're looked up,
+so any write to HueBridges simply drops the whole thing
+"""
+@on_engine_created
+def watch_bridge_table(engine):
+
+    @event.listens_for(engine, "after_execute")
+    def after_execute(connection, clauseelement, multiparams, params, result):
+        if isinstance(clauseelement, UpdateBase) and clauseelement.table is HueBridge.__table__:
+            _mark_changed(connection, "bridges_changed")
+            HueBridge.index_cache.clear()
+
+    @event.listens_for(engine, "commit")
+    @event.listens_for(engine, "rollback")
+    def commit(connection):
+        if connection.info.pop("bridges_changed", False):
+            HueBridge.index_cache.clear()
 
 
 # Explicitely do nothing on direct run
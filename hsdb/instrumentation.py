@@ -0,0 +1,289 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Opt-in query instrumentation. Once enabled, every statement that goes through our engine
+is timed, and we keep:
+
+    Latency histograms, per model (table) and per statement
+    A log of slow queries (anything over `slow_threshold` seconds)
+    A log of likely N+1 patterns: the same statement run `n_plus_one_threshold` or more
+        times over a single checked-out connection (ie: one session transaction)
+
+Examples:
+    from hsdb import instrumentation
+
+    instrumentation.enable(slow_threshold=0.25)
+    ...
+    instrumentation.stats()         Everything, as a dict
+    instrumentation.prometheus()    Histograms in the Prometheus text format
+"""
+
+import time
+import logging
+import threading
+
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.ddl import DDLElement
+
+from .hsdb import on_engine_created
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of our histogram buckets. Anything slower lands in +Inf
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram(object):
+    """
+    A cumulative latency histogram, Prometheus style
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+
+        self.counts[-1] += 1
+
+    def cumulative(self):
+        """
+        Return a list of (upper bound, number of observations <= bound), ending with +Inf
+        """
+        ret = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            ret.append((bound, total))
+        return ret
+
+    def as_dict(self):
+        return {
+            "count"     : self.count,
+            "sum"       : self.sum,
+            "mean"      : self.sum / self.count if self.count else 0.0,
+            "buckets"   : [ ("+Inf" if bound == float("inf") else bound, count) for bound, count in self.cumulative() ]
+        }
+
+
+class QueryStats(object):
+    """
+    Holds everything we've collected. There's one of these per process, see `enable()`
+    """
+
+    def __init__(self, slow_threshold=0.5, n_plus_one_threshold=10, max_statements=500, log_size=100):
+        """
+        Args:
+            slow_threshold (float) Statements taking longer than this (in seconds) are logged as slow
+            n_plus_one_threshold (int) Number of identical statements over one connection checkout
+                before we flag it as a likely N+1
+            max_statements (int) Max number of distinct statements to keep histograms for. Any
+                past that are lumped together under "other"
+            log_size (int) How many slow query / N+1 entries to hang on to
+        """
+        self.slow_threshold = slow_threshold
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.max_statements = max_statements
+        self.log_size = log_size
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.models = {}
+            self.statements = {}
+            self.slow_queries = deque(maxlen=self.log_size)
+            self.n_plus_one = deque(maxlen=self.log_size)
+
+    def record(self, statement, parameters, model, duration):
+        with self._lock:
+            self.models.setdefault(model, Histogram()).observe(duration)
+
+            key = statement
+            if key not in self.statements and len(self.statements) >= self.max_statements:
+                key = "other"
+            self.statements.setdefault(key, Histogram()).observe(duration)
+
+            if duration >= self.slow_threshold:
+                self.slow_queries.append({
+                    "statement"     : statement,
+                    "parameters"    : repr(parameters),
+                    "model"         : model,
+                    "duration"      : duration,
+                    "time"          : time.time()
+                })
+                log.warning("Slow query (%.3fs) against %s: %s", duration, model, statement)
+
+    def flag_n_plus_one(self, statement, model, count):
+        with self._lock:
+            self.n_plus_one.append({
+                "statement" : statement,
+                "model"     : model,
+                "count"     : count,
+                "time"      : time.time()
+            })
+        log.warning("Possible N+1: statement against %s ran %d times over one connection: %s", model, count, statement)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "models"        : dict( (key, hist.as_dict()) for key, hist in self.models.items() ),
+                "statements"    : dict( (key, hist.as_dict()) for key, hist in self.statements.items() ),
+                "slow_queries"  : list(self.slow_queries),
+                "n_plus_one"    : list(self.n_plus_one)
+            }
+
+    def prometheus(self, prefix="hsdb"):
+        """
+        Render our per-model histograms (and slow query / N+1 counts) in the Prometheus
+        text exposition format. Per-statement histograms are left out, as raw SQL makes
+        for a terrible (and unbounded) label
+        """
+        name = "{}_query_duration_seconds".format(prefix)
+        lines = [
+            "# HELP {} Time spent executing statements, by model".format(name),
+            "# TYPE {} histogram".format(name)
+        ]
+
+        with self._lock:
+            for model in sorted(self.models):
+                hist = self.models[model]
+                for bound, count in hist.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('{}_bucket{{model="{}",le="{}"}} {}'.format(name, model, le, count))
+                lines.append('{}_sum{{model="{}"}} {!r}'.format(name, model, hist.sum))
+                lines.append('{}_count{{model="{}"}} {}'.format(name, model, hist.count))
+
+            for metric, entries in (("slow_queries", self.slow_queries), ("n_plus_one", self.n_plus_one)):
+                lines.append("# TYPE {}_{} gauge".format(prefix, metric))
+                lines.append("{}_{} {}".format(prefix, metric, len(entries)))
+
+        return "\n".join(lines) + "\n"
+
+
+# Our per-process stats. None until `enable()` is called
+_stats = None
+_installed = []
+_models = {}
+
+
+def enable(slow_threshold=0.5, n_plus_one_threshold=10, max_statements=500, log_size=100):
+    """
+    Start collecting. Safe to call before or after the engine has been built. Calling it
+    again resets everything we've collected so far, using the new settings
+
+    Args:
+        Same as QueryStats
+    """
+    global _stats
+    _stats = QueryStats(slow_threshold, n_plus_one_threshold, max_statements, log_size)
+
+    if not _installed:
+        _installed.append(on_engine_created(install))
+
+    return _stats
+
+def disable():
+    """
+    Stop collecting. Our listeners stay attached, but do nothing
+    """
+    global _stats
+    _stats = None
+
+def reset():
+    """
+    Throw away everything we've collected so far
+    """
+    if _stats is not None:
+        _stats.reset()
+
+def stats():
+    """
+    Return everything we've collected as a dict, or None when we're not enabled
+    """
+    return _stats.as_dict() if _stats is not None else None
+
+def prometheus(prefix="hsdb"):
+    """
+    Return our per-model histograms in the Prometheus text format
+    """
+    return _stats.prometheus(prefix) if _stats is not None else ""
+
+def _model_of(context):
+    """
+    Work out which table (by model name, where there is one) a statement is against
+    """
+    compiled = getattr(context, "compiled", None)
+    statement = getattr(compiled, "statement", None)
+    if statement is None:
+        return "raw"
+
+    if isinstance(statement, DDLElement):
+        return "ddl"
+
+    if isinstance(statement, UpdateBase):
+        tables = [statement.table]
+    else:
+        froms = getattr(statement, "froms", None) or [statement]
+        tables = find_tables(froms[0])
+
+    if not tables:
+        return "none"
+
+    name = getattr(tables[0], "name", "unknown")
+
+    # Map table names back to model names the first time we see them
+    if not _models:
+        from hsdb import HomestackDatabase
+        for cls in HomestackDatabase.__subclasses__():
+            if hasattr(cls, "__tablename__"):
+                _models[cls.__tablename__] = cls.__name__
+
+    return _models.get(name, name)
+
+def install(engine):
+    """
+    Attach our listeners to an engine. Done for you by `enable()`
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        if _stats is not None:
+            connection.info.setdefault("query_start_time", []).append(time.time())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        stats = _stats
+        starts = connection.info.get("query_start_time")
+        if stats is None or not starts:
+            return
+
+        duration = time.time() - starts.pop()
+        model = _model_of(context)
+        stats.record(statement, parameters, model, duration)
+
+        # Count identical statements over this checkout, flagging once we hit our threshold
+        seen = connection.info.setdefault("statement_counts", {})
+        seen[statement] = seen.get(statement, 0) + 1
+        if seen[statement] == stats.n_plus_one_threshold:
+            stats.flag_n_plus_one(statement, model, seen[statement])
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        connection_record.info.pop("statement_counts", None)
+        connection_record.info.pop("query_start_time", None)
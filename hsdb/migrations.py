@@ -0,0 +1,331 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Helpers for data migrations in Alembic revisions
+
+Everything here runs on the migration's own connection (`op.get_bind()`), never through
+our models or `hs_engine`, so it's part of whatever transaction Alembic runs the revision
+in, and works against whatever database Alembic was pointed at. Databases with
+transactional DDL run each revision in one transaction. MySQL commits on every DDL
+statement, so Alembic doesn't start one there. Wrap data changes that have to land
+together in `transaction()`
+
+    bulk_insert     Seed rows with `op.bulk_insert`, `chunk_size` rows per INSERT. Takes
+                        any iterable, so rows can be generated as they're inserted
+    deduplicate     Drop NULL and duplicate rows from a table (ie: before giving it a
+                        primary key), entirely in SQL
+    backfill        Update a table in chunks of `chunk_size` rows, walking it by an
+                        integer key (keyset pagination, so no chunk gets slower than the
+                        last and memory stays bounded), logging progress as it goes. Give
+                        it a `checkpoint` name and an interrupted backfill picks up after
+                        the last chunk that was committed
+    transaction     Run a block in one transaction, joining the migration's if it has one
+
+Everything but `func` backfills also works offline (`alembic upgrade --sql`), rendering
+the SQL it would have run instead
+
+Examples:
+    from hsdb import migrations
+
+    roles = sa.table("Roles", sa.column("role_id"), sa.column("name"))
+    with migrations.transaction():
+        migrations.bulk_insert(roles, [ {"role_id": 1, "name": "admin"}, ... ])
+        ...
+
+    # In SQL, a chunk at a time
+    passwords = sa.table("Passwords", sa.column("password_id"), sa.column("time_cost"))
+    migrations.backfill(passwords, "password_id", values={"time_cost": 2000},
+                        where=passwords.c.time_cost == None)
+
+    # In Python, a chunk at a time, committing (and checkpointing) after each chunk
+    migrations.backfill(users, "user_id", func=lambda row: {"username": row.username.lower()},
+                        columns=["username"], checkpoint="lowercase_usernames", commit=True)
+"""
+
+import time
+import binascii
+import datetime
+import logging
+import itertools
+
+from contextlib import contextmanager
+
+from alembic import op
+
+from sqlalchemy import and_
+from sqlalchemy import func as sql_func
+from sqlalchemy import select
+from sqlalchemy import bindparam
+from sqlalchemy import literal
+from sqlalchemy import literal_column
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+from sqlalchemy import Column
+from sqlalchemy import VARCHAR
+from sqlalchemy import BigInteger
+from sqlalchemy import LargeBinary
+from sqlalchemy import BINARY
+from sqlalchemy import VARBINARY
+
+log = logging.getLogger(__name__)
+
+# int: Rows per INSERT / UPDATE chunk, unless told otherwise
+DEFAULT_CHUNK_SIZE = 1000
+
+# Where backfill checkpoints are kept. Only exists while a checkpointed backfill is unfinished
+checkpoints = Table("hsdb_backfills", MetaData(),
+                    Column("name", VARCHAR(191), primary_key=True),
+                    Column("last_key", BigInteger, nullable=False),
+                    Column("done", BigInteger, nullable=False))
+
+
+def chunked(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield lists of up to `chunk_size` items from any iterable, without materializing it
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def offline():
+    """
+    Whether Alembic is rendering SQL (`--sql`) rather than talking to a database
+    """
+    return op.get_context().as_sql
+
+
+@contextmanager
+def transaction():
+    """
+    Run a block of data changes in one transaction on the migration's connection. Inside the
+    migration's own transaction (or another `transaction()`), this just joins it. Offline,
+    it's up to whoever runs the rendered SQL
+    """
+    if offline():
+        yield
+        return
+
+    with op.get_bind().begin():
+        yield
+
+
+def bulk_insert(table, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Insert `rows` (dicts keyed on column name) into `table`, `chunk_size` rows per INSERT
+
+    Args:
+        table (Table) A Table, or a lightweight `sa.table()` naming the columns being set.
+            Give the columns types, or offline (`--sql`) values are rendered as NULL, and
+            binary values as text
+        rows (iterable) The rows to insert. Can be a generator
+        chunk_size (int) Rows per INSERT statement
+
+    Returns:
+        The number of rows inserted
+    """
+    count = 0
+    for chunk in chunked(rows, chunk_size):
+        if offline():
+            # op.bulk_insert() can't render binary or date/time values as literals
+            for row in chunk:
+                op.execute(table.insert().values(dict( (key, _literal(table.c[key], value)) for key, value in row.items() )))
+        else:
+            op.bulk_insert(table, chunk, multiinsert=True)
+        count += len(chunk)
+
+    log.info("Inserted %d rows into %s", count, table.name)
+    return count
+
+
+def _literal(column, value):
+    """
+    Return `value` as something SQLAlchemy can render inline, for offline mode
+    """
+    if value is None:
+        return value
+    if isinstance(column.type, (LargeBinary, BINARY, VARBINARY)):
+        return literal_column("X'{}'".format(binascii.hexlify(bytes(value)).decode("ascii")))
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return literal(str(value))
+    return value
+
+
+def deduplicate(table, columns):
+    """
+    Delete every row of `table` with a NULL in any of `columns`, and all but one of each set
+    of rows that are the same across them. Meant for tables made up of nothing but
+    `columns`, like our pivot tables, on their way to getting a primary key
+
+    The distinct rows are copied out to a scratch table (`<table>_deduplicate`) and back,
+    all in SQL, so no rows pass through Python and it renders offline. The scratch table
+    is only dropped once the rows are back, so nothing is lost if we're interrupted
+
+    Args:
+        table (Table) A Table, or a lightweight `sa.table()` with (typed) `columns`
+        columns (list) Names of the columns that make a row unique
+    """
+    scratch = op.create_table("{}_deduplicate".format(table.name),
+                              *[ Column(column, table.c[column].type) for column in columns ])
+
+    selected = [ table.c[column] for column in columns ]
+    op.execute(scratch.insert().from_select(columns, select(selected).where(and_(*[ column != None for column in selected ])).distinct()))
+
+    with transaction():
+        op.execute(table.delete())
+        op.execute(table.insert().from_select(columns, select([ scratch.c[column] for column in columns ])))
+
+    op.drop_table(scratch.name)
+    log.info("Deduplicated %s on (%s)", table.name, ", ".join(columns))
+
+
+def _log_progress(name, done, total, elapsed):
+    rate = done / elapsed if elapsed else 0
+    log.info("Backfill %s: %d/%d rows (%.0f%%), %.0f rows/s", name, done, total,
+             100.0 * done / total if total else 100.0, rate)
+
+def _checkpoint(bind, name):
+    """
+    Return (last_key, done) for an unfinished backfill, or (None, 0)
+    """
+    if not checkpoints.exists(bind=bind):
+        return None, 0
+
+    row = bind.execute(select([checkpoints.c.last_key, checkpoints.c.done]).where(checkpoints.c.name == name)).first()
+    return (row.last_key, row.done) if row is not None else (None, 0)
+
+def _save_checkpoint(bind, name, last_key, done):
+    updated = bind.execute(checkpoints.update().where(checkpoints.c.name == name).values(last_key=last_key, done=done))
+    if not updated.rowcount:
+        bind.execute(checkpoints.insert().values(name=name, last_key=last_key, done=done))
+
+def _clear_checkpoint(bind, name):
+    bind.execute(checkpoints.delete().where(checkpoints.c.name == name))
+    if bind.execute(select([sql_func.count()]).select_from(checkpoints)).scalar() == 0:
+        checkpoints.drop(bind=bind)
+
+
+def backfill(table, key, values=None, func=None, columns=(), where=None, chunk_size=DEFAULT_CHUNK_SIZE,
+             checkpoint=None, commit=False, progress=_log_progress):
+    """
+    Update `table` a chunk of rows at a time, in `key` order
+
+    Each chunk is found with `WHERE key > <last key seen> ORDER BY key LIMIT chunk_size`, so
+    only one chunk's keys (or rows, with `func`) are ever held in memory, and every chunk
+    costs the same no matter how far in we are. Make `where` match only the rows still
+    needing work where possible (ie: `column == None`), so a re-run skips finished rows
+
+    Either `values` or `func` says how rows are updated:
+        values  A dict of column name to value or SQL expression, applied to each chunk
+                    with one `UPDATE ... WHERE key BETWEEN <first> AND <last>`
+        func    Called with each row (`key` plus `columns`), returns a dict of new values
+                    for it, or None to leave it alone. Applied with an executemany UPDATE
+
+    Every chunk runs in a transaction of its own, or as part of the migration's when there
+    is one (databases with transactional DDL), in which case the whole backfill commits or
+    rolls back along with the revision's schema changes. With `commit=True`, the migration's
+    transaction is committed first, so every chunk commits on its own (keeping locks short on
+    big tables). Combined with `checkpoint`, an interrupted backfill resumes after the last
+    committed chunk the next time the revision runs
+
+    Offline (`--sql`), a `values` backfill is rendered as a single UPDATE. `func` backfills
+    need a database
+
+    Args:
+        table (Table) A Table, or a lightweight `sa.table()` with `key` and any `columns`
+        key (str) Name of an integer, unique column to walk the table by (the primary key)
+        values (dict) See above
+        func (callable) See above
+        columns (list) Names of the columns `func` needs to see
+        where (ClauseElement) Only backfill rows matching this
+        chunk_size (int) Rows per chunk
+        checkpoint (str) Record progress under this name (unique per backfill), so an
+            interrupted backfill can pick up where it left off
+        commit (bool) Commit after every chunk, rather than with the migration
+        progress (callable) Called as progress(table name, rows done, rows total, seconds
+            elapsed) after every chunk. Logs at INFO by default. None to stay quiet
+
+    Returns:
+        The number of rows backfilled (including any done by a previous, interrupted run)
+    """
+    if (values is None) == (func is None):
+        raise ValueError("backfill() needs exactly one of `values` or `func`")
+
+    if offline():
+        if func is not None:
+            raise RuntimeError("Can't run a `func` backfill of {} in offline (--sql) mode".format(table.name))
+        statement = table.update().values(values)
+        op.execute(statement.where(where) if where is not None else statement)
+        return None
+
+    if commit:
+        context = op.get_context()
+        if not hasattr(context, "autocommit_block"):
+            raise RuntimeError("backfill(commit=True) needs Alembic 1.2 or later")
+        with context.autocommit_block():
+            return _backfill(op.get_bind(), table, key, values, func, columns, where, chunk_size, checkpoint, progress)
+
+    return _backfill(op.get_bind(), table, key, values, func, columns, where, chunk_size, checkpoint, progress)
+
+def _backfill(bind, table, key, values, func, columns, where, chunk_size, checkpoint, progress):
+    key = table.c[key]
+    selected = [key] + [ table.c[column] for column in columns ]
+
+    last_key, done = _checkpoint(bind, checkpoint) if checkpoint else (None, 0)
+    if checkpoint:
+        checkpoints.create(bind=bind, checkfirst=True)
+        if last_key is not None:
+            log.info("Resuming backfill %s after %s=%s (%d rows done)", checkpoint, key.name, last_key, done)
+
+    def remaining(after):
+        clauses = [ clause for clause in (where, key > after if after is not None else None) if clause is not None ]
+        return and_(*clauses) if clauses else None
+
+    def query(columns, after):
+        statement = select(columns).select_from(table)
+        clause = remaining(after)
+        return statement.where(clause) if clause is not None else statement
+
+    total = done + bind.execute(query([sql_func.count()], last_key)).scalar()
+    start = time.time()
+
+    statement = table.update().where(key == bindparam("_hsdb_key"))
+
+    while True:
+        # A transaction per chunk. Inside the migration's transaction this just nests in it
+        with bind.begin():
+            rows = bind.execute(query(selected, last_key).order_by(key).limit(chunk_size)).fetchall()
+            if not rows:
+                break
+
+            if values is not None:
+                bounds = and_(key >= rows[0][0], key <= rows[-1][0])
+                bind.execute(table.update().where(and_(bounds, where) if where is not None else bounds).values(values))
+            else:
+                # Rows updating the same set of columns share an executemany
+                updates = {}
+                for row in rows:
+                    new = func(row)
+                    if new:
+                        new = dict(new, _hsdb_key=row[0])
+                        updates.setdefault(tuple(sorted(new)), []).append(new)
+
+                # SET is made up of whichever columns the parameters name
+                for params in updates.values():
+                    bind.execute(statement, params)
+
+            last_key = rows[-1][0]
+            done += len(rows)
+            if checkpoint:
+                _save_checkpoint(bind, checkpoint, last_key, done)
+
+        if progress is not None:
+            progress(checkpoint or table.name, done, total, time.time() - start)
+
+    if checkpoint:
+        _clear_checkpoint(bind, checkpoint)
+
+    return done
@@ -11,7 +11,7 @@ setup(
     author           = 'Pat Litke',
     author_email     = 'litke.p+gh@arcti.cc',
     url              = 'https://github.com/geudrik/homestack-db-library',
-    classifiers      = ['Development Status :: 4 - Beta'],
-    install_requires = ['sqlalchemy>=1.1.3', 'argon2>=0.1.10']
+    classifiers      = ['Development Status :: 4 - Beta', 'Programming Language :: Python :: 2.7', 'Programming Language :: Python :: 3'],
+    install_requires = ['sqlalchemy>=1.2,<1.4', 'argon2>=0.1.10']
 )
 
@@ -0,0 +1,133 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+The awaitable helpers in hsdb.aio. Python 3 only
+"""
+
+import os
+import shutil
+import functools
+import tempfile
+import unittest
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import UserGroup
+from hsdb import UserGroupToRole
+from hsdb import Role
+from hsdb import aio
+
+
+@unittest.skipIf(aio.asyncio is None, "needs asyncio (Python 3)")
+class AsyncModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")))
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+        self.loop = aio.asyncio.new_event_loop()
+        aio.asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def run_until_complete(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def test_insert_and_query(self):
+        Roles = aio.AsyncModel(Role)
+
+        role = self.run_until_complete(Roles.insert(name="admin"))
+        self.assertEqual(role.name, "admin")
+
+        found = self.run_until_complete(Roles.first_by(name="admin"))
+        self.assertEqual(found.role_id, role.role_id)
+        self.assertEqual([ listed.name for listed in self.run_until_complete(Roles.list()) ], ["admin"])
+
+    def test_serialize_loads_relationships_on_a_worker(self):
+        group = UserGroup.insert(name="administrator")
+        role = Role.insert(name="admin")
+        HomestackDatabase._engine.execute(UserGroupToRole.insert(), user_group_id=group.group_id, role_id=role.role_id)
+        HomestackDatabase.remove_session()
+
+        Groups = aio.AsyncModel(UserGroup)
+        group = self.run_until_complete(Groups.first_by(name="administrator"))
+        serialized = self.run_until_complete(Groups.serialize(group, depth=2))
+        self.assertEqual([ loaded["name"] for loaded in serialized["roles"] ], ["admin"])
+
+    def test_concurrent_calls(self):
+        Roles = aio.AsyncModel(Role)
+        self.run_until_complete(Roles.insert_many([ {"name": "role-{}".format(i)} for i in range(20) ]))
+
+        found = self.run_until_complete(aio.asyncio.gather(*[ Roles.first_by(name="role-{}".format(i)) for i in range(20) ]))
+        self.assertEqual([ role.name for role in found ], [ "role-{}".format(i) for i in range(20) ])
+
+
+def task_scope():
+    """
+    One session per asyncio task, as an asyncio service would configure it. Blows up off
+    of a task (ie: on a worker thread), like asyncio.current_task() does
+    """
+    current_task = getattr(aio.asyncio, "current_task", None) or aio.asyncio.Task.current_task
+    task = current_task()
+    if task is None:
+        raise RuntimeError("no running event loop")
+    return id(task)
+
+@unittest.skipIf(aio.asyncio is None, "needs asyncio (Python 3)")
+class TaskScopedTest(AsyncModelTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")), scopefunc=task_scope)
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+        self.loop = aio.asyncio.new_event_loop()
+        aio.asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        # Our scopefunc only works on a task, and reset() removes the current scope's session
+        self.run_until_complete(aio.asyncio.coroutine(hsdb.reset)())
+        self.loop.close()
+        shutil.rmtree(self.directory)
+
+    def test_serialize_loads_relationships_on_a_worker(self):
+        Groups = aio.AsyncModel(UserGroup)
+        Roles = aio.AsyncModel(Role)
+
+        group = self.run_until_complete(Groups.insert(name="administrator"))
+        role = self.run_until_complete(Roles.insert(name="admin"))
+
+        def link():
+            HomestackDatabase.get_session().execute(UserGroupToRole.insert(), {"user_group_id": group.group_id, "role_id": role.role_id})
+            UserGroup._commit()
+        self.run_until_complete(Groups.run(link))
+
+        serialized = self.run_until_complete(Groups.serialize(group, depth=2))
+        self.assertEqual([ loaded["name"] for loaded in serialized["roles"] ], ["admin"])
+
+    def test_delete(self):
+        Roles = aio.AsyncModel(Role)
+
+        role = self.run_until_complete(Roles.insert(name="admin"))
+        self.run_until_complete(Roles.delete(role))
+        self.assertEqual(self.run_until_complete(Roles.list()), [])
+
+    def test_called_from_tasks(self):
+        Roles = aio.AsyncModel(Role)
+
+        # Legacy style coroutines call through to these once they're running as a task,
+        #   where our scopefunc works
+        tasks = [ aio.asyncio.ensure_future(aio.asyncio.coroutine(functools.partial(Roles.insert, name="role-{}".format(i)))(), loop=self.loop)
+                  for i in range(5) ]
+
+        roles = self.run_until_complete(aio.asyncio.gather(*tasks))
+        self.assertEqual([ role.name for role in roles ], [ "role-{}".format(i) for i in range(5) ])
+
+if __name__ == "__main__":
+    unittest.main()
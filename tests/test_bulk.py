@@ -0,0 +1,98 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+insert_many(), upsert_many() (the generic, non-MySQL path) and transaction() blocks
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import Role
+
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # Our SQLite profile BEGINs itself, which SAVEPOINTs need (pysqlite's own transaction
+        #   handling trips over them on Python 2)
+        hsdb.configure_sqlite(os.path.join(self.directory, "hsdb.db"), readers=0)
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+    def tearDown(self):
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def names(self):
+        HomestackDatabase.remove_session()
+        return sorted(role.name for role in Role.list())
+
+    def test_insert_many(self):
+        self.assertEqual(Role.insert_many([ {"name": "role-{}".format(i)} for i in range(5) ], batch_size=2), 5)
+        self.assertEqual(self.names(), [ "role-{}".format(i) for i in range(5) ])
+
+    def test_insert_many_returns_pks(self):
+        ids = Role.insert_many([{"name": "a"}, {"name": "b"}], return_pks=True)
+        self.assertEqual([ Role.filter_by(role_id=role_id).one().name for role_id in ids ], ["a", "b"])
+
+    def test_upsert_many_without_primary_keys_inserts(self):
+        self.assertEqual(Role.upsert_many([{"name": "a"}, {"name": "b"}]), 2)
+        self.assertEqual(self.names(), ["a", "b"])
+
+    def test_upsert_many_by_primary_key(self):
+        ids = Role.insert_many([{"name": "a"}, {"name": "b"}], return_pks=True)
+
+        Role.upsert_many([{"role_id": ids[0], "name": "renamed"}, {"role_id": ids[1] + 100, "name": "c"}, {"name": "d"}])
+        self.assertEqual(self.names(), ["b", "c", "d", "renamed"])
+        self.assertEqual(Role.filter_by(role_id=ids[0]).one().name, "renamed")
+
+    def test_upsert_many_by_conflict_keys(self):
+        Role.insert_many([{"name": "a"}])
+        role_id = Role.filter_by(name="a").one().role_id
+
+        Role.upsert_many([{"name": "a"}, {"name": "b"}], conflict_keys=["name"])
+        self.assertEqual(self.names(), ["a", "b"])
+        self.assertEqual(Role.filter_by(name="a").one().role_id, role_id)
+
+    def test_transaction_commits_once(self):
+        with Role.transaction() as session:
+            Role.insert(name="a")
+            Role.insert_many([{"name": "b"}])
+
+            # _commit() is suppressed inside the block
+            self.assertTrue(session.info["transaction_depth"])
+            self.assertIn("a", [ role.name for role in session.new ])
+
+        self.assertEqual(self.names(), ["a", "b"])
+
+    def test_transaction_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with Role.transaction():
+                Role.insert(name="a")
+                raise RuntimeError("boom")
+
+        self.assertEqual(self.names(), [])
+
+    def test_nested_transaction_rolls_back_to_savepoint(self):
+        with Role.transaction():
+            Role.insert(name="outer")
+
+            with self.assertRaises(RuntimeError):
+                with Role.transaction():
+                    Role.insert(name="inner")
+                    raise RuntimeError("boom")
+
+            with Role.transaction():
+                Role.insert(name="kept")
+
+        self.assertEqual(self.names(), ["kept", "outer"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Password hashing on the credential service's worker processes
+"""
+
+import os
+import unittest
+
+from hsdb import credentials
+
+# Cheap costs, we're not testing argon2 itself
+PARAMS = {"t": 2, "m": 64, "p": 1}
+
+
+class CredentialServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = credentials.CredentialService(processes=1, params=PARAMS)
+        self.salt = os.urandom(32)
+
+    def tearDown(self):
+        self.service.close()
+
+    def test_hash_and_verify(self):
+        hashed, params = self.service.hash_password("hunter2", self.salt)
+        self.assertEqual(params, PARAMS)
+        self.assertTrue(self.service.verify("hunter2", self.salt, hashed, params))
+        self.assertFalse(self.service.verify("hunter3", self.salt, hashed, params))
+
+    def test_busy(self):
+        service = credentials.CredentialService(processes=1, max_queue=0, params=PARAMS)
+        try:
+            self.assertRaises(credentials.CredentialServiceBusy, service.hash_password, "hunter2", self.salt)
+        finally:
+            service.close()
+
+    @unittest.skipIf(credentials.asyncio is None, "needs asyncio (Python 3)")
+    def test_awaitables(self):
+        asyncio = credentials.asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        try:
+            hashed = loop.run_until_complete(self.service.hash_password_async("hunter2", self.salt))
+            self.assertEqual(hashed, self.service.hash_password("hunter2", self.salt)[0])
+            self.assertTrue(loop.run_until_complete(self.service.verify_async("hunter2", self.salt, hashed, PARAMS)))
+            self.assertFalse(loop.run_until_complete(self.service.verify_async("hunter3", self.salt, hashed, PARAMS)))
+        finally:
+            loop.close()
+
+    @unittest.skipUnless(credentials.asyncio is None, "Python 2 only")
+    def test_awaitables_need_python_3(self):
+        self.assertRaises(RuntimeError, self.service.hash_password_async, "hunter2", self.salt)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Eager loading should keep serialize() at a fixed number of queries, however many rows
+there are. Run with `python -m unittest discover` from the repo root
+"""
+
+import os
+import json
+import base64
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import event
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import User
+from hsdb import UserGroup
+from hsdb import UserGroupToRole
+from hsdb import Role
+
+
+class EagerSerializeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")))
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+        self.statements = []
+        event.listen(HomestackDatabase._engine, "before_cursor_execute", self.count)
+
+    def tearDown(self):
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def seed(self, groups):
+        """
+        Create `groups` groups with two roles each, on top of whatever's already there
+        """
+        start = UserGroup.query().count()
+        role_ids = Role.insert_many([ {"name": "role-{}-{}".format(start + i, j)} for i in range(groups) for j in range(2) ], return_pks=True)
+        group_ids = UserGroup.insert_many([ {"name": "group-{}".format(start + i)} for i in range(groups) ], return_pks=True)
+
+        HomestackDatabase._engine.execute(UserGroupToRole.insert(), [ {"user_group_id": group_id, "role_id": role_ids[2 * i + j]}
+                                                                       for i, group_id in enumerate(group_ids) for j in range(2) ])
+        HomestackDatabase.remove_session()
+
+    def serialize_all(self, **kwargs):
+        """
+        Serialize every group at depth 2 (ie: with its roles), returning how many statements
+        it took
+        """
+        HomestackDatabase.remove_session()
+        del self.statements[:]
+
+        groups = UserGroup.list(**kwargs)
+        serialized = [ group.serialize(depth=2) for group in groups ]
+        self.assertTrue(all(len(group["roles"]) == 2 for group in serialized))
+
+        return len(self.statements), len(serialized)
+
+    def test_eager_query_count_is_constant(self):
+        self.seed(10)
+        small, rows = self.serialize_all(eager=2)
+        self.assertEqual(rows, 10)
+
+        self.seed(90)
+        large, rows = self.serialize_all(eager=2)
+        self.assertEqual(rows, 100)
+
+        self.assertEqual(small, large)
+
+    def test_lazy_query_count_grows(self):
+        # Make sure we're counting what we think we are: without eager loading, it's a
+        #   query per group
+        self.seed(10)
+        small, _ = self.serialize_all()
+
+        self.seed(90)
+        large, _ = self.serialize_all()
+
+        self.assertEqual(large - small, 90)
+
+    def test_eager_relationship_names(self):
+        # Unicode names too, on Python 2
+        for eager in (["roles"], [u"roles"], [UserGroup.roles]):
+            hsdb.statement_cache.clear()
+            self.seed(10)
+            small, _ = self.serialize_all(eager=eager)
+
+            self.seed(10)
+            large, _ = self.serialize_all(eager=eager)
+
+            self.assertEqual(small, large)
+
+    def test_serialize_iter_query_count_is_constant(self):
+        def serialize_iter():
+            HomestackDatabase.remove_session()
+            del self.statements[:]
+            rows = list(UserGroup.serialize_iter(chunk_size=1000, depth=2))
+            return len(self.statements), len(rows)
+
+        self.seed(10)
+        small, rows = serialize_iter()
+        self.assertEqual(rows, 10)
+
+        self.seed(90)
+        large, rows = serialize_iter()
+        self.assertEqual(rows, 100)
+
+        self.assertEqual(small, large)
+
+    def test_json_encodes_binary_columns(self):
+        user = User.insert(username="mike")
+        salt = user.password_salt
+
+        line, = list(User.serialize_iter(json_lines=True))
+        self.assertEqual(base64.b64decode(json.loads(line)["password_salt"]), salt)
+
+        users = json.loads("".join(User.serialize_json_array(exclude=["password_salt"])))
+        self.assertEqual([ serialized["username"] for serialized in users ], ["mike"])
+        self.assertNotIn("password_salt", users[0])
+
+        # And plain dicts keep the raw bytes
+        self.assertEqual(next(User.serialize_iter())["password_salt"], salt)
+
+    def test_json_array(self):
+        self.seed(3)
+        groups = json.loads("".join(UserGroup.serialize_json_array(chunk_size=2, depth=2)))
+        self.assertEqual(sorted(group["name"] for group in groups), ["group-0", "group-1", "group-2"])
+        self.assertTrue(all(len(group["roles"]) == 2 for group in groups))
+
+
+if __name__ == "__main__":
+    unittest.main()
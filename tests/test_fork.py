@@ -0,0 +1,121 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Forked children should get a pool of their own, rather than using (or tripping over) the
+connections they inherited from their parent. Forks real processes, so POSIX only
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import Role
+
+
+def dbapi_connection():
+    """
+    Return the raw DBAPI connection behind the current scope's session
+    """
+    return HomestackDatabase.get_session().connection().connection.connection
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs os.fork()")
+class AfterForkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")), keep_alive=True)
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+        Role.insert(name="admin")
+
+    def tearDown(self):
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def fork(self, child):
+        """
+        Run `child()` in a forked process, returning whatever (JSON-able) thing it returned
+        """
+        read, write = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            os.close(read)
+            try:
+                result = {"result": child()}
+            except Exception as e:
+                result = {"error": "{}: {}".format(type(e).__name__, e)}
+            finally:
+                with os.fdopen(write, "w") as f:
+                    f.write(json.dumps(result))
+                os._exit(0)
+
+        os.close(write)
+        with os.fdopen(read) as f:
+            result = json.loads(f.read())
+        os.waitpid(pid, 0)
+
+        self.assertNotIn("error", result, result.get("error"))
+        return result["result"]
+
+    def test_child_gets_its_own_connection(self):
+        # One connection checked out by the parent's session, and one sitting in the pool
+        pooled = HomestackDatabase._engine.connect()
+        pooled_dbapi = pooled.connection.connection
+        pooled.close()
+
+        parent_dbapi = dbapi_connection()
+        self.assertIsNot(parent_dbapi, pooled_dbapi)
+
+        def child():
+            hsdb.after_fork()
+            names = [ role.name for role in Role.list() ]
+            dbapi = dbapi_connection()
+            return {
+                "names"         : names,
+                "inherited"     : dbapi is parent_dbapi or dbapi is pooled_dbapi,
+                "pid"           : HomestackDatabase.get_session().connection().connection.info["pid"],
+                "my_pid"        : os.getpid()
+            }
+
+        result = self.fork(child)
+        self.assertEqual(result["names"], ["admin"])
+        self.assertFalse(result["inherited"])
+        self.assertEqual(result["pid"], result["my_pid"])
+
+        # And the parent's connections are still good
+        self.assertIs(dbapi_connection(), parent_dbapi)
+        self.assertEqual([ role.name for role in Role.list() ], ["admin"])
+        HomestackDatabase.remove_session()
+        self.assertEqual([ role.name for role in Role.list() ], ["admin"])
+
+    def test_child_can_write(self):
+        dbapi_connection()
+
+        def child():
+            hsdb.after_fork()
+            Role.insert(name="from_child")
+            return [ role.name for role in Role.list() ]
+
+        self.assertEqual(sorted(self.fork(child)), ["admin", "from_child"])
+
+        HomestackDatabase.remove_session()
+        self.assertEqual(sorted(role.name for role in Role.list()), ["admin", "from_child"])
+
+    @unittest.skipUnless(hasattr(os, "register_at_fork"), "needs os.register_at_fork() (3.7+)")
+    def test_after_fork_runs_automatically(self):
+        parent_dbapi = dbapi_connection()
+
+        def child():
+            return dbapi_connection() is parent_dbapi
+
+        self.assertFalse(self.fork(child))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Keyset pagination, and what happens when callers hand us cursors that aren't ours
+"""
+
+import os
+import json
+import base64
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import User
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+class PaginateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")))
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+        start = datetime(2020, 1, 1)
+        User.insert_many([ {"username": "user-{}".format(i), "time": start + timedelta(minutes=i)} for i in range(7) ])
+
+    def tearDown(self):
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def test_pages(self):
+        pages = list(User.iter_pages(order_by=[User.time], limit=3))
+        self.assertEqual([ len(page.items) for page in pages ], [3, 3, 1])
+        self.assertEqual([ user.username for page in pages for user in page.items ], [ "user-{}".format(i) for i in range(7) ])
+        self.assertIsNone(pages[-1].next_cursor)
+
+    def test_descending(self):
+        page = User.paginate(order_by=[User.time], limit=3, desc=True)
+        page = User.paginate(order_by=[User.time], after=page.next_cursor, limit=3, desc=True)
+        self.assertEqual([ user.username for user in page.items ], ["user-3", "user-2", "user-1"])
+
+    def test_malformed_cursors(self):
+        malformed = [
+            "not base64!",
+            base64.urlsafe_b64encode(b"not json").decode("ascii"),
+            base64.urlsafe_b64encode(b"\xff\xfe").decode("ascii"),
+            cursor(5),
+            cursor({"dt": "2020-01-01T00:00:00"}),
+            cursor([1]),
+            cursor(["2020-01-01T00:00:00", 1, 2]),
+            cursor([{}, 1]),
+            cursor([{"when": "2020-01-01T00:00:00"}, 1]),
+            cursor([{"dt": "2020-01-01T00:00:00", "extra": 1}, 1]),
+            cursor([{"dt": 5}, 1]),
+            cursor([{"dt": "yesterday"}, 1]),
+            cursor([[1], 1])
+        ]
+
+        for after in malformed:
+            self.assertRaises(ValueError, User.paginate, order_by=[User.time], after=after)
+
+
+if __name__ == "__main__":
+    unittest.main()
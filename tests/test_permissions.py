@@ -0,0 +1,84 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Cached permission sets, and what does (and doesn't) invalidate them
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import User
+from hsdb import UserGroup
+from hsdb import UserToUserGroup
+from hsdb import UserGroupToRole
+from hsdb import Role
+
+
+class PermissionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")))
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+        User.permission_cache.clear()
+
+        self.user = User.insert(username="mike")
+        self.group = UserGroup.insert(name="user")
+        self.role = Role.insert(name="hue_ro")
+        engine = HomestackDatabase._engine
+        engine.execute(UserToUserGroup.insert(), user_id=self.user.user_id, user_group_id=self.group.group_id)
+        engine.execute(UserGroupToRole.insert(), user_group_id=self.group.group_id, role_id=self.role.role_id)
+
+    def tearDown(self):
+        User.permission_cache.clear()
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def test_permissions(self):
+        self.assertTrue(self.user.has_role("hue_ro"))
+        self.assertTrue(self.user.in_group("user"))
+        self.assertFalse(self.user.has_role("admin"))
+
+    def test_logins_keep_the_cache(self):
+        self.user.has_role("hue_ro")
+        self.assertEqual(len(User.permission_cache), 1)
+
+        self.user.timestamp = datetime.utcnow()
+        User._commit()
+        User.insert(username="someone_else")
+
+        self.assertEqual(len(User.permission_cache), 1)
+
+    def test_role_changes_clear_the_cache(self):
+        self.assertTrue(self.user.has_role("hue_ro"))
+
+        self.role.name = "hue_rw"
+        Role._commit()
+
+        self.assertFalse(self.user.has_role("hue_ro"))
+        self.assertTrue(self.user.has_role("hue_rw"))
+
+    def test_membership_changes_clear_the_cache(self):
+        self.assertTrue(self.user.in_group("user"))
+
+        HomestackDatabase._engine.execute(UserToUserGroup.delete())
+
+        self.assertFalse(self.user.in_group("user"))
+
+    def test_deleting_users_clears_the_cache(self):
+        self.user.has_role("hue_ro")
+        User.query().filter_by(username="mike").delete()
+        User._commit()
+
+        self.assertEqual(len(User.permission_cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Prepared statements: filter_by() / list() running from the statement cache, and chaining
+anything else onto them
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.orm import Query
+from sqlalchemy.orm import selectinload
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import User
+from hsdb import UserGroup
+from hsdb import Role
+from hsdb.hsdb import PreparedQuery
+
+
+class PreparedQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")))
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+        hsdb.statement_cache.resize(500)
+
+        Role.insert_many([{"name": "a"}, {"name": "b"}, {"name": "c"}])
+
+    def tearDown(self):
+        hsdb.statement_cache.resize(500)
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def test_prepared_methods(self):
+        query = Role.filter_by(name="a")
+        self.assertIsInstance(query, PreparedQuery)
+
+        self.assertEqual([ role.name for role in query.all() ], ["a"])
+        self.assertEqual([ role.name for role in query ], ["a"])
+        self.assertEqual(query.first().name, "a")
+        self.assertEqual(query.one().name, "a")
+        self.assertEqual(query.count(), 1)
+        self.assertIsNone(Role.filter_by(name="nope").first())
+
+        hits = hsdb.statement_cache.stats()["hits"]
+        Role.filter_by(name="b").all()
+        self.assertEqual(hsdb.statement_cache.stats()["hits"], hits + 1)
+
+    def test_chaining_keeps_the_criteria(self):
+        chained = Role.filter_by(name="a").filter(Role.name == "zzz")
+        self.assertIsInstance(chained, Query)
+        self.assertNotIsInstance(chained, PreparedQuery)
+        self.assertEqual(chained.all(), [])
+
+        self.assertEqual(Role.filter_by(name="a").filter_by(role_id=999).all(), [])
+        self.assertEqual(Role.filter_by(name="a").filter_by(role_id=999).count(), 0)
+        self.assertEqual(Role.filter_by(name="a").filter_by(role_id=999).first(), None)
+
+    def test_query_methods(self):
+        self.assertEqual(Role.filter_by(name="a")[0].name, "a")
+        self.assertEqual([ role.name for role in Role.filter_by(name="a")[:5] ], ["a"])
+        self.assertEqual([ role.name for role in Role.list() ], ["a", "b", "c"])
+        self.assertEqual([ role.name for role in Role.filter_by().order_by(Role.name.desc()).limit(2) ], ["c", "b"])
+        self.assertIn("WHERE", str(Role.filter_by(name="a")))
+
+        self.assertEqual(Role.filter_by(name="a").delete(), 1)
+        Role._commit()
+        self.assertEqual(sorted(role.name for role in Role.list()), ["b", "c"])
+
+    def test_loader_options_arent_prepared(self):
+        shapes = len(hsdb.statement_cache.shapes)
+
+        for i in range(20):
+            groups = UserGroup.filter_by(name="x", eager=[selectinload(UserGroup.roles)])
+            self.assertNotIsInstance(groups, PreparedQuery)
+            self.assertEqual(groups.all(), [])
+
+        self.assertEqual(len(hsdb.statement_cache.shapes), shapes)
+
+        # Names and attributes are
+        self.assertIsInstance(UserGroup.filter_by(name="x", eager=["roles"]), PreparedQuery)
+        self.assertIsInstance(UserGroup.filter_by(name="x", eager=[UserGroup.roles]), PreparedQuery)
+        self.assertIsInstance(UserGroup.filter_by(name="x", eager=2), PreparedQuery)
+
+    def test_shapes_are_bounded(self):
+        hsdb.statement_cache.resize(3)
+
+        for model, key, value in [(Role, "name", "a"), (Role, "role_id", 1), (UserGroup, "name", "x"),
+                                  (UserGroup, "group_id", 1), (User, "username", "mike"), (User, "user_id", 1)]:
+            model.filter_by(**{key: value}).all()
+
+        self.assertEqual(len(hsdb.statement_cache.shapes), 3)
+        self.assertEqual(Role.filter_by(name="a").first().name, "a")
+
+    def test_disabled(self):
+        hsdb.statement_cache.resize(0)
+        self.assertNotIsInstance(Role.filter_by(name="a"), PreparedQuery)
+        self.assertEqual(Role.filter_by(name="a").one().name, "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
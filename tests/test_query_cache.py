@@ -0,0 +1,72 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+The opt in second-level query cache, and models opting in (and out) at runtime
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import Role
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")))
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+        hsdb.query_cache.clear()
+
+        # Something's been written before anybody opts in
+        Role.insert(name="admin")
+
+    def tearDown(self):
+        Role.__query_cache__ = False
+        hsdb.query_cache.clear()
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def names(self):
+        HomestackDatabase.remove_session()
+        return sorted(role.name for role in Role.list())
+
+    def hits(self):
+        return hsdb.query_cache.stats()["hits"]
+
+    def test_off_by_default(self):
+        hits = self.hits()
+        self.names()
+        self.names()
+        self.assertEqual(self.hits(), hits)
+
+    def test_opting_in_at_runtime(self):
+        Role.__query_cache__ = True
+
+        hits = self.hits()
+        self.assertEqual(self.names(), ["admin"])
+        self.assertEqual(self.names(), ["admin"])
+        self.assertEqual(self.hits(), hits + 1)
+
+        Role.insert(name="user")
+        self.assertEqual(self.names(), ["admin", "user"])
+
+    def test_opting_back_out(self):
+        Role.__query_cache__ = True
+        self.names()
+
+        Role.__query_cache__ = False
+        Role.insert(name="user")
+
+        Role.__query_cache__ = True
+        self.assertEqual(self.names(), ["admin", "user"])
+
+
+if __name__ == "__main__":
+    unittest.main()
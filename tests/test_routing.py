@@ -0,0 +1,157 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Read/write routing, with a SQLite file standing in for the primary and each replica, and
+our embedded SQLite profile (configure_sqlite())
+"""
+
+import os
+import time
+import shutil
+import threading
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import Role
+from hsdb.hsdb import RoutingSession
+
+
+class RoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        # Each database gets a role named after it, so reads tell us where they went
+        self.urls = {}
+        for name in ("primary", "replica-1", "replica-2"):
+            url = self.urls[name] = "sqlite:///{}".format(os.path.join(self.directory, "{}.db".format(name)))
+            engine = create_engine(url)
+            HomestackDatabase._base.metadata.create_all(bind=engine)
+            engine.execute(Role.__table__.insert(), name=name)
+            engine.dispose()
+
+    def tearDown(self):
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def configure(self, **kwargs):
+        hsdb.configure(url=self.urls["primary"], replicas=[self.urls["replica-1"], self.urls["replica-2"]], **kwargs)
+
+    def read(self):
+        """
+        Return the names of the roles, from wherever a fresh session's read gets sent
+        """
+        HomestackDatabase.remove_session()
+        return sorted(role.name for role in Role.list())
+
+    def test_round_robin(self):
+        self.configure()
+        self.assertIsInstance(HomestackDatabase.get_session(), RoutingSession)
+
+        reads = [ self.read() for i in range(4) ]
+        self.assertEqual(sorted(reads), [["replica-1"], ["replica-1"], ["replica-2"], ["replica-2"]])
+        self.assertNotEqual(reads[0], reads[1])
+
+    def test_least_loaded(self):
+        # SQLAlchemy doesn't pool connections to SQLite files by default, so there'd be
+        #   nothing to count
+        self.configure(replica_strategy="least_loaded", poolclass=QueuePool)
+
+        busy = hsdb.hsdb.get_replicas()[0].connect()
+        try:
+            self.assertEqual([ self.read() for i in range(3) ], [["replica-2"]] * 3)
+        finally:
+            busy.close()
+
+    def test_writes_go_to_the_primary(self):
+        self.configure(sticky_window=0)
+
+        Role.insert(name="written")
+        self.assertIn(self.read(), [["replica-1"], ["replica-2"]])
+
+        with Role.use_primary():
+            self.assertEqual(sorted(role.name for role in Role.list()), ["primary", "written"])
+
+    def test_read_your_writes(self):
+        self.configure(sticky_window=0.5)
+
+        Role.insert(name="written")
+        self.assertEqual(self.read(), ["primary", "written"])
+
+        # Only for the scope that wrote
+        other = []
+        reader = threading.Thread(target=lambda: other.append(self.read()))
+        reader.start()
+        reader.join()
+        self.assertIn(other[0], [["replica-1"], ["replica-2"]])
+
+        time.sleep(0.6)
+        self.assertIn(self.read(), [["replica-1"], ["replica-2"]])
+
+    def test_transactions_read_from_the_primary(self):
+        self.configure(sticky_window=0)
+
+        HomestackDatabase.remove_session()
+        with Role.transaction():
+            self.assertEqual([ role.name for role in Role.list() ], ["primary"])
+
+    def test_locking_reads_go_to_the_primary(self):
+        self.configure(sticky_window=0)
+
+        HomestackDatabase.remove_session()
+        self.assertEqual([ role.name for role in Role.query().with_for_update() ], ["primary"])
+
+    def test_no_replicas(self):
+        hsdb.configure(url=self.urls["primary"])
+        self.assertNotIsInstance(HomestackDatabase.get_session(), RoutingSession)
+        self.assertEqual([ self.read() for i in range(2) ], [["primary"]] * 2)
+
+
+class SqliteProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "hsdb.db")
+
+    def tearDown(self):
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def test_readers_and_writer(self):
+        hsdb.configure_sqlite(self.path, readers=2)
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+        engine = HomestackDatabase._engine
+        readers, = hsdb.hsdb.get_replicas()
+        self.assertEqual(engine.execute("PRAGMA journal_mode").scalar().lower(), "wal")
+        self.assertEqual(engine.execute("PRAGMA foreign_keys").scalar(), 1)
+
+        Role.insert(name="admin")
+        HomestackDatabase.remove_session()
+        self.assertEqual([ role.name for role in Role.list() ], ["admin"])
+
+        # Readers are query only
+        self.assertRaises(exc.OperationalError, readers.execute, Role.__table__.insert(), name="nope")
+
+    def test_no_readers(self):
+        hsdb.configure_sqlite(self.path, readers=0, pragmas={"mmap_size": None})
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+
+        self.assertEqual(hsdb.hsdb.get_replicas(), [])
+        self.assertEqual(HomestackDatabase._engine.execute("PRAGMA mmap_size").scalar(), 0)
+
+        Role.insert(name="admin")
+        self.assertEqual([ role.name for role in Role.list() ], ["admin"])
+
+
+if __name__ == "__main__":
+    unittest.main()
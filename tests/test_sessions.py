@@ -0,0 +1,87 @@
+#! /usr/bin/env python2.7
+# -*- coding: latin-1 -*-
+
+"""
+Session lifetime limits for long-running workers
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import hsdb
+from hsdb import HomestackDatabase
+from hsdb import Role
+
+
+class SessionLimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        hsdb.configure(url="sqlite:///{}".format(os.path.join(self.directory, "hsdb.db")))
+        HomestackDatabase._base.metadata.create_all(bind=HomestackDatabase._engine)
+        Role.insert_many([ {"name": "role-{}".format(i)} for i in range(20) ])
+        HomestackDatabase.remove_session()
+
+    def tearDown(self):
+        hsdb.limit_sessions()
+        HomestackDatabase.remove_session()
+        hsdb.reset()
+        shutil.rmtree(self.directory)
+
+    def job(self, i):
+        """
+        A unit of work that loads a role, and commits when it's done
+        """
+        role = Role.filter_by(name="role-{}".format(i)).first()
+        HomestackDatabase.get_session().commit()
+        return role
+
+    def test_max_operations_recycles_with_objects_held(self):
+        hsdb.limit_sessions(max_operations=3)
+        recycles = HomestackDatabase.session_stats()["recycles"]
+
+        held = [ self.job(i) for i in range(13) ]
+
+        self.assertGreater(HomestackDatabase.session_stats()["recycles"], recycles)
+        self.assertLess(HomestackDatabase.session_stats()["objects"], len(held))
+
+    def test_max_objects_bounds_the_identity_map(self):
+        hsdb.limit_sessions(max_objects=5)
+
+        held = [ self.job(i) for i in range(20) ]
+
+        self.assertEqual(len(held), 20)
+        self.assertLessEqual(HomestackDatabase.session_stats()["objects"], 5)
+
+    def test_never_inside_a_transaction(self):
+        hsdb.limit_sessions(max_operations=1)
+        session = HomestackDatabase.get_session()
+
+        role = Role.filter_by(name="role-0").first()
+        for i in range(5):
+            Role.filter_by(name="role-{}".format(i)).first()
+
+        # Still open, so still the same session holding the same objects
+        self.assertIn(role, HomestackDatabase.get_session())
+        self.assertIs(HomestackDatabase.get_session(), session)
+
+    def test_never_with_unflushed_changes(self):
+        hsdb.limit_sessions(max_operations=1)
+
+        with Role.transaction():
+            Role.insert(name="staged")
+            for i in range(5):
+                HomestackDatabase.get_session()
+
+        self.assertEqual(Role.filter_by(name="staged").count(), 1)
+
+    def test_off(self):
+        recycles = HomestackDatabase.session_stats()["recycles"]
+        [ self.job(i) for i in range(10) ]
+        self.assertEqual(HomestackDatabase.session_stats()["recycles"], recycles)
+
+
+if __name__ == "__main__":
+    unittest.main()